@@ -0,0 +1,247 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+from phylorank.rel_dist import RelativeDistance
+
+from numpy import (zeros as np_zeros,
+                   full as np_full,
+                   concatenate as np_concatenate,
+                   where as np_where,
+                   nan as np_nan,
+                   errstate as np_errstate)
+
+
+class AllRootings():
+    """Relative divergence of nodes under alternative rootings of a tree.
+
+    The input tree is treated as unrooted, i.e. a root with two children
+    is suppressed and its two edges merged, which is how the tree would
+    look after being rerooted with Dendropy. Rerooting on an edge places
+    the new root at the midpoint of the edge.
+
+    The mean distance from each node to its extant taxa is computed once
+    for the subtree below the node (down pass) and once for the rest of
+    the tree viewed from the node's parent (up pass). Together these give
+    the mean distance to tips of every node under any rooting, so the
+    relative divergence of all nodes for a given rooting is obtained in
+    a single top-down sweep without copying or rerooting the tree.
+    """
+
+    def __init__(self, tree):
+        """Initialization.
+
+        Parameters
+        ----------
+        tree : CompactTree
+            Phylogenetic tree.
+        """
+
+        self.tree = tree
+
+        RelativeDistance().decorate_rel_dist(tree)
+
+        self.root_suppressed = (len(tree.children(0)) == 2)
+        self._up_pass()
+
+    def _up_pass(self):
+        """Calculate mean distance to tips of the tree above each node.
+
+        For a node c with parent p, the following are determined for the
+        subtree obtained by making p a child of c:
+          up_num_taxa: number of terminal taxa
+          up_mean_dist: mean distance to tips
+          up_edge_length: length of edge between c and this subtree
+        """
+
+        tree = self.tree
+
+        num_taxa = tree.num_taxa.tolist()
+        mean_dist = tree.mean_dist.tolist()
+        edge_length = tree.edge_length.tolist()
+
+        total_taxa = num_taxa[0]
+        up_num_taxa = [total_taxa - n for n in num_taxa]
+        up_mean_dist = [0.0] * tree.num_nodes
+        up_edge_length = list(edge_length)
+
+        # processing nodes in preorder ensures the values
+        # for a parent are known before its children
+        for p in range(tree.num_nodes):
+            if tree.is_leaf[p]:
+                continue
+
+            children = tree.children(p).tolist()
+            if p == 0 and self.root_suppressed:
+                # root is removed when the tree is rerooted so
+                # its children are joined by a single edge
+                c1, c2 = children
+                up_mean_dist[c1] = mean_dist[c2]
+                up_mean_dist[c2] = mean_dist[c1]
+                up_edge_length[c1] = up_edge_length[c2] = edge_length[c1] + edge_length[c2]
+                continue
+
+            for c in children:
+                n = up_num_taxa[c]
+                if n == 0:
+                    continue
+
+                # Dendropy places the original parent of a node after
+                # its remaining children when a tree is rerooted
+                avg_div = 0
+                for s in children:
+                    if s != c:
+                        avg_div += (float(num_taxa[s]) / n) * (mean_dist[s] + edge_length[s])
+                if p != 0:
+                    avg_div += (float(up_num_taxa[p]) / n) * (up_mean_dist[p] + up_edge_length[p])
+
+                up_mean_dist[c] = avg_div
+
+        self.up_num_taxa = up_num_taxa
+        self.up_mean_dist = up_mean_dist
+        self.up_edge_length = up_edge_length
+
+    def _node_rel_dist(self, x, a, b, is_leaf):
+        """Relative divergence of node given relative divergence of parent."""
+
+        if is_leaf:
+            return 1.0
+
+        if (a + b) != 0:
+            return x + (a / (a + b)) * (1.0 - x)
+
+        # internal node has zero length to parent,
+        # so should have the same relative distance
+        # as the parent node
+        return x
+
+    def rel_dist(self, node):
+        """Calculate relative divergence of all nodes when rooted on edge above node.
+
+        Parameters
+        ----------
+        node : int
+            Index of node defining edge to root on.
+
+        Returns
+        -------
+        ndarray
+            Relative divergence of each node; NaN for the root
+            if it is removed by the rerooting.
+        """
+
+        tree = self.tree
+
+        rel_dist = np_full(tree.num_nodes, np_nan)
+        fixed = np_zeros(tree.num_nodes, dtype=bool)
+
+        # new root splits the edge in half
+        half_edge = 0.5 * self.up_edge_length[node]
+        rel_dist[node] = self._node_rel_dist(0.0, half_edge, tree.mean_dist[node], tree.is_leaf[node])
+        fixed[node] = True
+
+        # nodes on the path from the new root to the original
+        # root have their parent-child relationship inverted
+        x = 0.0
+        a = half_edge
+        b = self.up_mean_dist[node]
+        child = node
+        p = tree.parent[node]
+        while p != -1:
+            if p == 0 and self.root_suppressed:
+                sibling = [c for c in tree.children(0) if c != child][0]
+                rel_dist[sibling] = self._node_rel_dist(x, a, b, tree.is_leaf[sibling])
+                fixed[sibling] = True
+                break
+
+            rel_dist[p] = self._node_rel_dist(x, a, b, False)
+            fixed[p] = True
+
+            x = rel_dist[p]
+            a = self.up_edge_length[p]
+            b = self.up_mean_dist[p]
+            child = p
+            p = tree.parent[p]
+
+        # all other nodes retain their original parent
+        for nodes in tree.levels[1:]:
+            a = tree.edge_length[nodes]
+            b = tree.mean_dist[nodes]
+            x = rel_dist[tree.parent[nodes]]
+
+            with np_errstate(divide='ignore', invalid='ignore'):
+                level_rel_dist = np_where((a + b) != 0, x + (a / (a + b)) * (1.0 - x), x)
+            level_rel_dist[tree.is_leaf[nodes]] = 1.0
+
+            rel_dist[nodes] = np_where(fixed[nodes], rel_dist[nodes], level_rel_dist)
+
+        return rel_dist
+
+    def root_children(self, node):
+        """Get children of the new root when rooted on edge above node.
+
+        Parameters
+        ----------
+        node : int
+            Index of node defining edge to root on.
+
+        Returns
+        -------
+        int
+            Index of node.
+        int
+            Index of node on the other side of the edge.
+        """
+
+        tree = self.tree
+
+        p = tree.parent[node]
+        if p == 0 and self.root_suppressed:
+            p = [c for c in tree.children(0) if c != node][0]
+
+        return node, p
+
+    def ingroup_nodes(self, node, outgroup_below):
+        """Get nodes on the ingroup side of a rooting.
+
+        Parameters
+        ----------
+        node : int
+            Index of node defining edge rooted on.
+        outgroup_below : boolean
+            Flag indicating if the outgroup is below the node.
+
+        Returns
+        -------
+        ndarray
+            Indices of nodes in the ingroup in preorder.
+        """
+
+        # the original root is included on the side above
+        # the node unless it is removed by the rerooting
+
+        tree = self.tree
+
+        start = node
+        end = node + tree.subtree_size[node]
+        if not outgroup_below:
+            return tree.preorder[start:end]
+
+        ingroup = np_concatenate((tree.preorder[0:start], tree.preorder[end:]))
+        if self.root_suppressed:
+            ingroup = ingroup[1:]
+
+        return ingroup
@@ -20,14 +20,19 @@ import sys
 import logging
 from collections import defaultdict, namedtuple
 
-from phylorank.newick import parse_label
-from phylorank.common import (get_phyla_lineages, filter_taxa_for_dist_inference)
+from phylorank.newick import parse_taxon_label
+from phylorank.common import (get_phyla_lineages,
+                              get_left_right_taxa,
+                              filter_taxa_for_dist_inference,
+                              read_tree)
 
 from biolib.taxonomy import Taxonomy
 
-import dendropy
 
 from numpy import (mean as np_mean,
+                   asarray as np_asarray,
+                   sort as np_sort,
+                   searchsorted as np_searchsorted,
                    std as np_std,
                    arange as np_arange,
                    percentile as np_percentile)
@@ -40,43 +45,149 @@ class BranchLengthDistribution():
         """Initialize."""
         self.logger = logging.getLogger()
         
-    def _dist_to_ancestor(self, child, ancestor):
-        """Calculate distance from child node to ancestor node."""
-        
-        d = 0.0
-        cur_node = child
-        while cur_node != ancestor:
-            d += cur_node.edge.length
-            cur_node = cur_node.parent_node
-        
-        return d
-        
-    def _ancestor_multiple_taxa_at_rank(self, node, rank_prefix):
-        """Find first ancestor that contains multiple named lineages at the specified rank."""
+    def _decorate_mdtt(self, tree):
+        """Calculate mean distance to tips (MDTT) for each node.
+
+        The summed distance from a node to its descendant leaves
+        is obtained from the summed distances of its children,
+        so the MDTT of all nodes is found in a single postorder
+        traversal.
+
+        Parameters
+        ----------
+        tree : Dendropy Tree
+            Phylogenetic tree.
+
+        Returns
+        -------
+        The following attributes are added to each node:
+          depth: distance from root
+          num_taxa: number of terminal taxa
+          mdtt: mean distance to tips
+        """
+
+        for node in tree.preorder_node_iter():
+            if node.parent_node is None:
+                node.depth = 0.0
+            else:
+                node.depth = node.parent_node.depth + node.edge_length
+
+        dist_to_tips = {}
+        for node in tree.postorder_node_iter():
+            if node.is_leaf():
+                node.num_taxa = 1
+                dist_to_tips[node] = 0.0
+            else:
+                children = node.child_nodes()
+                node.num_taxa = sum([c.num_taxa for c in children])
+                dist_to_tips[node] = sum([dist_to_tips[c] + c.num_taxa * c.edge_length for c in children])
+
+            node.mdtt = dist_to_tips[node] / node.num_taxa
+
+    def _taxa_at_rank_count(self, tree, rank_prefix):
+        """Count taxa at the specified rank within the lineage of each node.
+
+        Parameters
+        ----------
+        tree : Dendropy Tree
+            Phylogenetic tree.
+        rank_prefix : str
+            Prefix of taxa at rank of interest.
+
+        Returns
+        -------
+        d[node] -> int
+            Number of taxon labels at the specified rank on the node and its descendants.
+        """
+
+        taxa_count = {}
+        for node in tree.postorder_node_iter():
+            count = 0
+            for taxon in parse_taxon_label(node.label).taxa:
+                if taxon.startswith(rank_prefix):
+                    count += 1
+
+            for c in node.child_node_iter():
+                count += taxa_count[c]
+
+            taxa_count[node] = count
+
+        return taxa_count
+
+    def _ancestor_multiple_taxa_at_rank(self, node, taxa_at_rank_count):
+        """Find first ancestor that contains multiple named lineages at the specified rank.
+
+        Parameters
+        ----------
+        node : Node
+            Node of interest.
+        taxa_at_rank_count : d[node] -> int
+            Number of taxon labels at rank of interest within the lineage of each node.
+        """
         
         parent = node.parent_node
-        while True:
-            taxa = []
-            
-            for node in parent.levelorder_iter():
-                if node.label:
-                    support, taxon_name, _auxiliary_info = parse_label(node.label)
-                    
-                    if taxon_name:
-                        for taxon in [x.strip() for x in taxon_name.split(';')]:
-                            if taxon.startswith(rank_prefix):
-                                taxa.append(taxon)
-                            
-                if len(taxa) >= 2:
-                    break
-                    
-            if len(taxa) >= 2:
-                break  
-        
+        while taxa_at_rank_count[parent] < 2:
             parent = parent.parent_node
             
         return parent
+
+    def _interval_counts(self, start, end, thresholds):
+        """Count number of half-open intervals [start, end) containing each threshold.
+
+        Parameters
+        ----------
+        start : array_like
+            Start of each interval.
+        end : array_like
+            End of each interval.
+        thresholds : array_like
+            Values to evaluate.
+
+        Returns
+        -------
+        ndarray
+            Number of intervals containing each threshold.
+        """
+
+        start = np_asarray(start, dtype=float)
+        end = np_asarray(end, dtype=float)
+
+        # empty intervals do not contain any values
+        nonempty = start < end
+        start = np_sort(start[nonempty])
+        end = np_sort(end[nonempty])
+
+        return (np_searchsorted(start, thresholds, side='right')
+                - np_searchsorted(end, thresholds, side='right'))
     
+    def _lineage_intervals(self, tree):
+        """Determine mean branch length thresholds at which each node defines a lineage.
+
+        A node defines a lineage for thresholds in the half-open
+        interval [MDTT, lowest MDTT of its ancestors).
+
+        Parameters
+        ----------
+        tree : dendropy Tree
+            Input tree decorated with the MDTT of each node.
+
+        Returns
+        -------
+        list of (Node, float, float)
+            Each node in preorder with the start and end of its interval.
+        """
+
+        intervals = []
+        ancestor_mdtt = {tree.seed_node: float('inf')}
+        for node in tree.preorder_node_iter():
+            intervals.append((node, node.mdtt, ancestor_mdtt[node]))
+
+            child_ancestor_mdtt = min(ancestor_mdtt[node], node.mdtt)
+            for c in node.child_node_iter():
+                ancestor_mdtt[c] = child_ancestor_mdtt
+
+        return intervals
+
     def optimal(self, input_tree, 
                         rank,
                         min_dist, 
@@ -97,16 +208,16 @@ class BranchLengthDistribution():
     
         # read tree
         self.logger.info('Reading tree.')
-        tree = dendropy.Tree.get_from_path(input_tree,
-                                            schema='newick',
-                                            rooting='force-rooted',
-                                            preserve_underscores=True)
+        tree = read_tree(input_tree)
         
         # get mean distance to terminal taxa for each node along with
         # other stats needed to determine classification
         self.logger.info('Determining MDTT for each node.')
+        self._decorate_mdtt(tree)
         rank_prefix = Taxonomy.rank_prefixes[rank]
         child_rank_prefix = Taxonomy.rank_prefixes[rank+1]
+        taxa_at_rank_count = self._taxa_at_rank_count(tree, rank_prefix)
+        taxa_at_child_rank_count = self._taxa_at_rank_count(tree, child_rank_prefix)
         rank_info = []
         rank_dists = set()                                
         for node in tree.seed_node.preorder_internal_node_iter():
@@ -115,49 +226,23 @@ class BranchLengthDistribution():
                 
             # check if node is at the specified rank
             node_taxon = None
-            if node.label:
-                support, taxon_name, _auxiliary_info = parse_label(node.label)
-                
-                if taxon_name:
-                    for taxon in [x.strip() for x in taxon_name.split(';')]:
-                        if taxon.startswith(rank_prefix):
-                            node_taxon = taxon
+            for taxon in parse_taxon_label(node.label).taxa:
+                if taxon.startswith(rank_prefix):
+                    node_taxon = taxon
                         
             if not node_taxon:
                 continue
                 
             # check that node has two descendants at the next rank
-            child_rank_taxa = []
-            for c in node.levelorder_iter():
-                if c.label:
-                    support, taxon_name, _auxiliary_info = parse_label(c.label)
-                    
-                    if taxon_name:
-                        for taxon in [x.strip() for x in taxon_name.split(';')]:
-                            if taxon.startswith(child_rank_prefix):
-                                child_rank_taxa.append(taxon)
-                            
-                if len(child_rank_taxa) >= 2:
-                    break
-                    
-            if len(child_rank_taxa) < 2:
+            if taxa_at_child_rank_count[node] < 2:
                 continue
                 
             # get mean branch length to terminal taxa
-            dists_to_tips = []
-            for t in node.leaf_iter():
-                dists_to_tips.append(self._dist_to_ancestor(t, node))
-                
-            node_dist = np_mean(dists_to_tips)
+            node_dist = node.mdtt
             
             # get mean branch length to terminal taxa for first ancestor spanning multiple phyla
-            ancestor = self._ancestor_multiple_taxa_at_rank(node, rank_prefix)
-            
-            ancestor_dists_to_tips = []
-            for t in ancestor.leaf_iter():
-                ancestor_dists_to_tips.append(self._dist_to_ancestor(t, ancestor))
-                
-            ancestor_dist = np_mean(ancestor_dists_to_tips)
+            ancestor = self._ancestor_multiple_taxa_at_rank(node, taxa_at_rank_count)
+            ancestor_dist = ancestor.mdtt
                     
             rank_info.append([node_dist, ancestor_dist, node_taxon])
             rank_dists.add(node_dist)
@@ -181,34 +266,33 @@ class BranchLengthDistribution():
         top_precision = 0
         for d in np_arange(min_dist, max_dist+step_size, step_size):
             rank_dists.add(d)
-            
-        for dist_threshold in sorted(rank_dists, reverse=True):
-            correct = 0
-            incorrect = 0
-            for node_dist, ancestor_dist, node_taxon in rank_info:
-                # check if node/edge would be collapsed at the given threshold
-                if node_dist <= dist_threshold and ancestor_dist > dist_threshold:
-                    correct += 1
-                elif node_dist > dist_threshold:
-                    incorrect += 1
-                else:
-                    incorrect += 1 # above ancestor with multiple taxa
+
+        # a taxon is correct if its node would be collapsed at a
+        # threshold while its first ancestor spanning multiple taxa
+        # would not, i.e. the threshold is in [node MDTT, ancestor MDTT)
+        thresholds = sorted(rank_dists, reverse=True)
+        correct_counts = self._interval_counts([node_dist for node_dist, _, _ in rank_info],
+                                                [ancestor_dist for _, ancestor_dist, _ in rank_info],
+                                                thresholds)
+        num_lineages, num_terminal_lineages = self._num_lineages(tree, thresholds)
+
+        for i, dist_threshold in enumerate(thresholds):
+            correct = int(correct_counts[i])
+            incorrect = len(rank_info) - correct
          
             denominator = correct + incorrect
             if denominator:
                 precision = float(correct) / denominator
             else:
                 precision = 0
-                
-            num_lineages, num_terminal_lineages = self._num_lineages(tree, dist_threshold)
                     
             row = '%f\t%d\t%d\t%.3f\t%d\t%d\t%d' % (dist_threshold, 
                                                             correct, 
                                                             incorrect, 
                                                             precision,
-                                                            num_lineages + num_terminal_lineages,
-                                                            num_lineages, 
-                                                            num_terminal_lineages)
+                                                            num_lineages[i] + num_terminal_lineages[i],
+                                                            num_lineages[i], 
+                                                            num_terminal_lineages[i])
                                                             
             fout.write(row + '\n')
             print(row)
@@ -221,48 +305,45 @@ class BranchLengthDistribution():
                 
         return top_threshold, top_correct, top_incorrect
         
-    def _num_lineages(self, tree, threshold):
-        """Produce table with number of lineage for increasing mean branch lengths
+    def _num_lineages(self, tree, thresholds):
+        """Determine number of lineages defined by each mean branch length threshold.
+
+        Lineages are the nodes with a MDTT at or below the threshold
+        whose ancestors are all above the threshold, along with leaf
+        nodes whose ancestors are all above the threshold. A node
+        therefore defines a lineage for thresholds in the interval
+        [MDTT, lowest MDTT of its ancestors), so the number of lineages
+        for all thresholds is determined in a single sweep over the
+        sorted interval boundaries.
 
         Parameters
         ----------
         tree : dendropy Tree
-            Input tree.
-        threshold : float
+            Input tree decorated with the MDTT of each node.
+        thresholds : iterable
             Mean distance to terminal taxa used to define lineages.
             
         Returns
         -------
-        int
-            Number of lineages with multiple taxa.
-        int 
-            Number of lineage represented by single leaf node.
+        ndarray
+            Number of lineages with multiple taxa for each threshold.
+        ndarray
+            Number of lineage represented by single leaf node for each threshold.
         """
-        
-        stack = [tree.seed_node]
-        num_lineages = 0
-        num_terminal_lineages = 0
-        while stack:
-            node = stack.pop()
-            
-            # check if node is a leaf
+
+        internal_start = []
+        internal_end = []
+        leaf_end = []
+        for node, start, end in self._lineage_intervals(tree):
             if node.is_leaf():
-                num_terminal_lineages += 1
-                continue
-                                
-            # check if node meets mean branch length criterion
-            dists_to_tips = []
-            for t in node.leaf_iter():
-                dists_to_tips.append(self._dist_to_ancestor(t, node))
-                
-            if np_mean(dists_to_tips) > threshold:
-                for c in node.child_node_iter():
-                    stack.append(c)
-                continue
-                
-            num_lineages += 1
+                leaf_end.append(end)
+            else:
+                internal_start.append(start)
+                internal_end.append(end)
+
+        num_lineages = self._interval_counts(internal_start, internal_end, thresholds)
+        num_terminal_lineages = self._interval_counts([float('-inf')] * len(leaf_end), leaf_end, thresholds)
 
-            
         return num_lineages, num_terminal_lineages
             
     def table(self, input_tree, taxon_category_file, bl_step_size, output_table):
@@ -287,47 +368,48 @@ class BranchLengthDistribution():
             taxon_category[line_split[0]] = line_split[1]
 
         # read tree
-        tree = dendropy.Tree.get_from_path(input_tree,
-                                            schema='newick',
-                                            rooting='force-rooted',
-                                            preserve_underscores=True)
+        tree = read_tree(input_tree)
         
-        # determine mean distance to leaves and taxon categories for each node
-        all_categories = set()
-        node_info = {}
-        parent_mean_dist_to_leafs = {}
-        max_bl_threshold = None
-        for i, node in enumerate(tree.seed_node.preorder_iter()):
-            node.id = i
-            
+        # determine mean distance to leaves and taxon categories for each
+        # node; the categories below a node are the union of the categories
+        # below its children and are tracked as a bitmask
+        self._decorate_mdtt(tree)
+
+        category_bit = {}
+        category_mask = {}
+        for node in tree.postorder_node_iter():
+            mask = 0
             if node.is_leaf():
-                mean_dist_to_leafs = 0.0
-                categories = set()
                 for c in taxon_category[node.taxon.label].split('/'):
-                    categories.add(c)
+                    if c not in category_bit:
+                        category_bit[c] = 1 << len(category_bit)
+                    mask |= category_bit[c]
             else:
-                dist_to_leafs = []
-                categories = set()
-                for t in node.leaf_iter():
-                    dist_to_leafs.append(self._dist_to_ancestor(t, node))
-                    
-                    for c in taxon_category[t.taxon.label].split('/'):
-                        categories.add(c)
+                for c in node.child_node_iter():
+                    mask |= category_mask[c]
 
-                mean_dist_to_leafs = np_mean(dist_to_leafs)
-                
-            if node.parent_node:
-                p = parent_mean_dist_to_leafs[node.parent_node.id]
-            else:
-                p = mean_dist_to_leafs + 1e-6
+            category_mask[node] = mask
 
-            category = '/'.join(sorted(list(categories), reverse=True))
-            all_categories.add(category)
-            node_info[node.id] = [mean_dist_to_leafs, p, category] 
-            parent_mean_dist_to_leafs[node.id] = mean_dist_to_leafs
-            
-            if mean_dist_to_leafs > max_bl_threshold:
-                max_bl_threshold = mean_dist_to_leafs
+        category_names = {}
+        def category_name(mask):
+            if mask not in category_names:
+                categories = [c for c, bit in category_bit.items() if mask & bit]
+                category_names[mask] = '/'.join(sorted(categories, reverse=True))
+            return category_names[mask]
+
+        interval_start = defaultdict(list)
+        interval_end = defaultdict(list)
+        max_bl_threshold = 0.0
+        for node, start, end in self._lineage_intervals(tree):
+            category = category_name(category_mask[node])
+            interval_start[category].append(start)
+            interval_end[category].append(end)
+            max_bl_threshold = max(max_bl_threshold, start)
+
+        all_categories = sorted(interval_start)
+        bl_thresholds = np_arange(0, max_bl_threshold + bl_step_size, bl_step_size)
+        category_counts = [self._interval_counts(interval_start[c], interval_end[c], bl_thresholds)
+                            for c in all_categories]
             
         # write table
         fout = open(output_table, 'w')
@@ -336,43 +418,15 @@ class BranchLengthDistribution():
             fout.write('\t%s' % c)
         fout.write('\n')
         
-        for bl_threshold in np_arange(0, max_bl_threshold + bl_step_size, bl_step_size):
-            category_count = defaultdict(int)
-            
-            stack = [tree.seed_node]
-            while stack:
-                node = stack.pop()
-                
-                mean_dist_to_leafs, _, category = node_info[node.id]
-                if mean_dist_to_leafs > bl_threshold:
-                    for c in node.child_node_iter():
-                        stack.append(c)
-                else:
-                    category_count[category] += 1
-                                  
+        for i, bl_threshold in enumerate(bl_thresholds):
             # check if node meets mean branch length criterion
-            if sum(category_count.values()) > 0:
+            if sum([counts[i] for counts in category_counts]) > 0:
                 fout.write('%.3f' % bl_threshold)
-                for c in all_categories:
-                    fout.write('\t%d' % category_count[c])
+                for counts in category_counts:
+                    fout.write('\t%d' % counts[i])
                 fout.write('\n')
                 
         fout.close()
-   
-        if False:
-            node_info.sort()
-            for bl_threshold in np_arange(0, node_info[-1][0] + bl_step_size, bl_step_size):
-                category_count = defaultdict(int)
-                for mean_bl_dist, parent_mean_bl_dist, category in node_info:
-                    if bl_threshold >= mean_bl_dist and bl_threshold < parent_mean_bl_dist:
-                        category_count[category] += 1
-                        
-                if sum(category_count.values()) > 0:
-                    fout.write('%.3f' % bl_threshold)
-                    for c in all_categories:
-                        fout.write('\t%d' % category_count[c])
-                    fout.write('\n')
-            
         
     def decorate(self, 
                     input_tree,
@@ -410,12 +464,10 @@ class BranchLengthDistribution():
         
         # read tree
         self.logger.info('Reading tree.')
-        tree = dendropy.Tree.get_from_path(input_tree,
-                                            schema='newick',
-                                            rooting='force-rooted',
-                                            preserve_underscores=True)
+        tree = read_tree(input_tree)
         
         # decorate tree
+        self._decorate_mdtt(tree)
         rank_prefix = Taxonomy.rank_prefixes[rank]
         new_name_number = defaultdict(int)
         ncbi_only = 0
@@ -435,13 +487,9 @@ class BranchLengthDistribution():
             p = node
             parent_taxon = None
             while p and not parent_taxon:
-                if p.label:
-                    support, taxon_name, _auxiliary_info = parse_label(p.label)
-                    
-                    if taxon_name:
-                        for taxon in [x.strip() for x in taxon_name.split(';')]:
-                            if taxon.startswith(rank_prefix):
-                                parent_taxon = taxon
+                for taxon in parse_taxon_label(p.label).taxa:
+                    if taxon.startswith(rank_prefix):
+                        parent_taxon = taxon
                     
                 p = p.parent_node
                     
@@ -453,13 +501,9 @@ class BranchLengthDistribution():
             # check if descendant node already has a label at this rank
             children_taxon = []
             for c in node.preorder_internal_node_iter():
-                if c.label:
-                    support, taxon_name, _auxiliary_info = parse_label(c.label)
-                    
-                    if taxon_name:
-                        for taxon in [x.strip() for x in taxon_name.split(';')]:
-                            if taxon.startswith(rank_prefix):
-                                children_taxon.append(taxon)
+                for taxon in parse_taxon_label(c.label).taxa:
+                    if taxon.startswith(rank_prefix):
+                        children_taxon.append(taxon)
                         
             if retain_named_lineages and children_taxon:
                 for c in node.child_node_iter():
@@ -467,11 +511,7 @@ class BranchLengthDistribution():
                 continue
                 
             # check if node meets mean branch length criterion
-            dists_to_tips = []
-            for t in node.leaf_iter():
-                dists_to_tips.append(self._dist_to_ancestor(t, node))
-                
-            if np_mean(dists_to_tips) > threshold:
+            if node.mdtt > threshold:
                 for c in node.child_node_iter():
                     stack.append(c)
                 continue
@@ -505,9 +545,8 @@ class BranchLengthDistribution():
                 lineage_name = 'Unclassified lineage'
             
             support = None
-            taxon_name = None
             if node.label: # preserve support information
-                support, _taxon_name, _auxiliary_info = parse_label(node.label)
+                support = parse_taxon_label(node.label).support
 
             new_name_number[lineage_name] += 1
 
@@ -530,8 +569,7 @@ class BranchLengthDistribution():
                     continue
                     
                 if node.label: # preserve support information
-                    support, _taxon_name, _auxiliary_info = parse_label(node.label)
-                    node.label = support
+                    node.label = parse_taxon_label(node.label).support
                     
         # prune tree to shallowest and deepest taxa in each named lineage
         if prune:
@@ -540,7 +578,7 @@ class BranchLengthDistribution():
                 for c in node.child_node_iter():
                     dists = []
                     for t in c.leaf_iter():
-                        d = self._dist_to_ancestor(t, node)
+                        d = t.depth - node.depth
                         dists.append((d, t))
                     
                     dists.sort()
@@ -563,22 +601,22 @@ class BranchLengthDistribution():
         tree.write_to_path(output_tree, schema='newick', suppress_rooting=True, unquoted_underscores=True)
         
     def _write_bl_dist(self, tree, output_rd_file):
-        """Write out mean branch length for each node."""
-        
-        fout = open(output_rd_file, 'w')
+        """Write out mean branch length for each node.
+
+        The tree must be decorated with the MDTT of each node.
+        """
+
+        left_taxon, right_taxon = get_left_right_taxa(tree)
+
+        rows = []
         for node in tree.preorder_node_iter():
             if node.is_leaf():
-                fout.write('%s\t%f\n' % (node.taxon.label, 0))
+                rows.append('%s\t%f\n' % (node.taxon.label, 0))
             else:
-                # get mean branch length to extent taxa
-                dists_to_tips = []
-                for t in node.leaf_iter():
-                    dists_to_tips.append(self._dist_to_ancestor(t, node))
-                    
-                # get left and right taxa that define this node
-                taxa = list(node.preorder_iter(lambda n: n.is_leaf()))
-                fout.write('%s|%s\t%f\n' % (taxa[0].taxon.label, taxa[-1].taxon.label, np_mean(dists_to_tips)))
-                
+                rows.append('%s|%s\t%f\n' % (left_taxon[node], right_taxon[node], node.mdtt))
+
+        fout = open(output_rd_file, 'w', 1024 * 1024)
+        fout.writelines(rows)
         fout.close()
                 
     def run(self, input_tree, trusted_taxa_file, min_children, taxonomy_file, output_dir):
@@ -598,10 +636,7 @@ class BranchLengthDistribution():
             Desired output directory.
         """
 
-        tree = dendropy.Tree.get_from_path(input_tree, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree = read_tree(input_tree)
                                             
         input_tree_name = os.path.splitext(os.path.basename(input_tree))[0]
         
@@ -624,6 +659,7 @@ class BranchLengthDistribution():
         taxa_for_dist_inference = filter_taxa_for_dist_inference(tree, taxonomy, set(), min_children, -1)
         
         # determine branch lengths to leaves for named lineages
+        self._decorate_mdtt(tree)
         rank_bl_dist = defaultdict(list)
         taxa_bl_dist = defaultdict(list)
         taxa_at_rank = defaultdict(list)
@@ -631,19 +667,18 @@ class BranchLengthDistribution():
             if node.is_leaf() or not node.label:
                 continue
                 
-            _support, taxon, _auxiliary_info = parse_label(node.label)
-            if not taxon:
+            taxa = parse_taxon_label(node.label).taxa
+            if not taxa:
                 continue
                 
             # get most specific rank in multi-rank taxa string
-            taxa = [t.strip() for t in taxon.split(';')]
             taxon = taxa[-1]
             
             most_specific_rank = taxon[0:3]
             taxa_at_rank[Taxonomy.rank_index[most_specific_rank]].append(taxon)
                 
             for n in node.leaf_iter():
-                dist_to_node = self._dist_to_ancestor(n, node)
+                dist_to_node = n.depth - node.depth
  
                 for t in taxa:
                     taxa_bl_dist[t].append(dist_to_node)
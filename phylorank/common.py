@@ -15,11 +15,20 @@
 #                                                                             #
 ###############################################################################
 
+import os
 import sys
+import logging
 
 from biolib.taxonomy import Taxonomy
 
-from phylorank.newick import parse_label
+import numpy as np
+
+from phylorank.taxonomy_store import TaxonomyStore
+from phylorank.newick import parse_taxon_label, read_newick
+from phylorank.compile_tree import (compiled_tree_file,
+                                    read_compiled_header,
+                                    read_compiled_tree,
+                                    is_fresh)
 
 
 def is_integer(s):
@@ -31,6 +40,124 @@ def is_integer(s):
         return False
 
 
+def read_compact_tree(tree_file):
+    """Read tree in Newick format into a compact tree.
+
+    A compiled version of the tree is memory-mapped instead
+    of parsing the Newick file if it is present and was
+    created from the current version of the file.
+
+    Parameters
+    ----------
+    tree_file : str
+        Newick file.
+
+    Returns
+    -------
+    CompactTree
+        Rooted phylogenetic tree.
+    """
+
+    compiled_file = compiled_tree_file(tree_file)
+    if os.path.exists(compiled_file):
+        try:
+            header = read_compiled_header(compiled_file)
+            if header is None:
+                logging.getLogger().warning('Ignoring invalid compiled tree: %s' % compiled_file)
+            elif not is_fresh(header, tree_file, compiled_file):
+                logging.getLogger().warning('Ignoring out-of-date compiled tree: %s' % compiled_file)
+            else:
+                return read_compiled_tree(compiled_file, header)
+        except (ValueError, KeyError, TypeError, UnicodeDecodeError):
+            # incomplete header or arrays extending beyond a truncated file
+            logging.getLogger().warning('Ignoring invalid compiled tree: %s' % compiled_file)
+
+    return read_newick(tree_file)
+
+
+def read_tree(tree_file):
+    """Read tree in Newick format into a Dendropy tree.
+
+    The tree is treated as rooted and underscores in labels
+    are preserved.
+
+    Parameters
+    ----------
+    tree_file : str
+        Newick file.
+
+    Returns
+    -------
+    Dendropy Tree
+        Rooted phylogenetic tree.
+    """
+
+    return read_compact_tree(tree_file).to_dendropy()
+
+
+def reroot_above_node(tree, node):
+    """Reroot tree in place on the edge leading to a node.
+
+    The new root is placed at the midpoint of the edge. A root with
+    two children is removed when the tree is rerooted, so if the edge
+    is below such a root the new root is placed at the midpoint of
+    the combined edge between the children of the current root.
+
+    Parameters
+    ----------
+    tree : Dendropy Tree
+        Phylogenetic tree.
+    node : Dendropy Node
+        Node below the edge to root on.
+    """
+
+    sibling = None
+    if node.parent_node == tree.seed_node and len(tree.seed_node.child_nodes()) == 2:
+        sibling = [c for c in tree.seed_node.child_node_iter() if c != node][0]
+        edge_length = node.edge_length + sibling.edge_length
+    else:
+        edge_length = node.edge_length
+
+    tree.reroot_at_edge(node.edge,
+                        length1=0.5 * node.edge_length,
+                        length2=0.5 * node.edge_length)
+
+    if sibling is not None:
+        node.edge_length = 0.5 * edge_length
+        sibling.edge_length = 0.5 * edge_length
+
+
+def get_left_right_taxa(tree):
+    """Get left and right taxa that define each node.
+
+    Parameters
+    ----------
+    tree : Dendropy Tree
+        Phylogenetic tree.
+
+    Returns
+    -------
+    dict : d[node] -> taxon label
+        Leftmost taxon below each node.
+    dict : d[node] -> taxon label
+        Rightmost taxon below each node.
+    """
+
+    # children are visited before their parent so these can be
+    # taken directly from the first and last child
+    left_taxon = {}
+    right_taxon = {}
+    for node in tree.postorder_node_iter():
+        if node.is_leaf():
+            left_taxon[node] = right_taxon[node] = node.taxon.label
+        else:
+            children = node.child_nodes()
+            left_taxon[node] = left_taxon[children[0]]
+            right_taxon[node] = right_taxon[children[-1]]
+
+    return left_taxon, right_taxon
+
+
 def read_taxa_file(taxa_file):
     """Read taxa from file.
 
@@ -58,7 +185,7 @@ def filter_taxa_for_dist_inference(tree, taxonomy, trusted_taxa, min_children, m
     ----------
     tree : Dendropy Tree
         Phylogenetic tree.
-    taxonomy : d[taxon ID] -> [d__x; p__y; ...]
+    taxonomy : TaxonomyStore or d[taxon ID] -> [d__x; p__y; ...]
         Taxonomy for each taxon.
     trusted_taxa : iterable
         Trusted taxa to consider when inferring distribution.
@@ -68,40 +195,36 @@ def filter_taxa_for_dist_inference(tree, taxonomy, trusted_taxa, min_children, m
         Only consider taxa with at least this level of support when inferring distribution.
     """
 
-    # determine children taxa for each named group
-    taxon_children = Taxonomy().taxon_children(taxonomy)
+    if not isinstance(taxonomy, TaxonomyStore):
+        taxonomy = TaxonomyStore.from_dict(taxonomy)
 
     # get all named groups
-    taxa_for_dist_inference = set()
-    for taxon_id, taxa in taxonomy.items():
-        for taxon in taxa:
-            taxa_for_dist_inference.add(taxon)
+    taxa_for_dist_inference = set([taxonomy.taxon_names[t]
+                                   for t in np.flatnonzero(taxonomy.taxon_rank >= 0).tolist()])
 
     # sanity check species names as these are a common problem
     species = set()
-    for taxon_id, taxa in taxonomy.items():
-        if len(taxa) > Taxonomy.rank_index['s__']:
-            species_name = taxa[Taxonomy.rank_index['s__']]
+    species_index = Taxonomy.rank_index['s__']
+    if taxonomy.taxa.shape[1] > species_index:
+        species_taxa = taxonomy.taxa[:, species_index]
+        for t in np.unique(species_taxa[species_taxa >= 0]).tolist():
+            species_name = taxonomy.taxon_names[t]
             valid, error_msg = True, None
             if species_name != 's__':
                 valid, error_msg = Taxonomy().validate_species_name(species_name, require_full=True, require_prefix=True)
             if not valid:
-                print('[Warning] Species name %s for %s is invalid: %s' % (species_name, taxon_id, error_msg))
+                for g in np.flatnonzero(species_taxa == t).tolist():
+                    print('[Warning] Species name %s for %s is invalid: %s' % (species_name, taxonomy.genome_ids[g], error_msg))
                 continue
-                
+
             species.add(species_name)
 
     # restrict taxa to those with a sufficient number of named children
-    # Note: a taxonomic group with no children will not end up in the
-    # taxon_children data structure so care must be taken when applying
-    # this filtering criteria.
+    # Note: a taxonomic group with no children will not satisfy this
+    # criteria so species must be explicitly added below
     if min_children > 0:
-        valid_taxa = set()
-        for taxon, children_taxa in taxon_children.items():
-            if len(children_taxa) >= min_children:
-                valid_taxa.add(taxon)
-
-        taxa_for_dist_inference.intersection_update(valid_taxa)
+        valid_taxa = np.flatnonzero(taxonomy.is_named[:-1] & (taxonomy.num_children >= min_children))
+        taxa_for_dist_inference.intersection_update([taxonomy.taxon_names[t] for t in valid_taxa.tolist()])
 
         # explicitly add in the species since they have no
         # children and thus be absent from the taxon_child dictionary
@@ -114,7 +237,7 @@ def filter_taxa_for_dist_inference(tree, taxonomy, trusted_taxa, min_children, m
                 continue
 
             # check for support value
-            support, taxon_name, _auxiliary_info = parse_label(node.label)
+            support, taxon_name = parse_taxon_label(node.label)[0:2]
 
             if not taxon_name:
                 continue
@@ -151,10 +274,8 @@ def get_phyla_lineages(tree):
         if not node.label or node.is_leaf():
             continue
 
-        _support, taxon_name, _auxiliary_info = parse_label(node.label)
-        if taxon_name:
-            taxa = [x.strip() for x in taxon_name.split(';')]
-            if taxa[-1].startswith('p__'):
-                phyla.append(taxa[-1])
+        taxa = parse_taxon_label(node.label).taxa
+        if taxa and taxa[-1].startswith('p__'):
+            phyla.append(taxa[-1])
                 
     return phyla
@@ -0,0 +1,343 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import dendropy
+import numpy as np
+
+
+class CompactTree():
+    """Array-based representation of a rooted tree.
+
+    Nodes are identified by their index in a preorder traversal of
+    the tree so the root has index 0, every node has a larger index
+    than its parent, and the descendants of node i are the nodes
+    i+1, ..., i+subtree_size[i]-1. Children are stored in compressed
+    sparse row form and retain the order of the source tree.
+    """
+
+    def __init__(self, parent, edge_length, labels, taxa, nodes=None):
+        """Initialization.
+
+        Parameters
+        ----------
+        parent : array_like
+            Index of parent for each node in preorder (-1 for root).
+        edge_length : array_like
+            Length of edge leading to each node.
+        labels : list
+            Label of each node, or None.
+        taxa : list
+            Taxon label of each leaf node, or None for internal nodes.
+        nodes : list
+            Source Dendropy Node for each index, or None.
+        """
+
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.edge_length = np.asarray(edge_length, dtype=np.float64)
+        self.labels = labels
+        self.taxa = taxa
+        self.nodes = nodes
+
+        self.num_nodes = len(self.parent)
+
+        # children of each node in compressed sparse row form
+        child_parents = self.parent[1:]
+        num_children = np.bincount(child_parents, minlength=self.num_nodes)
+        self.child_ptr = np.zeros(self.num_nodes + 1, dtype=np.int32)
+        np.cumsum(num_children, out=self.child_ptr[1:])
+        self.child_index = (np.argsort(child_parents, kind='stable') + 1).astype(np.int32)
+        self.is_leaf = (num_children == 0)
+
+        # number of edges between each node and the root
+        parent_list = self.parent.tolist()
+        level = [0] * self.num_nodes
+        for i in range(1, self.num_nodes):
+            level[i] = level[parent_list[i]] + 1
+        self.level = np.array(level, dtype=np.int32)
+
+        # nodes grouped by level; all children of a node are in the
+        # level following their parent so each group can be processed
+        # as a single vectorized operation
+        level_order = np.argsort(self.level, kind='stable').astype(np.int32)
+        level_bounds = np.searchsorted(self.level[level_order],
+                                       np.arange(self.level.max() + 2))
+        self.levels = [level_order[level_bounds[i]:level_bounds[i + 1]]
+                       for i in range(len(level_bounds) - 1)]
+
+        # size of subtree and number of leaves below each node
+        self.subtree_size = np.ones(self.num_nodes, dtype=np.int32)
+        self.num_taxa = self.is_leaf.astype(np.int32)
+        for nodes_at_level in self.levels[:0:-1]:
+            parents = self.parent[nodes_at_level]
+            np.add.at(self.subtree_size, parents, self.subtree_size[nodes_at_level])
+            np.add.at(self.num_taxa, parents, self.num_taxa[nodes_at_level])
+
+        # position of each node in a postorder traversal
+        post_pos = np.arange(self.num_nodes) - self.level + self.subtree_size - 1
+        self.postorder = np.empty(self.num_nodes, dtype=np.int32)
+        self.postorder[post_pos] = np.arange(self.num_nodes, dtype=np.int32)
+        self.preorder = np.arange(self.num_nodes, dtype=np.int32)
+
+    def __getstate__(self):
+        """Get state for pickling, excluding the source Dendropy nodes."""
+
+        state = self.__dict__.copy()
+        state['nodes'] = None
+        return state
+
+    @classmethod
+    def from_dendropy(cls, tree):
+        """Create compact representation of a Dendropy tree.
+
+        Parameters
+        ----------
+        tree : Dendropy Tree
+            Phylogenetic tree.
+
+        Returns
+        -------
+        CompactTree
+            Compact representation with a reference to the source nodes.
+        """
+
+        nodes = list(tree.preorder_node_iter())
+        node_index = {}
+        parent = [-1] * len(nodes)
+        edge_length = [0.0] * len(nodes)
+        labels = [None] * len(nodes)
+        taxa = [None] * len(nodes)
+        for i, node in enumerate(nodes):
+            node_index[node] = i
+            if node.parent_node is not None:
+                parent[i] = node_index[node.parent_node]
+            if node.edge_length is not None:
+                edge_length[i] = node.edge_length
+            labels[i] = node.label
+            if node.taxon is not None:
+                taxa[i] = node.taxon.label
+
+        return cls(parent, edge_length, labels, taxa, nodes)
+
+    def to_dendropy(self, return_nodes=False):
+        """Create Dendropy tree with the same topology, labels, and edge lengths.
+
+        Parameters
+        ----------
+        return_nodes : boolean
+            Flag indicating if the Dendropy node for each index should also be returned.
+
+        Returns
+        -------
+        Dendropy Tree
+            Rooted phylogenetic tree.
+        list
+            Dendropy node for each index, if requested.
+        """
+
+        taxon_namespace = dendropy.TaxonNamespace()
+        tree = dendropy.Tree(taxon_namespace=taxon_namespace, is_rooted=True)
+
+        parent = self.parent.tolist()
+        edge_length = self.edge_length.tolist()
+
+        root = tree.seed_node
+        root.label = self.labels[0]
+        if edge_length[0] != 0:
+            root.edge.length = edge_length[0]
+
+        nodes = [root]
+        for i in range(1, self.num_nodes):
+            node = dendropy.Node(label=self.labels[i], edge_length=edge_length[i])
+            if self.taxa[i] is not None:
+                node.taxon = taxon_namespace.new_taxon(self.taxa[i])
+            nodes[parent[i]].add_child(node)
+            nodes.append(node)
+
+        if self.taxa[0] is not None:
+            root.taxon = taxon_namespace.new_taxon(self.taxa[0])
+
+        if return_nodes:
+            return tree, nodes
+
+        return tree
+
+    def children(self, node_index):
+        """Get children of a node.
+
+        Parameters
+        ----------
+        node_index : int
+            Index of node.
+
+        Returns
+        -------
+        ndarray
+            Indices of children in the order of the source tree.
+        """
+
+        return self.child_index[self.child_ptr[node_index]:self.child_ptr[node_index + 1]]
+
+    def subtree_counts(self, leaf_mask):
+        """Count number of marked leaves within the subtree of each node.
+
+        Parameters
+        ----------
+        leaf_mask : ndarray
+            Boolean array indicating marked leaf nodes.
+
+        Returns
+        -------
+        ndarray
+            Number of marked leaves below each node.
+        """
+
+        # the subtree of a node is a contiguous block in preorder
+        cs = np.concatenate(([0], np.cumsum(leaf_mask)))
+        return cs[self.preorder + self.subtree_size] - cs[self.preorder]
+
+    def prune(self, leaf_mask):
+        """Create tree containing only the marked leaves.
+
+        Internal nodes without any marked leaves are removed and
+        nodes left with a single child are suppressed by adding the
+        length of their edge to that of their child, as done by
+        Dendropy when retaining a subset of taxa.
+
+        Parameters
+        ----------
+        leaf_mask : ndarray
+            Boolean array indicating leaf nodes to retain.
+
+        Returns
+        -------
+        CompactTree
+            Pruned tree.
+        """
+
+        keep = self.subtree_counts(leaf_mask) > 0
+        kept_children = np.bincount(self.parent[1:][keep[1:]], minlength=self.num_nodes)
+        retain = keep & (kept_children != 1)
+
+        # nearest retained ancestor of each node and length of the path
+        # to it; pointers over suppressed nodes are doubled each round
+        # so deep chains are resolved in a logarithmic number of rounds
+        new_parent = self.parent.copy()
+        path_length = self.edge_length.copy()
+        stop = np.append(retain, True)      # parent of root is -1
+        active = np.flatnonzero(keep & ~stop[new_parent])
+        while len(active):
+            p = new_parent[active]
+            path_length[active] += path_length[p]
+            new_parent[active] = new_parent[p]
+            active = active[~stop[new_parent[active]]]
+
+        # removing nodes from a preorder traversal leaves a preorder
+        # traversal of the pruned tree with children in the same order
+        retained = np.flatnonzero(retain)
+        new_index = np.cumsum(retain, dtype=np.int32) - 1
+        parent = new_parent[retained]
+        parent = np.where(parent >= 0, new_index[np.maximum(parent, 0)], -1)
+
+        retained_list = retained.tolist()
+        return CompactTree(parent,
+                            path_length[retained],
+                            [self.labels[i] for i in retained_list],
+                            [self.taxa[i] for i in retained_list])
+
+    def outgroup_edge(self, outgroup_mask):
+        """Determine edge separating the outgroup from all other taxa.
+
+        The outgroup is taken to be the smallest clade containing all
+        outgroup taxa under a rooting that places the root outside
+        of the outgroup. If the outgroup is not monophyletic and spans
+        the root of the tree, the tree is split on the largest clade
+        consisting only of ingroup taxa.
+
+        Parameters
+        ----------
+        outgroup_mask : ndarray
+            Boolean array indicating leaf nodes in the outgroup.
+
+        Returns
+        -------
+        int
+            Index of node defining the edge to root on, or None if there are no outgroup taxa.
+        boolean
+            Flag indicating if the outgroup is below the node.
+        int
+            Number of taxa on the outgroup side of the edge.
+        """
+
+        outgroup_counts = self.subtree_counts(outgroup_mask)
+        num_outgroup = outgroup_counts[0]
+        if num_outgroup == 0:
+            return None, None, 0
+
+        # MRCA of outgroup under the current rooting; nodes spanning
+        # all outgroup taxa form a path from the root so the MRCA
+        # is the one with the largest preorder index
+        mrca = np.flatnonzero(outgroup_counts == num_outgroup)[-1]
+        if mrca != 0:
+            return mrca, True, self.num_taxa[mrca]
+
+        # outgroup spans the root so find largest clade of ingroup taxa
+        ingroup_clades = (outgroup_counts[1:] == 0) & (outgroup_counts[self.parent[1:]] != 0)
+        candidates = np.flatnonzero(ingroup_clades) + 1
+        ingroup_clade = candidates[self.num_taxa[candidates].argmax()]
+
+        return ingroup_clade, False, self.num_taxa[0] - self.num_taxa[ingroup_clade]
+
+    def leaves(self, node_index):
+        """Get indices of leaves below a node in preorder.
+
+        Parameters
+        ----------
+        node_index : int
+            Index of node.
+
+        Returns
+        -------
+        ndarray
+            Indices of leaf nodes within the subtree.
+        """
+
+        subtree = np.arange(node_index, node_index + self.subtree_size[node_index])
+        return subtree[self.is_leaf[subtree]]
+
+    def clade_hashes(self, leaf_keys):
+        """Hash the set of leaves below each node.
+
+        The hash of a clade is the XOR of the keys of its leaves,
+        so clades with the same leaves have the same hash regardless
+        of topology or child order within the clade.
+
+        Parameters
+        ----------
+        leaf_keys : ndarray
+            Unsigned 64-bit key of each node, with 0 for internal nodes.
+
+        Returns
+        -------
+        ndarray
+            Hash of leaves below each node.
+        """
+
+        # the subtree of a node is a contiguous block in preorder
+        # so its hash is the difference of two prefix XORs
+        px = np.zeros(self.num_nodes + 1, dtype=np.uint64)
+        np.bitwise_xor.accumulate(np.asarray(leaf_keys, dtype=np.uint64), out=px[1:])
+        return px[self.preorder + self.subtree_size] ^ px[self.preorder]
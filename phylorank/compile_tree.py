@@ -0,0 +1,308 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import json
+import struct
+import hashlib
+import logging
+
+import numpy as np
+
+from phylorank.newick import read_newick
+from phylorank.compact_tree import CompactTree
+
+
+'''
+Binary representation of a tree which can be memory-mapped.
+
+The file consists of a fixed magic string, the length of a JSON header,
+the header, and a set of arrays each aligned to 8 bytes. The header
+records the size, modification time, and SHA-256 hash of the source
+Newick file along with the type, offset, and length of each array.
+Node labels and taxon labels are stored as indices into a table of
+unique strings separated by null characters.
+'''
+
+COMPILED_TREE_EXT = '.ptree'
+
+_MAGIC = b'PHYLORANK_TREE\x00\x01'
+
+# spare bytes reserved in the header for updating it in place
+_HEADER_SLACK = 32
+
+
+def compiled_tree_file(tree_file):
+    """Get name of compiled tree for a Newick file."""
+
+    return tree_file + COMPILED_TREE_EXT
+
+
+def _file_hash(filename):
+    """Calculate SHA-256 hash of a file."""
+
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def _data_start(header_len):
+    """Get position of first array given length of header."""
+
+    return (len(_MAGIC) + 8 + header_len + 7) // 8 * 8
+
+
+def write_compiled_tree(tree, tree_file, output_file):
+    """Write compiled representation of a tree.
+
+    Parameters
+    ----------
+    tree : CompactTree
+        Tree read from tree_file.
+    tree_file : str
+        Source Newick file.
+    output_file : str
+        Output file for compiled tree.
+    """
+
+    # intern labels of internal nodes and leaves
+    string_index = {}
+    label_index = np.full(tree.num_nodes, -1, dtype=np.int32)
+    taxon_index = np.full(tree.num_nodes, -1, dtype=np.int32)
+    for i in range(tree.num_nodes):
+        for values, indices in ((tree.labels, label_index), (tree.taxa, taxon_index)):
+            s = values[i]
+            if s is not None:
+                indices[i] = string_index.setdefault(s, len(string_index))
+
+    strings = sorted(string_index, key=string_index.get)
+    string_data = np.frombuffer('\0'.join(strings).encode('utf-8'), dtype=np.uint8)
+
+    arrays = [('parent', tree.parent.astype('<i4')),
+              ('edge_length', tree.edge_length.astype('<f8')),
+              ('label_index', label_index.astype('<i4')),
+              ('taxon_index', taxon_index.astype('<i4')),
+              ('string_data', string_data)]
+
+    stat = os.stat(tree_file)
+    header = {'source_size': stat.st_size,
+              'source_mtime': stat.st_mtime,
+              'source_sha256': _file_hash(tree_file),
+              'num_nodes': tree.num_nodes,
+              'num_strings': len(strings),
+              'arrays': {}}
+
+    # arrays start at the first 8 byte boundary following the
+    # header and their offsets are relative to this position
+    offset = 0
+    for name, data in arrays:
+        header['arrays'][name] = [data.dtype.str, offset, len(data)]
+        offset += (data.nbytes + 7) // 8 * 8
+
+    # the header is padded so the modification time of the
+    # source file can later be updated without moving the arrays
+    header_bytes = json.dumps(header).encode('utf-8') + b' ' * _HEADER_SLACK
+    data_start = _data_start(len(header_bytes))
+
+    with open(output_file, 'wb') as fout:
+        fout.write(_MAGIC)
+        fout.write(struct.pack('<Q', len(header_bytes)))
+        fout.write(header_bytes)
+        for name, data in arrays:
+            fout.write(b'\0' * (data_start + header['arrays'][name][1] - fout.tell()))
+            fout.write(data.tobytes())
+
+
+def read_compiled_header(compiled_file):
+    """Read header of a compiled tree.
+
+    Parameters
+    ----------
+    compiled_file : str
+        Compiled tree.
+
+    Returns
+    -------
+    dict
+        Header information, or None if the file is not a valid compiled tree.
+    """
+
+    with open(compiled_file, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            return None
+
+        try:
+            header_len = struct.unpack('<Q', f.read(8))[0]
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        except (struct.error, ValueError):
+            # truncated or corrupt header
+            return None
+
+        header['header_len'] = header_len
+        header['data_start'] = _data_start(header_len)
+
+        return header
+
+
+def _update_source_mtime(compiled_file, header, mtime):
+    """Record new modification time of the source file in the header of a compiled tree.
+
+    Returns
+    -------
+    boolean
+        True if the header was updated.
+    """
+
+    new_header = dict((k, v) for k, v in header.items() if k not in ('header_len', 'data_start'))
+    new_header['source_mtime'] = mtime
+    header_bytes = json.dumps(new_header).encode('utf-8')
+    if len(header_bytes) > header['header_len']:
+        return False
+
+    try:
+        with open(compiled_file, 'r+b') as f:
+            f.seek(len(_MAGIC) + 8)
+            f.write(header_bytes + b' ' * (header['header_len'] - len(header_bytes)))
+    except (IOError, OSError):
+        return False
+
+    header['source_mtime'] = mtime
+    return True
+
+
+def is_fresh(header, tree_file, compiled_file):
+    """Check if a compiled tree was created from the current version of a Newick file.
+
+    A compiled tree is taken to be fresh if the size and modification
+    time of the Newick file are unchanged. If only the modification
+    time has changed, the hash of the file is used to determine if
+    the contents have changed and, if not, the new modification time
+    is recorded in the compiled tree so the file need not be hashed again.
+
+    Parameters
+    ----------
+    header : dict
+        Header of compiled tree.
+    tree_file : str
+        Source Newick file.
+    compiled_file : str
+        Compiled tree.
+
+    Returns
+    -------
+    boolean
+        True if the compiled tree is fresh.
+    """
+
+    stat = os.stat(tree_file)
+    if stat.st_size != header['source_size']:
+        return False
+
+    if stat.st_mtime == header['source_mtime']:
+        return True
+
+    if _file_hash(tree_file) != header['source_sha256']:
+        return False
+
+    if not _update_source_mtime(compiled_file, header, stat.st_mtime):
+        logging.getLogger().info('Recompile tree to avoid hashing %s on every run.' % tree_file)
+
+    return True
+
+
+def read_compiled_tree(compiled_file, header=None):
+    """Read compiled tree using memory-mapped arrays.
+
+    Parameters
+    ----------
+    compiled_file : str
+        Compiled tree.
+    header : dict
+        Header of compiled tree if previously read.
+
+    Returns
+    -------
+    CompactTree
+        Rooted phylogenetic tree.
+    """
+
+    if header is None:
+        header = read_compiled_header(compiled_file)
+        if header is None:
+            raise ValueError('File is not a compiled tree: %s' % compiled_file)
+
+    # arrays are mapped copy-on-write so they can
+    # be modified without altering the file
+    arrays = {}
+    for name, (dtype, offset, length) in header['arrays'].items():
+        if length == 0:
+            arrays[name] = np.zeros(0, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(compiled_file,
+                                     dtype=dtype,
+                                     mode='c',
+                                     offset=header['data_start'] + offset,
+                                     shape=(length,))
+
+    strings = []
+    if header['num_strings']:
+        strings = arrays['string_data'].tobytes().decode('utf-8').split('\0')
+    strings.append(None)   # index -1 indicates no label
+
+    labels = [strings[i] for i in arrays['label_index'].tolist()]
+    taxa = [strings[i] for i in arrays['taxon_index'].tolist()]
+
+    return CompactTree(arrays['parent'], arrays['edge_length'], labels, taxa)
+
+
+class CompileTree():
+    """Compile Newick tree into a binary format for fast loading."""
+
+    def __init__(self):
+        """Initialization."""
+
+        self.logger = logging.getLogger()
+
+    def run(self, input_tree):
+        """Compile tree.
+
+        The compiled tree is placed beside the input tree
+        so it is found whenever the input tree is read.
+
+        Parameters
+        ----------
+        input_tree : str
+          Newick tree to compile.
+
+        Returns
+        -------
+        str
+            Name of compiled tree.
+        """
+
+        output_file = compiled_tree_file(input_tree)
+
+        self.logger.info('Reading tree.')
+        tree = read_newick(input_tree)
+        self.logger.info('Tree contains %d nodes.' % tree.num_nodes)
+
+        write_compiled_tree(tree, input_tree, output_file)
+
+        return output_file
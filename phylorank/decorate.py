@@ -17,17 +17,28 @@
 
 import sys
 import logging
-from collections import defaultdict
 
-import dendropy
-from numpy import (median as np_median)
+from numpy import (zeros as np_zeros,
+                   full as np_full,
+                   arange as np_arange,
+                   sort as np_sort,
+                   array as np_array,
+                   cumsum as np_cumsum,
+                   searchsorted as np_searchsorted,
+                   flatnonzero as np_flatnonzero,
+                   int64 as np_int64,
+                   float64 as np_float64)
 
 from biolib.taxonomy import Taxonomy
 from biolib.newick import parse_label, create_label
 
 from phylorank.common import (read_taxa_file,
+                              read_tree,
                               filter_taxa_for_dist_inference)
 from phylorank.outliers import Outliers
+from phylorank.compact_tree import CompactTree
+from phylorank.lca import LCA
+from phylorank.taxonomy_store import TaxonomyStore
 
 
 class Decorate():
@@ -49,7 +60,7 @@ class Decorate():
         ----------
         tree : Tree
           Dendropy Tree.
-        taxonomy : d[extent_taxon_id] -> taxa list
+        taxonomy : TaxonomyStore
           Taxon labels for extant taxa.
           
         Returns
@@ -58,36 +69,64 @@ class Decorate():
             Node(s) with highest F-measure for each taxon.
         """
     
-        # get named lineages/taxa at each taxonomic rank
-        taxa_at_rank = Taxonomy().named_lineages_at_rank(taxonomy)
-        
-        # get extant taxa for each taxon label
-        extent_taxa_with_label = {}
-        for i, rank in enumerate(Taxonomy.rank_labels):
-            extent_taxa_with_label[i] = Taxonomy().extant_taxa_for_rank(rank, taxonomy)
-            
-        # get parent taxon for each taxon:
-        taxon_parents = Taxonomy().parents(taxonomy)
-        
-        # get number of leaves and taxon in each lineage
+        # the leaves below a node form a contiguous block of the leaves
+        # in preorder, so the number of leaves from a taxon within each
+        # lineage is obtained by searching the sorted positions of the
+        # taxon's leaves and the number of leaves with a taxon at a rank
+        # from a prefix sum over the leaves
         self.logger.info('Calculating taxa within each lineage.')
-        for node in tree.preorder_node_iter():
-            num_leaves = 0
-            taxa_count = defaultdict(lambda: defaultdict(int))
-            for leaf in node.leaf_iter():
-                num_leaves += 1
-                for rank_index, taxon in enumerate(taxonomy[leaf.taxon.label]):
-                    if taxon != Taxonomy.rank_prefixes[rank_index]:
-                        taxa_count[rank_index][taxon] += 1
-                
-            node.num_leaves = num_leaves
-            node.taxa_count = taxa_count
-            
-        taxa_in_tree = defaultdict(int)
-        for leaf in tree.leaf_node_iter():
-            for taxon in taxonomy[leaf.taxon.label]:
-                taxa_in_tree[taxon] += 1
-    
+        compact_tree = CompactTree.from_dendropy(tree)
+        node_index = dict((n, i) for i, n in enumerate(compact_tree.nodes))
+        lca = LCA(compact_tree)
+
+        leaf_nodes = np_flatnonzero(compact_tree.is_leaf)
+        leaf_start = np_searchsorted(leaf_nodes, compact_tree.preorder)
+        leaf_end = np_searchsorted(leaf_nodes, compact_tree.preorder + compact_tree.subtree_size)
+
+        num_ranks = len(Taxonomy.rank_labels)
+        leaf_genomes = np_array([taxonomy.genome_index[compact_tree.taxa[leaf]] for leaf in leaf_nodes],
+                                dtype=np_int64)
+        genome_leaf_pos = np_full(len(taxonomy), -1, dtype=np_int64)
+        genome_leaf_pos[leaf_genomes] = np_arange(len(leaf_nodes))
+
+        taxa_at_rank = {}
+        extant_taxa_count = {}
+        taxon_leaves = [{} for _ in range(num_ranks)]
+        named_leaves = np_zeros((num_ranks, len(leaf_nodes) + 1), dtype=np_int64)
+        for rank_index in range(num_ranks):
+            taxa_at_rank[rank_index] = taxonomy.named_lineages_at_rank(rank_index)
+            for taxon, genomes in taxonomy.extant_taxa_for_rank(rank_index).items():
+                leaf_pos = genome_leaf_pos[genomes]
+                taxon_leaves[rank_index][taxon] = np_sort(leaf_pos[leaf_pos >= 0])
+                extant_taxa_count[taxon] = len(genomes)
+            named_leaves[rank_index][1:] = taxonomy.is_named[taxonomy.taxa[leaf_genomes, rank_index]]
+        named_leaves = np_cumsum(named_leaves, axis=1)
+        num_leaves_with_taxa = named_leaves[:, leaf_end] - named_leaves[:, leaf_start]
+
+        def taxa_in_lineages(rank_index, taxon, nodes):
+            leaf_pos = taxon_leaves[rank_index].get(taxon, np_array([], dtype=np_int64))
+            return (np_searchsorted(leaf_pos, leaf_end[nodes])
+                    - np_searchsorted(leaf_pos, leaf_start[nodes]))
+
+        # only nodes with leaves from a taxon in their lineage can have
+        # a non-zero F-measure, so candidate placements for a taxon are
+        # restricted to the ancestors of its leaves below the parent node
+        parent = compact_tree.parent.tolist()
+        def candidate_nodes(rank_index, taxon, parent_index):
+            leaf_pos = taxon_leaves[rank_index].get(taxon, np_array([], dtype=np_int64))
+            start = np_searchsorted(leaf_pos, leaf_start[parent_index])
+            end = np_searchsorted(leaf_pos, leaf_end[parent_index])
+
+            candidates = set()
+            for n in leaf_nodes[leaf_pos[start:end]].tolist():
+                while n not in candidates:
+                    candidates.add(n)
+                    if n == parent_index:
+                        break
+                    n = parent[n]
+
+            return np_array(sorted(candidates), dtype=np_int64)
+
         # find node with best F-measure for each taxon
         fmeasure_for_taxa = {}
         for rank_index in range(0, len(Taxonomy.rank_labels)):
@@ -99,7 +138,7 @@ class Decorate():
                     # processing taxa at the domain is a special case
                     taxon_parent_node = tree.seed_node
                 else:
-                    parent_taxon = taxon_parents[taxon][-1]
+                    parent_taxon = taxonomy.parents(taxon)[-1]
                     if parent_taxon in fmeasure_for_taxa:
                         # only need to process the lineage below the parent node,
                         # but must take the MRCA if the placement of the parent
@@ -111,12 +150,16 @@ class Decorate():
                         if len(parent_nodes) == 1:
                             taxon_parent_node = parent_nodes[0]
                         else:
-                            taxa = []
+                            # MRCA of the leftmost and rightmost leaves of
+                            # each parent node spans all leaves of the nodes
+                            leaves = []
                             for p in parent_nodes:
-                                taxa += [leaf.taxon for leaf in p.leaf_iter()]
-                            taxon_parent_node = tree.mrca(taxa=taxa)
+                                i = node_index[p]
+                                leaves += [leaf_nodes[leaf_start[i]], leaf_nodes[leaf_end[i] - 1]]
+                            taxon_parent_node = compact_tree.nodes[lca.mrca(leaves)]
                             
-                        if taxon_parent_node.taxa_count[rank_index][taxon] < 0.5*taxa_in_tree[taxon]:
+                        parent_index = node_index[taxon_parent_node]
+                        if taxa_in_lineages(rank_index, taxon, parent_index) < 0.5*len(taxon_leaves[rank_index][taxon]):
                             # substantial portion of genomes for taxon fall outside 
                             # the parent lineages so best search the entire tree
                             taxon_parent_node = tree.seed_node       
@@ -125,23 +168,30 @@ class Decorate():
                         # it can be ignored (e.g., bacterial phylum in archaeal tree)
                         continue
                     
-                cur_taxon_fmeasure = -1
-                total_taxa = len(extent_taxa_with_label[rank_index][taxon])
-                
-                for node in taxon_parent_node.preorder_iter():
-                    taxa_in_lineage = node.taxa_count[rank_index][taxon]
-                    num_leaves_with_taxa = sum(node.taxa_count[rank_index].values())
-                    
-                    if taxa_in_lineage != 0 and num_leaves_with_taxa != 0:
-                        precision = float(taxa_in_lineage) / num_leaves_with_taxa
-                        recall = float(taxa_in_lineage) / total_taxa
-                        fmeasure = (2*precision*recall) / (precision + recall)
-
-                        if fmeasure > cur_taxon_fmeasure:
-                            cur_taxon_fmeasure = fmeasure
-                            fmeasure_for_taxa[taxon] = [(node, fmeasure, precision, recall)]
-                        elif fmeasure == cur_taxon_fmeasure:
-                            fmeasure_for_taxa[taxon].append((node, fmeasure, precision, recall))
+                total_taxa = extant_taxa_count[taxon]
+
+                # evaluate candidate nodes in the lineage in preorder
+                nodes = candidate_nodes(rank_index, taxon, node_index[taxon_parent_node])
+
+                taxa_in_lineage = taxa_in_lineages(rank_index, taxon, nodes)
+                num_leaves = num_leaves_with_taxa[rank_index][nodes]
+
+                valid = (taxa_in_lineage != 0) & (num_leaves != 0)
+                if not valid.any():
+                    continue
+
+                nodes = nodes[valid]
+                taxa_in_lineage = taxa_in_lineage[valid].astype(np_float64)
+                precision = taxa_in_lineage / num_leaves[valid]
+                recall = taxa_in_lineage / total_taxa
+                fmeasure = (2*precision*recall) / (precision + recall)
+
+                # retain all nodes with the highest F-measure
+                best_nodes = np_flatnonzero(fmeasure == fmeasure.max())
+                fmeasure_for_taxa[taxon] = [(compact_tree.nodes[nodes[i]], 
+                                                float(fmeasure[i]), 
+                                                float(precision[i]), 
+                                                float(recall[i])) for i in best_nodes]
                                              
         return fmeasure_for_taxa
         
@@ -294,7 +344,9 @@ class Decorate():
                             taxonomy,
                             trusted_taxa_file, 
                             min_children, 
-                            min_support):
+                            min_support,
+                            cpus=1,
+                            streaming_median=False):
         """Calculate median relative divergence to each node and thresholds for each taxonomic rank.
         
         Parameters
@@ -303,7 +355,7 @@ class Decorate():
           Dendropy Tree.
         placed_taxon : set
           Taxon currently placed in tree which can be used for relative divergence inference.
-        taxonomy: d[taxon_id] -> taxonomy info
+        taxonomy: TaxonomyStore
           Taxonomic information for extant taxa.
         trusted_taxa_file : str
           File specifying trusted taxa to consider when inferring distribution. Set to None to consider all taxa.
@@ -311,6 +363,10 @@ class Decorate():
           Only consider taxa with at least the specified number of children taxa when inferring distribution.
         min_support : float
           Only consider taxa with at least this level of support when inferring distribution.
+        cpus : int
+          Number of processes to use for evaluating rootings.
+        streaming_median : boolean
+          Estimate median relative divergence of nodes with streaming quantiles.
         
         Returns
         -------
@@ -333,16 +389,19 @@ class Decorate():
  
         # infer distribution                                        
         outliers = Outliers()
-        phylum_rel_dists, rel_node_dists = outliers.median_rd_over_phyla(tree, 
-                                                                            taxa_for_dist_inference, 
-                                                                            taxonomy)    
+        phylum_rel_dists, node_rd = outliers.median_rd_over_phyla(tree, 
+                                                                    taxa_for_dist_inference, 
+                                                                    taxonomy,
+                                                                    cpus,
+                                                                    streaming_median)
         median_for_rank = outliers.rank_median_rd(phylum_rel_dists, 
                                                     taxa_for_dist_inference)
                                                     
         # set edge lengths to median value over all rootings
+        node_rd = node_rd.tolist()
         tree.seed_node.rel_dist = 0.0
         for n in tree.preorder_node_iter(lambda n: n != tree.seed_node):
-            n.rel_dist = np_median(rel_node_dists[n.id])
+            n.rel_dist = node_rd[n.id]
             
         return median_for_rank
         
@@ -434,7 +493,9 @@ class Decorate():
                 min_children, 
                 min_support,
                 skip_rd_refine,
-                output_tree):
+                output_tree,
+                cpus=1,
+                streaming_median=False):
         """Decorate internal nodes with taxa labels.
 
         Parameters
@@ -453,14 +514,15 @@ class Decorate():
           Skip refinement of taxonomy based on relative divergence information.
         output_tree: str
           Name of output tree.
+        cpus : int
+          Number of processes to use for evaluating rootings.
+        streaming_median : boolean
+          Estimate median relative divergence of nodes with streaming quantiles.
         """
         
         # read tree
         self.logger.info('Reading tree.')
-        tree = dendropy.Tree.get_from_path(input_tree, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree = read_tree(input_tree)
                                             
         # remove any previous taxon labels
         self.logger.info('Removing any previous internal node labels.')
@@ -468,11 +530,9 @@ class Decorate():
                                    
         # read taxonomy and trim to taxa in tree
         self.logger.info('Reading taxonomy.')
-        full_taxonomy = Taxonomy().read(taxonomy_file)
-        
-        taxonomy = {}
-        for leaf in tree.leaf_node_iter():
-            taxonomy[leaf.taxon.label] = full_taxonomy.get(leaf.taxon.label, Taxonomy.rank_prefixes)
+        full_taxonomy = TaxonomyStore.read(taxonomy_file)
+        taxonomy = full_taxonomy.subset([leaf.taxon.label for leaf in tree.leaf_node_iter()],
+                                        Taxonomy.rank_prefixes)
 
         # find best placement for each taxon based 
         # on the F-measure statistic
@@ -493,7 +553,9 @@ class Decorate():
                                                     taxonomy,
                                                     trusted_taxa_file, 
                                                     min_children, 
-                                                    min_support)
+                                                    min_support,
+                                                    cpus,
+                                                    streaming_median)
                                                                                           
             # resolve ambiguous position in tree
             self.logger.info('Resolving ambiguous taxon label placements using median relative divergences.')
@@ -0,0 +1,178 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import numpy as np
+
+
+class LCA():
+    """Lowest common ancestor queries over a compact tree.
+
+    The tree is recorded as an Euler tour, i.e. the sequence of nodes
+    visited by a depth-first traversal that lists a node each time it
+    is entered or returned to. The LCA of two nodes is the shallowest
+    node in the tour between their first occurrences, which is found
+    in constant time using a sparse table of range minimums.
+    """
+
+    def __init__(self, tree):
+        """Initialization.
+
+        Parameters
+        ----------
+        tree : CompactTree
+            Phylogenetic tree.
+        """
+
+        self.tree = tree
+
+        # Euler tour of tree
+        child_ptr = tree.child_ptr.tolist()
+        child_index = tree.child_index.tolist()
+
+        tour = []
+        first = [0] * tree.num_nodes
+        stack = [(0, child_ptr[0])]
+        while stack:
+            node, next_child = stack[-1]
+            if next_child == child_ptr[node]:
+                first[node] = len(tour)
+            tour.append(node)
+
+            if next_child < child_ptr[node + 1]:
+                stack[-1] = (node, next_child + 1)
+                child = child_index[next_child]
+                stack.append((child, child_ptr[child]))
+            else:
+                stack.pop()
+
+        self.tour = np.array(tour, dtype=np.int32)
+        self.first = np.array(first, dtype=np.int32)
+
+        # sparse table where sparse[j][i] is the position of the
+        # shallowest node in the tour between i and i + 2^j - 1
+        tour_level = tree.level[self.tour]
+        self.sparse = [np.arange(len(tour), dtype=np.int32)]
+        span = 1
+        while 2 * span <= len(tour):
+            prev = self.sparse[-1]
+            left = prev[:-span]
+            right = prev[span:]
+            self.sparse.append(np.where(tour_level[right] < tour_level[left], right, left))
+            span *= 2
+
+        self.tour_level = tour_level
+
+    def _range_min(self, i, j):
+        """Get shallowest node in tour between positions i and j (inclusive)."""
+
+        k = (j - i + 1).bit_length() - 1
+        left = self.sparse[k][i]
+        right = self.sparse[k][j - (1 << k) + 1]
+        if self.tour_level[right] < self.tour_level[left]:
+            return self.tour[right]
+
+        return self.tour[left]
+
+    def lca(self, node1, node2):
+        """Get lowest common ancestor of two nodes.
+
+        Parameters
+        ----------
+        node1 : int
+            Index of first node.
+        node2 : int
+            Index of second node.
+
+        Returns
+        -------
+        int
+            Index of lowest common ancestor.
+        """
+
+        i = self.first[node1]
+        j = self.first[node2]
+        if i > j:
+            i, j = j, i
+
+        return int(self._range_min(int(i), int(j)))
+
+    def mrca(self, nodes):
+        """Get most recent common ancestor of a set of nodes.
+
+        The MRCA of a set is the LCA of the nodes
+        occurring first and last in the Euler tour.
+
+        Parameters
+        ----------
+        nodes : iterable
+            Indices of nodes.
+
+        Returns
+        -------
+        int
+            Index of most recent common ancestor.
+        """
+
+        first = self.first[np.asarray(list(nodes), dtype=np.int32)]
+
+        return int(self._range_min(int(first.min()), int(first.max())))
+
+    def mrca_groups(self, nodes, groups, num_groups):
+        """Get most recent common ancestor of each of several sets of nodes.
+
+        Parameters
+        ----------
+        nodes : array_like
+            Indices of nodes.
+        groups : array_like
+            Index of set containing each node.
+        num_groups : int
+            Number of sets.
+
+        Returns
+        -------
+        ndarray
+            Index of most recent common ancestor of each set, or -1 for empty sets.
+        ndarray
+            Number of nodes in each set.
+        """
+
+        nodes = np.asarray(nodes, dtype=np.int64)
+        groups = np.asarray(groups, dtype=np.int64)
+
+        first = self.first[nodes]
+        lo = np.full(num_groups, len(self.tour), dtype=np.int64)
+        hi = np.full(num_groups, -1, dtype=np.int64)
+        np.minimum.at(lo, groups, first)
+        np.maximum.at(hi, groups, first)
+        num_nodes = np.bincount(groups, minlength=num_groups)
+
+        # range minimum queries are answered together
+        # for all ranges spanning the same power of two
+        mrca = np.full(num_groups, -1, dtype=np.int64)
+        valid = np.flatnonzero(hi >= 0)
+        i = lo[valid]
+        j = hi[valid]
+        k = np.frexp(j - i + 1)[1] - 1
+        for kk in np.unique(k).tolist():
+            sel = (k == kk)
+            left = self.sparse[kk][i[sel]]
+            right = self.sparse[kk][j[sel] - (1 << kk) + 1]
+            pos = np.where(self.tour_level[right] < self.tour_level[left], right, left)
+            mrca[valid[sel]] = self.tour[pos]
+
+        return mrca, num_nodes
@@ -22,7 +22,8 @@ from collections import defaultdict
 
 from phylorank.mark_tree import MarkTree
 from phylorank.rel_dist import RelativeDistance
-from phylorank.newick import parse_label
+from phylorank.newick import parse_taxon_label
+from phylorank.common import read_tree
 from phylorank.outliers import Outliers
 from phylorank.rd_ranks import RdRanks
 from phylorank.bl_dist import BranchLengthDistribution
@@ -31,6 +32,8 @@ from phylorank.tax_diff import TaxDiff
 from phylorank.plot.robustness_plot import RobustnessPlot
 from phylorank.plot.distribution_plot import DistributionPlot
 from phylorank.decorate import Decorate
+from phylorank.compile_tree import CompileTree
+from phylorank.taxonomy_store import TaxonomyStore
 
 from biolib.common import (make_sure_path_exists,
                            check_dir_exists,
@@ -39,9 +42,10 @@ from biolib.taxonomy import Taxonomy
 from biolib.misc.time_keeper import TimeKeeper
 from biolib.external.execute import check_dependencies
 
-from numpy import (mean as np_mean)
+from numpy import (mean as np_mean,
+                   zeros as np_zeros,
+                   flatnonzero as np_flatnonzero)
 
-import dendropy
 
 class OptionsParser():
     def __init__(self):
@@ -74,7 +78,9 @@ class OptionsParser():
                 options.fixed_root,
                 options.min_children,
                 options.min_support,
-                options.verbose_table)
+                options.verbose_table,
+                options.cpus,
+                options.streaming_median)
 
         self.logger.info('Done.')
         
@@ -244,10 +250,22 @@ class OptionsParser():
                         options.min_children,
                         options.min_support,
                         options.skip_rd_refine,
-                        options.output_tree)
+                        options.output_tree,
+                        options.cpus,
+                        options.streaming_median)
 
         self.logger.info('Finished decorating tree.')
    
+    def compile_tree(self, options):
+        """Compile tree into binary format for fast loading."""
+
+        check_file_exists(options.input_tree)
+
+        ct = CompileTree()
+        output_file = ct.run(options.input_tree)
+
+        self.logger.info('Compiled tree written to: %s' % output_file)
+
     def pull(self, options):
         """Pull command"""
         check_file_exists(options.input_tree)
@@ -296,10 +314,7 @@ class OptionsParser():
 
         taxonomy = Taxonomy().read(options.taxonomy_file)
 
-        tree = dendropy.Tree.get_from_path(options.input_tree, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree = read_tree(options.input_tree)
         
         for n in tree.leaf_node_iter():
             taxa_str = taxonomy.get(n.label, None)
@@ -322,8 +337,15 @@ class OptionsParser():
         """Taxon stats command"""
         check_file_exists(options.taxonomy_file)
 
-        taxonomy = Taxonomy().read(options.taxonomy_file)
-        taxon_children = Taxonomy().taxon_children(taxonomy)
+        taxonomy = TaxonomyStore.read(options.taxonomy_file)
+
+        # report named taxa with children along with named children
+        # of other taxa, even if all of their own children are unnamed
+        is_child = np_zeros(len(taxonomy.taxon_names), dtype=bool)
+        is_child[taxonomy.child_index] = True
+        reported_taxa = [taxonomy.taxon_names[t]
+                            for t in np_flatnonzero(taxonomy.is_named[:-1]
+                                                    & ((taxonomy.num_children > 0) | is_child))]
 
         fout = open(options.output_file, 'w')
         fout.write('Taxa')
@@ -335,7 +357,7 @@ class OptionsParser():
         for rank_prefix in Taxonomy.rank_prefixes:
             # find taxon at the specified rank
             cur_taxa = []
-            for taxon in taxon_children:
+            for taxon in reported_taxa:
                 if taxon.startswith(rank_prefix):
                     cur_taxa.append(taxon)
 
@@ -349,7 +371,7 @@ class OptionsParser():
                 for _ in range(Taxonomy.rank_index[rank_prefix], Taxonomy.rank_index['s__'] + 1):
                     children_taxa = set()
                     for t in next_taxa:
-                        children_taxa.update(taxon_children[t])
+                        children_taxa.update(taxonomy.children(t))
 
                     fout.write('\t%d' % len(children_taxa))
                     next_taxa = children_taxa
@@ -374,7 +396,8 @@ class OptionsParser():
                                 options.taxonomy_file,
                                 options.output_prefix,
                                 options.min_children,
-                                options.title)
+                                options.title,
+                                options.cpus)
 
         self.time_keeper.print_time_stamp()
 
@@ -387,7 +410,8 @@ class OptionsParser():
         r = RdRanks()
         r.run(options.input_tree,
                 options.thresholds,
-                options.output_dir)
+                options.output_dir,
+                options.cpus)
 
         self.logger.info('Done.')
         
@@ -464,20 +488,18 @@ class OptionsParser():
             taxa_out.write('Rank\tLowest Rank\tTaxon\n')
 
         # determine taxonomic resolution of named groups
-        tree = dendropy.Tree.get_from_path(options.input_tree, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree = read_tree(options.input_tree)
         
         rank_res = defaultdict(lambda: defaultdict(int))
         for node in tree.preorder_node_iter(lambda n: n != tree.seed_node):
             if not node.label or node.is_leaf():
                 continue
 
-            _support, taxon_name, _auxiliary_info = parse_label(node.label)
+            taxon_label = parse_taxon_label(node.label)
+            taxon_name = taxon_label.taxon
             
             if taxon_name:
-                lowest_rank = [x.strip() for x in taxon_name.split(';')][-1][0:3]
+                lowest_rank = taxon_label.taxa[-1][0:3]
                 for rank_prefix in Taxonomy.rank_prefixes:
                     if rank_prefix in taxon_name:
                         rank_res[rank_prefix][lowest_rank] += 1
@@ -545,6 +567,8 @@ class OptionsParser():
             self.tax_diff(options)
         elif(options.subparser_name == 'decorate'):
             self.decorate(options)
+        elif(options.subparser_name == 'compile_tree'):
+            self.compile_tree(options)
         elif(options.subparser_name == 'pull'):
             self.pull(options)
         elif(options.subparser_name == 'validate'):
@@ -20,9 +20,9 @@ import logging
 from collections import defaultdict
 
 from phylorank.rel_dist import RelativeDistance
-from phylorank.newick import parse_label
+from phylorank.newick import parse_taxon_label
+from phylorank.common import read_tree
 
-import dendropy
 
 '''
 To do:
@@ -76,10 +76,7 @@ class MarkTree():
         """
 
         # make sure we have a TreeNode object
-        tree = dendropy.Tree.get_from_path(input_tree, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree = read_tree(input_tree)
 
         # calculate relative distance for all nodes
         rd = RelativeDistance()
@@ -103,7 +100,7 @@ class MarkTree():
 
             # parse taxon name and support value from node label
             if n.label:
-                support, taxon_name, _auxiliary_info = parse_label(n.label)
+                support, taxon_name = parse_taxon_label(n.label)[0:2]
                 n.label += '|'
             else:
                 support = 100
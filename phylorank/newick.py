@@ -16,7 +16,15 @@
 ###############################################################################
 
 
+import re
+from collections import namedtuple
+from functools import lru_cache
+from itertools import chain
+
 from biolib.common import is_float
+from biolib.taxonomy import Taxonomy
+
+from phylorank.compact_tree import CompactTree
 
 
 '''Helper functions for parsing Newick information.'''
@@ -59,3 +67,185 @@ def parse_label(label):
                 taxon = label
 
     return support, taxon, auxiliary_info
+
+
+# parsed representation of a Newick label
+TaxonLabel = namedtuple('TaxonLabel', 'support taxon taxa rank_index auxiliary_info')
+
+# maximum number of distinct labels with a cached parse
+TAXON_LABEL_CACHE_SIZE = 1 << 18
+
+
+@lru_cache(maxsize=TAXON_LABEL_CACHE_SIZE)
+def parse_taxon_label(label):
+    """Parse a Newick label into a structured record.
+
+    Parsed labels are cached, so repeated requests for the same
+    label do not require any string processing. The cache holds
+    the most recently used labels and can be emptied with
+    parse_taxon_label.cache_clear().
+
+    Parameters
+    ----------
+    label : str
+        Internal label in a Newick tree.
+
+    Returns
+    -------
+    TaxonLabel
+        Support value (or None), taxon string (or None), individual taxa
+        in the taxon string, rank index of the most-specific taxon (or None),
+        and auxiliary information (or None).
+    """
+
+    support, taxon, auxiliary_info = parse_label(label)
+
+    taxa = ()
+    rank_index = None
+    if taxon:
+        taxa = tuple([x.strip() for x in taxon.split(';')])
+        rank_index = Taxonomy.rank_index.get(taxa[-1][0:3])
+
+    return TaxonLabel(support, taxon, taxa, rank_index, auxiliary_info)
+
+
+# Newick token: quoted label, comment, structural character, unquoted
+# label, or a single unmatched character which is reported as invalid
+_newick_token = re.compile(r"'(?:[^']|'')*'|\[[^\]]*\]|[(),:;]|[^\s(),:;\[\]']+|\S")
+
+
+def _newick_tokens(fin, chunk_size):
+    """Generate lists of tokens from a Newick file read in fixed size chunks."""
+
+    buf = ''
+    eof = False
+    while not eof:
+        chunk = fin.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+
+        carry = ''
+        tokens = _newick_token.findall(buf)
+        if not eof and ("'" in tokens or '[' in tokens):
+            # a quoted label or comment continues in the next chunk, in
+            # which case its opening character is an unmatched token; a
+            # quote within a comment or bracket within a quoted label
+            # is part of the enclosing token so is not mistaken for one
+            for m in _newick_token.finditer(buf):
+                if m.group() in ("'", '['):
+                    buf, carry = buf[0:m.start()], buf[m.start():]
+                    break
+            tokens = _newick_token.findall(buf)
+
+        if tokens and not eof:
+            # the last token may be incomplete
+            end = len(buf.rstrip())
+            last_token = tokens.pop()
+            carry = buf[end - len(last_token):] + carry
+
+        yield tokens
+        buf = carry
+
+
+def _unquote(token):
+    """Get label specified by a Newick token."""
+
+    if token[0] == "'":
+        return token[1:-1].replace("''", "'")
+
+    return token
+
+
+def read_newick(tree_file, chunk_size=1 << 20):
+    """Read first tree in a Newick file into a compact tree.
+
+    The tree is treated as rooted and underscores in labels are preserved,
+    matching how PhyloRank reads trees with Dendropy. Labels of leaf nodes
+    are taxon labels, while labels of internal nodes are retained verbatim
+    so they can be parsed with parse_taxon_label.
+
+    Parameters
+    ----------
+    tree_file : str
+        Newick file.
+    chunk_size : int
+        Number of characters to read at a time.
+
+    Returns
+    -------
+    CompactTree
+        Tree with nodes in preorder.
+    """
+
+    parent = []
+    edge_length = []
+    labels = []
+    taxa = []
+
+    open_nodes = []         # internal nodes whose children are being read
+    last_node = -1          # node to which a label or edge length applies
+    expect_child = True     # next label starts a new leaf node
+    expect_length = False   # next token is an edge length
+
+    with open(tree_file) as fin:
+        for token in chain.from_iterable(_newick_tokens(fin, chunk_size)):
+            c = token[0]
+            if c == '[':
+                # comments such as rooting statements are ignored
+                if token[-1] != ']' or len(token) == 1:
+                    raise ValueError('Unterminated comment in Newick file.')
+                continue
+
+            if expect_length:
+                edge_length[last_node] = float(token)
+                expect_length = False
+                continue
+
+            if c == '(':
+                parent.append(open_nodes[-1] if open_nodes else -1)
+                edge_length.append(0.0)
+                labels.append(None)
+                taxa.append(None)
+                open_nodes.append(len(parent) - 1)
+                expect_child = True
+            elif c == ',' or c == ')' or c == ':':
+                if expect_child:
+                    # leaf node without a label
+                    parent.append(open_nodes[-1] if open_nodes else -1)
+                    edge_length.append(0.0)
+                    labels.append(None)
+                    taxa.append(None)
+                    last_node = len(parent) - 1
+                    expect_child = False
+
+                if c == ',':
+                    if not open_nodes:
+                        raise ValueError('Unexpected comma outside of parentheses in Newick file.')
+                    expect_child = True
+                elif c == ')':
+                    if not open_nodes:
+                        raise ValueError('Unbalanced parentheses in Newick file.')
+                    last_node = open_nodes.pop()
+                else:
+                    expect_length = True
+            elif c == ';':
+                break
+            elif len(token) == 1 and (c == "'" or c == ']'):
+                raise ValueError('Unexpected %s in Newick file.' % c)
+            elif expect_child:
+                parent.append(open_nodes[-1] if open_nodes else -1)
+                edge_length.append(0.0)
+                labels.append(None)
+                taxa.append(_unquote(token))
+                last_node = len(parent) - 1
+                expect_child = False
+            else:
+                labels[last_node] = _unquote(token)
+
+    if open_nodes:
+        raise ValueError('Unbalanced parentheses in Newick file.')
+
+    if not parent:
+        raise ValueError('Newick file does not contain a tree: %s' % tree_file)
+
+    return CompactTree(parent, edge_length, labels, taxa)
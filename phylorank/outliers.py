@@ -18,19 +18,24 @@
 import os
 import sys
 import logging
-import random
+import warnings
+import multiprocessing as mp
 from collections import defaultdict, namedtuple
 
 from phylorank.rel_dist import RelativeDistance
+from phylorank.compact_tree import CompactTree
+from phylorank.all_rootings import AllRootings
 from phylorank.common import (read_taxa_file,
+                              read_tree,
                               filter_taxa_for_dist_inference,
                               is_integer,
-                              get_phyla_lineages)
-from phylorank.newick import parse_label
+                              get_phyla_lineages,
+                              get_left_right_taxa)
+from phylorank.newick import parse_taxon_label
+from phylorank.quantiles import StreamingQuantile
 
 from biolib.taxonomy import Taxonomy
 from biolib.plots.abstract_plot import AbstractPlot
-from biolib.external.execute import check_dependencies
 
 from numpy import (mean as np_mean,
                    std as np_std,
@@ -41,14 +46,99 @@ from numpy import (mean as np_mean,
                    linspace as np_linspace,
                    percentile as np_percentile,
                    ones_like as np_ones_like,
+                   zeros as np_zeros,
+                   int32 as np_int32,
+                   full as np_full,
+                   nan as np_nan,
+                   nanmedian as np_nanmedian,
+                   argmin as np_argmin,
+                   select as np_select,
+                   float32 as np_float32,
+                   float64 as np_float64,
                    histogram as np_histogram)
 
 from scipy.stats import norm
 
-import dendropy
 import mpld3
 
 
+# rootings evaluated by the current process
+_rootings = None
+_named_clades = None
+_taxon_names = None
+
+
+def _init_phylum_rooting(rootings, named_clades, taxon_names):
+    """Set tree information used to evaluate rootings."""
+
+    global _rootings, _named_clades, _taxon_names
+    _rootings = rootings
+    _named_clades = named_clades
+    _taxon_names = taxon_names
+
+
+def _phylum_rooting(phylum_outgroup):
+    """Calculate relative divergence with tree rooted on a phylum.
+
+    Parameters
+    ----------
+    phylum_outgroup : (str, list)
+        Phylum to root on and indices of leaf nodes in the phylum.
+
+    Returns
+    -------
+    int
+        Number of leaves on the outgroup side of the rooting.
+    dict : d[rank_index][taxon] -> relative divergence
+        Relative divergence of named groups.
+    list
+        Indices of nodes in the ingroup in preorder.
+    list
+        Relative divergence of nodes in the ingroup.
+    """
+
+    p, outgroup_leaves = phylum_outgroup
+
+    if len(outgroup_leaves) == 0:
+        return 0, None, None, None
+
+    compact_tree = _rootings.tree
+    outgroup_mask = np_zeros(compact_tree.num_nodes, dtype=bool)
+    outgroup_mask[outgroup_leaves] = True
+
+    root_node, outgroup_below, leaves_in_outgroup = compact_tree.outgroup_edge(outgroup_mask)
+
+    # calculate relative distance to all nodes
+    cur_rel_dists = _rootings.rel_dist(root_node)
+
+    # calculate relative distance to taxa; nodes without a relative
+    # distance are not present in the rerooted tree
+    rel_dists = defaultdict(dict)
+    for rank_index, (nodes, taxa) in _named_clades.items():
+        for taxon_name, rel_dist in zip(taxa, cur_rel_dists[nodes].tolist()):
+            if rel_dist == rel_dist:
+                rel_dists[rank_index][taxon_name] = rel_dist
+    rel_dists.pop(0, None) # remove results for Domain
+
+    # determine which lineages represents the 'ingroup'; the
+    # lineage containing the outgroup is the first child of the root
+    node, other = _rootings.root_children(root_node)
+    root_children = (node, other) if outgroup_below else (other, node)
+    ingroup_subtree = root_children[1]
+    for c in root_children:
+        taxon_name = _taxon_names[c]
+        if not taxon_name or p not in taxon_name:
+            ingroup_subtree = c
+            break
+
+    ingroup_nodes = _rootings.ingroup_nodes(root_node, ingroup_subtree != root_node)
+
+    return (leaves_in_outgroup,
+            rel_dists,
+            ingroup_nodes.tolist(),
+            cur_rel_dists[ingroup_nodes].tolist())
+
+
 class Outliers(AbstractPlot):
     """Identify outliers based on relative distances.
 
@@ -71,89 +161,7 @@ class Outliers(AbstractPlot):
         AbstractPlot.__init__(self, options)
         
         self.dpi = dpi
-
-        check_dependencies(['genometreetk'])
-        
-    def root_with_outgroup(self, input_tree, taxonomy, outgroup_taxa):
-        """Reroot the tree using the given outgroup.
-
-        Parameters
-        ----------
-        input_tree : Dendropy Tree
-          Tree to rerooted.
-        taxonomy : dict
-            Taxonomy for taxa.
-        outgroup : iterable
-          Labels of taxa in outgroup.
-          
-        Returns
-        -------
-        Dendropy Tree
-            Deep-copy of original tree rerooted on outgroup.
-        """
-        
-        new_tree = input_tree.clone()
-        
-        outgroup = set()
-        for genome_id, taxa in taxonomy.items():
-            if outgroup_taxa in taxa:
-                outgroup.add(genome_id)
-        self.logger.info('Identifying %d genomes in the outgroup.' % len(outgroup))
-
-        outgroup_in_tree = set()
-        ingroup_in_tree = set()
-        for n in new_tree.leaf_node_iter():
-            if n.taxon.label in outgroup:
-                outgroup_in_tree.add(n.taxon)
-            else:
-                ingroup_in_tree.add(n)
-        self.logger.info('Identified %d outgroup taxa in the tree.' % len(outgroup_in_tree))
-
-        if len(outgroup_in_tree) == 0:
-            self.logger.warning('No outgroup taxa identified in the tree.')
-            self.logger.warning('Tree was not rerooted.')
-            sys.exit(0)
-            
-        # There is a complication here. We wish to find the MRCA of the outgroup
-        # taxa. Finding the MRCA requires a rooted tree and we have no gaurantee
-        # that the tree isn't currently rooted within the outgroup clade. There is
-        # also no way to identify a node that is gauranteed to be outside the outgroup
-        # clade. As such, the tree is randomly rooted on a leaf node not in the outgroup.
-        # This random rerooting is performed until the MRCA does not spans all taxa in 
-        # the tree.
-
-        leaves_in_tree = sum([1 for _ in new_tree.leaf_node_iter()])
-        while True:
-            rnd_ingroup_leaf = random.sample(ingroup_in_tree, 1)[0]
-            new_tree.reroot_at_edge(rnd_ingroup_leaf.edge,
-                                    length1=0.5 * rnd_ingroup_leaf.edge_length,
-                                    length2=0.5 * rnd_ingroup_leaf.edge_length)
-
-            mrca = new_tree.mrca(taxa=outgroup_in_tree)
-            leaves_in_mrca = sum([1 for _ in mrca.leaf_iter()])
-            if leaves_in_mrca != leaves_in_tree:
-                break
-
-        if leaves_in_mrca != len(outgroup_in_tree):
-            self.logger.info('Outgroup is not monophyletic. Tree will be rerooted at the MRCA of the outgroup.')
-            self.logger.info('The outgroup consisted of %d taxa, while the MRCA has %d leaf nodes.' % (len(outgroup_in_tree), leaves_in_mrca))
-            if leaves_in_mrca == leaves_in_tree:
-                self.logger.warning('The MRCA spans all taxa in the tree.')
-                self.logger.warning('This indicating the selected outgroup is likely polyphyletic in the current tree.')
-                self.logger.warning('Polyphyletic outgroups are not suitable for rooting. Try another outgroup.')
-        else:
-            self.logger.info('Outgroup is monophyletic.')
-
-        if mrca.edge_length is None:
-            self.logger.info('Tree appears to already be rooted on this outgroup.')
-        else:
-            self.logger.info('Rerooting tree.')
-            new_tree.reroot_at_edge(mrca.edge,
-                                length1=0.5 * mrca.edge_length,
-                                length2=0.5 * mrca.edge_length)
         
-        return new_tree
-
     def _distribution_plot(self, rel_dists, taxa_for_dist_inference, distribution_table, plot_file):
         """Create plot showing the distribution of taxa at each taxonomic rank.
 
@@ -361,61 +369,104 @@ class Outliers(AbstractPlot):
                 
             median_rel_dist[rank] = np_median(v)
 
+        rows = ['Taxa\tGTDB taxonomy\tMedian distance\tMean difference\tClosest rank\tClassification\n']
+        for rank in sorted(rel_dists.keys()):
+            taxa = list(rel_dists[rank].keys())
+            dists = np_array(list(rel_dists[rank].values()), dtype=np_float64)
+            parents = [';'.join(gtdb_parent_ranks[clade_label]) for clade_label in taxa]
+
+            if rank in median_rel_dist:
+                delta, closest_rank, classification = self._classify_rd(dists, rank, median_rel_dist)
+                rows += ['%s\t%s\t%.3f\t%.3f\t%s\t%s\n' % r
+                            for r in zip(taxa, parents, dists.tolist(), delta.tolist(), closest_rank, classification)]
+            else:
+                rows += ['%s\t%s\t%.3f\t%.3f\t%s\t%s\n' % (clade_label, parent_str, dist, -1,
+                                                                'NA', 'Insufficent data to calcualte median for rank.')
+                            for clade_label, parent_str, dist in zip(taxa, parents, dists.tolist())]
+
         fout = open(output_file, 'w')
-        fout.write('Taxa\tGTDB taxonomy\tMedian distance\tMean difference\tClosest rank\tClassification\n')
-            
-        for i, rank in enumerate(sorted(rel_dists.keys())):
-            for clade_label, dist in rel_dists[rank].items():
-                if rank in median_rel_dist:
-                    delta = dist - median_rel_dist[rank]
-                    closest_rank_dist = 1e10
-                    for test_rank, test_median in median_rel_dist.items():
-                        abs_dist = abs(dist - test_median)
-                        if abs_dist < closest_rank_dist:
-                            closest_rank_dist = abs_dist
-                            closest_rank = Taxonomy.rank_labels[test_rank]
-
-                    classification = "OK"
-                    if delta < -0.2:
-                        classification = "very overclassified"
-                    elif delta < -0.1:
-                        classification = "overclassified"
-                    elif delta > 0.2:
-                        classification = "very underclassified"
-                    elif delta > 0.1:
-                        classification = "underclassified"
-
-                    fout.write('%s\t%s\t%.3f\t%.3f\t%s\t%s\n' % (clade_label,
-                                                                   ';'.join(gtdb_parent_ranks[clade_label]),
-                                                                   dist,
-                                                                   delta,
-                                                                   closest_rank,
-                                                                   classification))
-                else:
-                    fout.write('%s\t%s\t%.3f\t%.3f\t%s\t%s\n' % (clade_label,
-                                                                   ';'.join(gtdb_parent_ranks[clade_label]),
-                                                                   dist,
-                                                                   -1,
-                                                                   'NA',
-                                                                   'Insufficent data to calcualte median for rank.'))
+        fout.write(''.join(rows))
         fout.close()
-        
-    def taxa_median_rd(self, phylum_rel_dists):
-        """Calculate the median relative divergence for each taxon.
-        
+
+    def _classify_rd(self, rel_dists, rank, median_for_rank):
+        """Classify taxa relative to the median relative divergence of ranks.
+
+        Parameters
+        ----------
+        rel_dists : ndarray
+            Relative divergence of taxa at a rank.
+        rank : int
+            Rank index of taxa.
+        median_for_rank : d[rank_index] -> float
+            Median relative divergence of each rank.
+
+        Returns
+        -------
+        ndarray
+            Difference between each taxon and the median of its rank.
+        list
+            Rank with median closest to each taxon.
+        list
+            Classification of each taxon.
+        """
+
+        ranks = list(median_for_rank.keys())
+        rank_medians = np_array([median_for_rank[r] for r in ranks], dtype=np_float64)
+
+        delta = rel_dists - median_for_rank[rank]
+
+        # ties are resolved in favour of the first rank
+        closest = np_argmin(np_abs(rel_dists[:, None] - rank_medians[None, :]), axis=1)
+        rank_labels = [Taxonomy.rank_labels[r] for r in ranks]
+        closest_rank = [rank_labels[c] for c in closest.tolist()]
+
+        classification = np_select([delta < -0.2, delta < -0.1, delta > 0.2, delta > 0.1],
+                                    ['very overclassified', 'overclassified', 'very underclassified', 'underclassified'],
+                                    default='OK')
+
+        return delta, closest_rank, classification.tolist()
+
+    def taxa_rd_matrix(self, phylum_rel_dists):
+        """Get relative divergence of taxa under each rooting as a dense matrix.
+
         Parameters
         ----------
         phylum_rel_dists: phylum_rel_dists[phylum][rank_index][taxon] -> relative divergences
-            Relative divergence of taxon at each rank for different phylum-level rootings.    
+            Relative divergence of taxon at each rank for different phylum-level rootings.
+
+        Returns
+        -------
+        d[rank_index] -> (list, ndarray)
+            Taxa at each rank in order of first appearance and their
+            relative divergence under each rooting, with NaN indicating
+            the taxon was not present under a rooting.
         """
-        
-        medians_for_taxa = defaultdict(lambda: defaultdict(list))
-        for p in phylum_rel_dists:
+
+        taxon_index = defaultdict(dict)
+        entries = defaultdict(list)
+        for j, p in enumerate(phylum_rel_dists):
             for rank, d in phylum_rel_dists[p].items():
+                index = taxon_index[rank]
                 for taxon, dist in d.items():
-                    medians_for_taxa[rank][taxon].append(dist)
-                    
-        return medians_for_taxa
+                    entries[rank].append((index.setdefault(taxon, len(index)), j, dist))
+
+        rd_matrix = {}
+        for rank, index in taxon_index.items():
+            rows, cols, dists = zip(*entries[rank]) if entries[rank] else ((), (), ())
+            m = np_full((len(index), len(phylum_rel_dists)), np_nan)
+            m[np_array(rows, dtype=np_int32), np_array(cols, dtype=np_int32)] = dists
+            rd_matrix[rank] = (list(index.keys()), m)
+
+        return rd_matrix
+
+    def _taxa_median_matrix(self, phylum_rel_dists):
+        """Get median relative divergence of taxa at each rank over all rootings."""
+
+        taxa_medians = {}
+        for rank, (taxa, m) in self.taxa_rd_matrix(phylum_rel_dists).items():
+            taxa_medians[rank] = (taxa, np_nanmedian(m, axis=1))
+
+        return taxa_medians
         
     def rank_median_rd(self, phylum_rel_dists, taxa_for_dist_inference):
         """Calculate median relative divergence for each rank.
@@ -428,14 +479,14 @@ class Outliers(AbstractPlot):
             Taxa to considered when inferring distributions.
         """
         
-        medians_for_taxa = self.taxa_median_rd(phylum_rel_dists)
+        taxa_medians = self._taxa_median_matrix(phylum_rel_dists)
     
         median_for_rank = {}
-        for i, rank in enumerate(sorted(medians_for_taxa.keys())):
-                v = [np_median(dists) for taxon, dists in medians_for_taxa[rank].items() if taxon in taxa_for_dist_inference]
-                
-                if v:
-                    median_for_rank[rank] = np_median(v)
+        for rank in sorted(taxa_medians.keys()):
+            taxa, medians = taxa_medians[rank]
+            in_dist = np_array([taxon in taxa_for_dist_inference for taxon in taxa], dtype=bool)
+            if in_dist.any():
+                median_for_rank[rank] = np_median(medians[in_dist])
                 
         return median_for_rank
         
@@ -457,12 +508,13 @@ class Outliers(AbstractPlot):
         ax = self.fig.add_subplot(111)
 
         # determine median relative distance for each taxa
-        medians_for_taxa = self.taxa_median_rd(phylum_rel_dists)
+        taxa_medians = self._taxa_median_matrix(phylum_rel_dists)
 
         # create percentile and classification boundary lines
         percentiles = {}
-        for i, rank in enumerate(sorted(medians_for_taxa.keys())):
-            v = [np_median(dists) for taxon, dists in medians_for_taxa[rank].items() if taxon in taxa_for_dist_inference]
+        for i, rank in enumerate(sorted(taxa_medians.keys())):
+            taxa, medians = taxa_medians[rank]
+            v = [md for taxon, md in zip(taxa, medians.tolist()) if taxon in taxa_for_dist_inference]
             if not v:
                 # not taxa at rank suitable for creating classification boundaries
                 continue
@@ -489,15 +541,15 @@ class Outliers(AbstractPlot):
         c = []
         labels = []
         rank_labels = []
-        for i, rank in enumerate(sorted(medians_for_taxa.keys())):
+        for i, rank in enumerate(sorted(taxa_medians.keys())):
+            taxa, medians = taxa_medians[rank]
             rank_label = Taxonomy.rank_labels[rank]
-            rank_labels.append(rank_label + ' (%d)' % len(medians_for_taxa[rank]))
+            rank_labels.append(rank_label + ' (%d)' % len(taxa))
 
             mono = []
             poly = []
             no_inference = []
-            for clade_label, dists in medians_for_taxa[rank].items():
-                md = np_median(dists)
+            for clade_label, md in zip(taxa, medians.tolist()):
                 x.append(md)
                 y.append(i)
                 labels.append(clade_label)
@@ -569,8 +621,8 @@ class Outliers(AbstractPlot):
         ax.set_xlim([-0.01, 1.01])
 
         ax.set_ylabel('rank (no. taxa)')
-        ax.set_yticks(range(0, len(medians_for_taxa)))
-        ax.set_ylim([-0.2, len(medians_for_taxa) - 0.01])
+        ax.set_yticks(range(0, len(taxa_medians)))
+        ax.set_ylim([-0.2, len(taxa_medians) - 0.01])
         ax.set_yticklabels(rank_labels)
 
         self.prettify(ax)
@@ -609,7 +661,7 @@ class Outliers(AbstractPlot):
         """
         
         # determine median relative distance for each taxa
-        medians_for_taxa = self.taxa_median_rd(phylum_rel_dists)
+        taxa_medians = self._taxa_median_matrix(phylum_rel_dists)
         
         # determine median relative distance for each rank
         median_for_rank = self.rank_median_rd(phylum_rel_dists, taxa_for_dist_inference)
@@ -621,53 +673,28 @@ class Outliers(AbstractPlot):
         fout_rank.write('{' + ','.join(median_str) + '}\n')
         fout_rank.close()
             
-        fout = open(outlier_table, 'w')
         if verbose_table:
-            fout.write('Taxa\tGTDB taxonomy\tMedian distance')
-            fout.write('\tMedian of rank\tMedian difference')
-            fout.write('\tClosest rank\tClassifciation\n')
+            rows = ['Taxa\tGTDB taxonomy\tMedian distance\tMedian of rank\tMedian difference\tClosest rank\tClassifciation\n']
         else:
-            fout.write('Taxa\tGTDB taxonomy\tMedian distance\tMedian difference\tClosest rank\tClassification\n')
+            rows = ['Taxa\tGTDB taxonomy\tMedian distance\tMedian difference\tClosest rank\tClassification\n']
         
         for rank in sorted(median_for_rank.keys()):
-            for clade_label, dists in medians_for_taxa[rank].items():
-                dists = np_array(dists)
-
-                taxon_median = np_median(dists)
-                delta = taxon_median - median_for_rank[rank]
-
-                closest_rank_dist = 1e10
-                for test_rank, test_median in median_for_rank.items():
-                    abs_dist = abs(taxon_median - test_median)
-                    if abs_dist < closest_rank_dist:
-                        closest_rank_dist = abs_dist
-                        closest_rank = Taxonomy.rank_labels[test_rank]
-
-                classification = "OK"
-                if delta < -0.2:
-                    classification = "very overclassified"
-                elif delta < -0.1:
-                    classification = "overclassified"
-                elif delta > 0.2:
-                    classification = "very underclassified"
-                elif delta > 0.1:
-                    classification = "underclassified"
-
-                if verbose_table:
-                    fout.write('%s\t%s\t%.2f\t%.3f\t%.3f\t%s\t%s\n' % (clade_label,
-                                                                       ';'.join(gtdb_parent_ranks[clade_label]),
-                                                                       taxon_median,
-                                                                       median_for_rank[rank],
-                                                                       delta,
-                                                                       closest_rank,
-                                                                       classification))
-                else:
-                    fout.write('%s\t%s\t%.3f\t%.3f\t%s\t%s\n' % (clade_label,
-                                                                   ';'.join(gtdb_parent_ranks[clade_label]),
-                                                                   taxon_median,
-                                                                   delta,
-                                                                   closest_rank,
-                                                                   classification))
+            taxa, taxon_medians = taxa_medians[rank]
+            delta, closest_rank, classification = self._classify_rd(taxon_medians, rank, median_for_rank)
+            parents = [';'.join(gtdb_parent_ranks[clade_label]) for clade_label in taxa]
+
+            if verbose_table:
+                rank_median = [median_for_rank[rank]] * len(taxa)
+                rows += ['%s\t%s\t%.2f\t%.3f\t%.3f\t%s\t%s\n' % r
+                            for r in zip(taxa, parents, taxon_medians.tolist(), rank_median,
+                                            delta.tolist(), closest_rank, classification)]
+            else:
+                rows += ['%s\t%s\t%.3f\t%.3f\t%s\t%s\n' % r
+                            for r in zip(taxa, parents, taxon_medians.tolist(),
+                                            delta.tolist(), closest_rank, classification)]
+
+        fout = open(outlier_table, 'w')
+        fout.write(''.join(rows))
         fout.close()
 
     def rd_fixed_root(self, tree, taxa_for_dist_inference):
@@ -683,20 +710,25 @@ class Outliers(AbstractPlot):
         
         # calculate relative distance to taxa
         rd = RelativeDistance()
-        rel_dists = rd.rel_dist_to_named_clades(tree)
+        compact_tree = CompactTree.from_dendropy(tree)
+        rel_dists = rd.rel_dist_to_named_clades(compact_tree)
         
         # create scaled tree
-        rd.decorate_rel_dist(tree)
-        for n in tree.preorder_node_iter(lambda n: n != tree.seed_node):
-            rd_to_parent = n.rel_dist - n.parent_node.rel_dist
-            n.edge_length = rd_to_parent
+        rel_node_dists = compact_tree.rel_dist.tolist()
+        tree.seed_node.rel_dist = rel_node_dists[0]
+        for i in range(1, compact_tree.num_nodes):
+            n = compact_tree.nodes[i]
+            n.rel_dist = rel_node_dists[i]
+            n.edge_length = n.rel_dist - rel_node_dists[compact_tree.parent[i]]
         
         return rel_dists
 
     def median_rd_over_phyla(self, 
                                 tree, 
                                 taxa_for_dist_inference,
-                                taxonomy):
+                                taxonomy,
+                                cpus=1,
+                                streaming_median=False):
         """Calculate the median relative divergence over all phyla rootings.
         
         Parameters
@@ -707,6 +739,17 @@ class Outliers(AbstractPlot):
           Taxa to use for inference relative divergence distributions.
         taxonomy : d[taxon_id] -> [d__, p__, ..., s__]
           Taxonomy of extant taxa.
+        cpus : int
+          Number of processes to use for evaluating rootings.
+        streaming_median : boolean
+          Estimate median relative divergence of nodes with streaming quantiles instead of retaining all values.
+
+        Returns
+        -------
+        dict : d[phylum][rank_index][taxon] -> relative divergence
+            Relative divergence of named groups under each phylum rooting.
+        ndarray
+            Median relative divergence of each node in preorder over rootings where it is in the ingroup.
         """
     
         # get list of phyla level lineages
@@ -722,20 +765,86 @@ class Outliers(AbstractPlot):
         # give each node a unique id
         for i, n in enumerate(tree.preorder_node_iter()):
             n.id = i
-    
-        # calculate relative divergence for tree rooted on each phylum
-        phylum_rel_dists = {}
-        rel_node_dists = defaultdict(list)
+
+        # the relative divergence under each rooting is inferred from
+        # a single unrooted representation of the tree, rather than by
+        # explicitly rerooting a copy of the tree on each phylum
         rd = RelativeDistance()
+        compact_tree = CompactTree.from_dendropy(tree)
+        rootings = AllRootings(compact_tree)
+
+        # labels are parsed once so evaluating
+        # each rooting requires no string processing
+        named_clade_nodes = defaultdict(list)
+        named_clade_taxa = defaultdict(list)
+        for i, rank_index, taxon_name in rd.named_clades(compact_tree):
+            named_clade_nodes[rank_index].append(i)
+            named_clade_taxa[rank_index].append(taxon_name)
+
+        named_clades = {}
+        for rank_index in named_clade_nodes:
+            named_clades[rank_index] = (np_array(named_clade_nodes[rank_index], dtype=np_int32),
+                                        named_clade_taxa[rank_index])
+
+        taxon_names = [parse_taxon_label(label).taxon for label in compact_tree.labels]
+
+        leaf_index = {}
+        for i, taxon_label in enumerate(compact_tree.taxa):
+            if taxon_label is not None:
+                leaf_index[taxon_label] = i
+
+        phyla_genomes = defaultdict(list)
+        phyla_set = set(phyla)
+        for genome_id, taxa in taxonomy.items():
+            for t in set(taxa).intersection(phyla_set):
+                phyla_genomes[t].append(genome_id)
+
+        rootings_to_process = []
         for p in phyla:
+            outgroup_leaves = [leaf_index[genome_id] for genome_id in phyla_genomes[p]
+                                if genome_id in leaf_index]
+            rootings_to_process.append((p, outgroup_leaves))
+
+        # evaluate rooting on each phylum; workers receive the tree once
+        # and results are merged in the order of the phyla
+        if cpus > 1:
+            self.logger.info('Evaluating rootings using %d processes.' % cpus)
+            pool = mp.Pool(processes=cpus,
+                            initializer=_init_phylum_rooting,
+                            initargs=(rootings, named_clades, taxon_names))
+            rooting_results = pool.imap(_phylum_rooting, rootings_to_process)
+        else:
+            pool = None
+            _init_phylum_rooting(rootings, named_clades, taxon_names)
+            rooting_results = map(_phylum_rooting, rootings_to_process)
+
+        # relative divergence of nodes in the 'ingroup' of each rooting
+        if streaming_median:
+            node_rd_median = StreamingQuantile(compact_tree.num_nodes)
+        else:
+            rel_node_dists = np_full((compact_tree.num_nodes, len(phyla)), np_nan, dtype=np_float32)
+
+        # calculate relative divergence for tree rooted on each phylum
+        phylum_rel_dists = {}
+        for phylum_index, ((p, outgroup_leaves), result) in enumerate(zip(rootings_to_process, rooting_results)):
             phylum = p.replace('p__', '').replace(' ', '_').lower()
             self.logger.info('Calculating information with rooting on %s.' % phylum.capitalize())
-            
-            cur_tree = self.root_with_outgroup(tree, taxonomy, p)
-            
-            # calculate relative distance to taxa
-            rel_dists = rd.rel_dist_to_named_clades(cur_tree)
-            rel_dists.pop(0, None) # remove results for Domain
+
+            self.logger.info('Identifying %d genomes in the outgroup.' % len(phyla_genomes[p]))
+            self.logger.info('Identified %d outgroup taxa in the tree.' % len(outgroup_leaves))
+            if len(outgroup_leaves) == 0:
+                self.logger.warning('No outgroup taxa identified in the tree.')
+                self.logger.warning('Tree was not rerooted.')
+                if pool:
+                    pool.terminate()
+                sys.exit(0)
+
+            leaves_in_outgroup, rel_dists, ingroup_nodes, ingroup_rel_dists = result
+            if leaves_in_outgroup != len(outgroup_leaves):
+                self.logger.info('Outgroup is not monophyletic. Tree will be rerooted at the MRCA of the outgroup.')
+                self.logger.info('The outgroup consisted of %d taxa, while the MRCA has %d leaf nodes.' % (len(outgroup_leaves), leaves_in_outgroup))
+            else:
+                self.logger.info('Outgroup is monophyletic.')
 
             # remove named groups in outgroup
             children = Taxonomy().children(p, taxonomy)
@@ -747,36 +856,41 @@ class Outliers(AbstractPlot):
                     rel_dists[r].pop(t, None)
 
             phylum_rel_dists[phylum] = rel_dists
-            
-            # calculate relative distance to all nodes
-            rd.decorate_rel_dist(cur_tree)
-            
-            # determine which lineages represents the 'ingroup'
-            ingroup_subtree = None
-            for c in cur_tree.seed_node.child_node_iter():
-                _support, taxon_name, _auxiliary_info = parse_label(c.label)
-                if not taxon_name or p not in taxon_name:
-                    ingroup_subtree = c
-                    break
-            
-            # do a preorder traversal of 'ingroup' and record relative divergence to nodes
-            for n in ingroup_subtree.preorder_iter():                        
-                rel_node_dists[n.id].append(n.rel_dist)
-                                                           
-        return phylum_rel_dists, rel_node_dists
+
+            # record relative divergence to nodes in 'ingroup'
+            if streaming_median:
+                node_rd_median.add(ingroup_nodes, ingroup_rel_dists)
+            else:
+                rel_node_dists[ingroup_nodes, phylum_index] = ingroup_rel_dists
+
+        if pool:
+            pool.close()
+            pool.join()
+
+        if streaming_median:
+            node_rd = node_rd_median.quantile()
+        else:
+            # nodes never in the ingroup have no median
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                node_rd = np_nanmedian(rel_node_dists, axis=1).astype(np_float64)
+
+        return phylum_rel_dists, node_rd
         
     def _write_rd(self, tree, output_rd_file):
         """Write out relative divergences for each node."""
-        
-        fout = open(output_rd_file, 'w')
+
+        left_taxon, right_taxon = get_left_right_taxa(tree)
+
+        rows = []
         for n in tree.preorder_node_iter():
             if n.is_leaf():
-                fout.write('%s\t%f\n' % (n.taxon.label, n.rel_dist))
+                rows.append('%s\t%f\n' % (n.taxon.label, n.rel_dist))
             else:
-                # get left and right taxa that define this node
-                taxa = list(n.preorder_iter(lambda n: n.is_leaf()))
-                fout.write('%s|%s\t%f\n' % (taxa[0].taxon.label, taxa[-1].taxon.label, n.rel_dist))
-                
+                rows.append('%s|%s\t%f\n' % (left_taxon[n], right_taxon[n], n.rel_dist))
+
+        fout = open(output_rd_file, 'w', 1024 * 1024)
+        fout.writelines(rows)
         fout.close()
         
     def run(self, input_tree, 
@@ -789,7 +903,9 @@ class Outliers(AbstractPlot):
                     fixed_root,
                     min_children, 
                     min_support,
-                    verbose_table):
+                    verbose_table,
+                    cpus=1,
+                    streaming_median=False):
         """Determine distribution of taxa at each taxonomic rank.
 
         Parameters
@@ -816,14 +932,15 @@ class Outliers(AbstractPlot):
           Only consider taxa with at least this level of support when inferring distribution.
         verbose_table : boolean
           Print additional columns in output table.
+        cpus : int
+          Number of processes to use for evaluating rootings.
+        streaming_median : boolean
+          Estimate median relative divergence of nodes with streaming quantiles.
         """
 
         # read tree
         self.logger.info('Reading tree.')
-        tree = dendropy.Tree.get_from_path(input_tree, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree = read_tree(input_tree)
 
         input_tree_name = os.path.splitext(os.path.basename(input_tree))[0]
 
@@ -872,7 +989,7 @@ class Outliers(AbstractPlot):
         else:
             # calculate relative distance to taxa
             rd = RelativeDistance()
-            rel_dists = rd.rel_dist_to_named_clades(tree)
+            rel_dists = rd.rel_dist_to_named_clades(CompactTree.from_dendropy(tree))
         
             # report number of taxa at each rank
             print('')
@@ -882,14 +999,17 @@ class Outliers(AbstractPlot):
                 print('%s\t%d\t%d' % (Taxonomy.rank_labels[rank], len(taxa), len(taxa_for_inference)))
             print('')
         
-            phylum_rel_dists, rel_node_dists = self.median_rd_over_phyla(tree, 
-                                                                            taxa_for_dist_inference,
-                                                                            taxonomy)
+            phylum_rel_dists, node_rd = self.median_rd_over_phyla(tree, 
+                                                                    taxa_for_dist_inference,
+                                                                    taxonomy,
+                                                                    cpus,
+                                                                    streaming_median)
                                                                             
             # set edge lengths to median value over all rootings
+            node_rd = node_rd.tolist()
             tree.seed_node.rel_dist = 0.0
             for n in tree.preorder_node_iter(lambda n: n != tree.seed_node):
-                n.rel_dist = np_median(rel_node_dists[n.id])
+                n.rel_dist = node_rd[n.id]
                 rd_to_parent = n.rel_dist - n.parent_node.rel_dist
                 if rd_to_parent < 0:
                     self.logger.warning('Not all branches are positive after scaling.')
@@ -20,7 +20,7 @@ import sys
 from collections import defaultdict, namedtuple
 
 from phylorank.rel_dist import RelativeDistance
-from phylorank.common import read_taxa_file, filter_taxa_for_dist_inference
+from phylorank.common import read_taxa_file, read_tree, filter_taxa_for_dist_inference
 
 from biolib.taxonomy import Taxonomy
 from biolib.plots.abstract_plot import AbstractPlot
@@ -36,7 +36,6 @@ from scipy.stats import norm
 
 import mpld3
 
-import dendropy
 
 
 class DistributionPlot(AbstractPlot):
@@ -272,10 +271,7 @@ class DistributionPlot(AbstractPlot):
         """
 
         # read tree
-        tree = dendropy.Tree.get_from_path(input_tree, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree = read_tree(input_tree)
 
         # read taxa to plot
         taxa_to_plot = None
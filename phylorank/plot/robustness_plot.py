@@ -18,9 +18,12 @@
 import os
 import sys
 import random
+import multiprocessing as mp
 from collections import defaultdict
 
 from phylorank.rel_dist import RelativeDistance
+from phylorank.common import read_compact_tree
+from phylorank.lca import LCA
 
 from biolib.taxonomy import Taxonomy
 from biolib.plots.abstract_plot import AbstractPlot
@@ -28,10 +31,106 @@ from biolib.plots.abstract_plot import AbstractPlot
 from numpy import (mean as np_mean,
                    std as np_std,
                    arange as np_arange,
+                   zeros as np_zeros,
+                   flatnonzero as np_flatnonzero,
+                   column_stack as np_column_stack,
                    percentile as np_percentile)
 
 import mpld3
-import dendropy
+
+
+def rel_dist_to_specified_groups(tree, groups_to_consider, groups):
+    """Determine relative distance to specified named clades.
+
+    The MRCA of all groups is found together and relative
+    distances are read from arrays over the nodes of the tree.
+
+    Parameters
+    ----------
+    tree : CompactTree
+      Phylogenetic tree.
+    groups_to_consider: set
+      Taxonomic groups to consider.
+    groups : d[taxon] -> list of children
+      Children within named taxonomic groups.
+
+    Returns
+    -------
+    dict : d[taxon] -> relative distance to root
+    """
+
+    # calculate relative distance for all nodes
+    rd = RelativeDistance()
+    rd.decorate_rel_dist(tree)
+
+    lca = LCA(tree)
+    leaf_index = {}
+    for i, taxon_label in enumerate(tree.taxa):
+        if taxon_label is not None:
+            leaf_index[taxon_label] = i
+
+    # find MRCA of all groups
+    taxa = [taxon for taxon in groups if taxon in groups_to_consider]
+    tips = []
+    tip_groups = []
+    for group_index, taxon in enumerate(taxa):
+        for t in groups[taxon]:
+            i = leaf_index.get(t)
+            if i is not None:
+                tips.append(i)
+                tip_groups.append(group_index)
+
+    mrca, num_tips = lca.mrca_groups(tips, tip_groups, len(taxa))
+
+    parent_rel_dist = np_zeros(tree.num_nodes)
+    parent_rel_dist[1:] = tree.rel_dist[tree.parent[1:]]
+
+    # gather information for nodes of interest; groups without
+    # tips are within the phylum removed from the tree
+    rel_dists_to_taxon = {}
+    dist_components_taxon = {}
+    polyphyletic = set()
+    present = np_flatnonzero(num_tips > 0)
+    lca_nodes = mrca[present]
+    monophyletic = (tree.num_taxa[lca_nodes] == num_tips[present]).tolist()
+    rel_dists = tree.rel_dist[lca_nodes].tolist()
+    components = np_column_stack((parent_rel_dist[lca_nodes],
+                                  tree.edge_length[lca_nodes],
+                                  tree.mean_dist[lca_nodes])).tolist()
+    for k, group_index in enumerate(present.tolist()):
+        taxon = taxa[group_index]
+        if not monophyletic[k]:
+            print('  [Warning] Group is not monophyletic %s' % taxon)
+            polyphyletic.add(taxon)
+            continue
+
+        # get relative distance from root to named child clade
+        rel_dists_to_taxon[taxon] = rel_dists[k]
+        dist_components_taxon[taxon] = components[k]
+
+    return rel_dists_to_taxon, dist_components_taxon, polyphyletic
+
+
+# groups evaluated by the current process
+_groups_to_consider = None
+_groups = None
+
+
+def _init_replicate(groups_to_consider, groups):
+    """Set groups to evaluate in replicate trees."""
+
+    global _groups_to_consider, _groups
+    _groups_to_consider = groups_to_consider
+    _groups = groups
+
+
+def _replicate_rel_dist(tree_file):
+    """Determine relative distance to named clades in a replicate tree."""
+
+    tree = read_compact_tree(tree_file)
+    rel_dist, components, _polyphyletic = rel_dist_to_specified_groups(tree, _groups_to_consider, _groups)
+
+    return rel_dist, components
 
 
 class RobustnessPlot(AbstractPlot):
@@ -41,13 +140,13 @@ class RobustnessPlot(AbstractPlot):
         """Initialize."""
         AbstractPlot.__init__(self, None)
 
-    def rel_dist_to_specified_groups(self, tree_file, groups_to_consider, groups):
+    def rel_dist_to_specified_groups(self, tree, groups_to_consider, groups):
         """Determine relative distance to specified named clades.
 
         Parameters
         ----------
-        tree_file : str
-          File containing a tree in Newick format.
+        tree : CompactTree
+          Phylogenetic tree.
         groups_to_consider: set
           Taxonomic groups to consider.
         groups : d[taxon] -> list of children
@@ -58,60 +157,17 @@ class RobustnessPlot(AbstractPlot):
         dict : d[taxon] -> relative distance to root
         """
 
-        tree = dendropy.Tree.get_from_path(tree_file, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
-
-        # calculate relative distance for all nodes
-        rd = RelativeDistance()
-        rd.decorate_rel_dist(tree)
-
-        # gather information for nodes of interest
-        rel_dists_to_taxon = {}
-        dist_components_taxon = {}
-        polyphyletic = set()
-        for taxon, taxa_ids in groups.items():
-            if taxon not in groups_to_consider:
-                continue
-
-            tips = []
-            for t in taxa_ids:
-                try:
-                    tip = tree.find(t)
-                    tips.append(tip)
-                except:
-                    continue
-
-            if len(tips) == 0:
-                # group is within the phylum removed from the tree
-                continue
-
-            lca_node = tree.lca(tips)
+        return rel_dist_to_specified_groups(tree, groups_to_consider, groups)
 
-            if len(list(lca_node.tips())) != len(tips):
-                print('  [Warning] Group is not monophyletic %s' % taxon)
-                polyphyletic.add(taxon)
-                continue
-
-            # get relative distance from root to named child clade
-            rel_dists_to_taxon[taxon] = lca_node.rel_dist
-            dist_components_taxon[taxon] = [lca_node.parent.rel_dist, lca_node.length, lca_node.weighted_dist]
-
-        return rel_dists_to_taxon, dist_components_taxon, polyphyletic
-
-    def run(self, rank, input_tree_dir, full_tree_file, derep_tree_file, taxonomy_file, output_prefix, min_children, title):
+    def run(self, rank, input_tree_dir, full_tree_file, derep_tree_file, taxonomy_file, output_prefix, min_children, title, cpus=1):
 
         # determine named clades in full tree
         named_clades = set()
-        tree = dendropy.Tree.get_from_path(full_tree_file, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        full_tree = read_compact_tree(full_tree_file)
         
-        for node in tree.preorder_node_iter():
-            if node.label:
-                taxonomy = node.label.split(';')
+        for label in full_tree.labels:
+            if label:
+                taxonomy = label.split(';')
                 named_clades.add(taxonomy[-1].strip().split(':')[-1])
 
         print('Identified %d named clades in full tree.' % len(named_clades))
@@ -142,11 +198,7 @@ class RobustnessPlot(AbstractPlot):
         # calculate relative distance for full tree
         print('')
         print('Calculating relative distance over full tree.')
-        tree = dendropy.Tree.get_from_path(full_tree_file, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
-        full_rel_dist, _full_dist_components, polyphyletic = self.rel_dist_to_specified_groups(tree, groups_to_consider, groups)
+        full_rel_dist, _full_dist_components, polyphyletic = self.rel_dist_to_specified_groups(full_tree, groups_to_consider, groups)
         if len(polyphyletic) > 0:
             print('')
             print('[Warning] Full tree contains polyphyletic groups.')
@@ -154,39 +206,45 @@ class RobustnessPlot(AbstractPlot):
         # calculate relative distance for dereplicated tree
         print('')
         print('Calculating relative distance over dereplicated tree.')
-        tree = dendropy.Tree.get_from_path(derep_tree_file, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree = read_compact_tree(derep_tree_file)
         
         derep_rel_dist, derep_dist_components, polyphyletic = self.rel_dist_to_specified_groups(tree, groups_to_consider, groups)
 
         groups_to_consider = groups_to_consider - polyphyletic
         print('Assessing distriubtion over %d groups after removing polyphyletic groups in original trees.' % len(groups_to_consider))
 
-        # calculate relative distance to each group in each tree
+        # calculate relative distance to each group in each tree; replicate
+        # trees are processed independently so can be evaluated in parallel
         print('')
+        tree_files = []
+        for f in sorted(os.listdir(input_tree_dir)):
+            if f.endswith('.rooted.tree'):
+                tree_files.append(os.path.join(input_tree_dir, f))
+
+        if cpus > 1:
+            print('Processing %d trees using %d processes.' % (len(tree_files), cpus))
+            pool = mp.Pool(processes=cpus,
+                            initializer=_init_replicate,
+                            initargs=(groups_to_consider, groups))
+            replicate_results = pool.imap(_replicate_rel_dist, tree_files)
+        else:
+            pool = None
+            _init_replicate(groups_to_consider, groups)
+            replicate_results = map(_replicate_rel_dist, tree_files)
+
         rel_dists = defaultdict(list)
         dist_components = defaultdict(list)
-        for f in os.listdir(input_tree_dir):
-            if not f.endswith('.rooted.tree'):
-                continue
-
-            print(f)
-
-            tree_file = os.path.join(input_tree_dir, f)
-            tree = dendropy.Tree.get_from_path(tree_file, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
-
-            # calculate relative distance to named taxa
-            rel_dist, components, _polyphyletic = self.rel_dist_to_specified_groups(tree, groups_to_consider, groups)
+        for tree_file, (rel_dist, components) in zip(tree_files, replicate_results):
+            print(os.path.basename(tree_file))
 
             for taxon, dist in rel_dist.items():
                 rel_dists[taxon].append(dist)
                 dist_components[taxon].append(components[taxon])
 
+        if pool:
+            pool.close()
+            pool.join()
+
         # create scatter plot
         x = []
         y = []
@@ -0,0 +1,145 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import numpy as np
+
+
+class StreamingQuantile():
+    """Streaming estimate of a quantile for many series of values.
+
+    Each series is summarized by the five markers of the P-square
+    algorithm (Jain and Chlamtac, 1985), so memory does not depend on
+    the number of values added. A batch of values is added as at most
+    one new value to each of a subset of the series, with all series
+    in the batch updated together. The quantile of a series with fewer
+    than five values is calculated exactly.
+    """
+
+    def __init__(self, num_series, p=0.5):
+        """Initialization.
+
+        Parameters
+        ----------
+        num_series : int
+            Number of series.
+        p : float
+            Quantile to estimate, in [0, 1].
+        """
+
+        self.p = p
+
+        self.count = np.zeros(num_series, dtype=np.int64)
+        self.q = np.zeros((num_series, 5), dtype=np.float64)       # marker heights
+        self.n = np.zeros((num_series, 5), dtype=np.float64)       # marker positions
+        self.n_desired = np.zeros((num_series, 5), dtype=np.float64)
+        self.dn = np.array([0.0, p / 2, p, (1 + p) / 2, 1.0])
+
+    def add(self, series, values):
+        """Add a value to each of a set of series.
+
+        Parameters
+        ----------
+        series : array_like
+            Indices of series, each appearing at most once.
+        values : array_like
+            Value to add to each series.
+        """
+
+        series = np.asarray(series, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+
+        # the first five values of a series are stored directly
+        init = self.count[series] < 5
+        if init.any():
+            s = series[init]
+            self.q[s, self.count[s]] = values[init]
+            self.count[s] += 1
+
+            full = s[self.count[s] == 5]
+            if len(full):
+                self.q[full] = np.sort(self.q[full], axis=1)
+                self.n[full] = np.arange(5)
+                self.n_desired[full] = [0, 2 * self.p, 4 * self.p, 2 + 2 * self.p, 4]
+
+            series = series[~init]
+            values = values[~init]
+
+        if len(series) == 0:
+            return
+
+        self.count[series] += 1
+        q = self.q[series]
+        n = self.n[series]
+        n_desired = self.n_desired[series] + self.dn
+
+        # find cell containing each value, extending the extreme markers
+        np.minimum(q[:, 0], values, out=q[:, 0])
+        np.maximum(q[:, 4], values, out=q[:, 4])
+        k = (values[:, None] >= q[:, 1:4]).sum(axis=1)
+        n += (np.arange(5) > k[:, None])
+
+        # adjust heights of the middle markers
+        for i in range(1, 4):
+            d = n_desired[:, i] - n[:, i]
+            right = n[:, i + 1] - n[:, i]
+            left = n[:, i - 1] - n[:, i]
+            adjust = ((d >= 1) & (right > 1)) | ((d <= -1) & (left < -1))
+            if not adjust.any():
+                continue
+
+            ds = np.sign(d[adjust])
+            qa = q[adjust]
+            na = n[adjust]
+
+            # piecewise-parabolic prediction
+            parabolic = qa[:, i] + ds / (na[:, i + 1] - na[:, i - 1]) * (
+                (na[:, i] - na[:, i - 1] + ds) * (qa[:, i + 1] - qa[:, i]) / (na[:, i + 1] - na[:, i])
+                + (na[:, i + 1] - na[:, i] - ds) * (qa[:, i] - qa[:, i - 1]) / (na[:, i] - na[:, i - 1]))
+
+            # linear prediction used if parabolic prediction is not monotonic
+            neighbour = i + ds.astype(np.int64)
+            rows = np.arange(len(ds))
+            linear = qa[:, i] + ds * (qa[rows, neighbour] - qa[:, i]) / (na[rows, neighbour] - na[:, i])
+
+            monotonic = (qa[:, i - 1] < parabolic) & (parabolic < qa[:, i + 1])
+            q[adjust, i] = np.where(monotonic, parabolic, linear)
+            n[adjust, i] += ds
+
+        self.q[series] = q
+        self.n[series] = n
+        self.n_desired[series] = n_desired
+
+    def quantile(self):
+        """Get estimated quantile of each series.
+
+        Returns
+        -------
+        ndarray
+            Quantile of each series, or NaN for series without values.
+        """
+
+        result = np.full(len(self.count), np.nan)
+
+        full = self.count >= 5
+        result[full] = self.q[full, 2]
+
+        for c in range(1, 5):
+            s = np.flatnonzero(self.count == c)
+            if len(s):
+                result[s] = np.percentile(self.q[s, 0:c], 100 * self.p, axis=1)
+
+        return result
@@ -18,18 +18,170 @@
 import os
 import sys
 import logging
+import multiprocessing as mp
 from collections import defaultdict, namedtuple
 
 from phylorank.rel_dist import RelativeDistance
-from phylorank.newick import parse_label
-from phylorank.common import get_phyla_lineages
+from phylorank.compact_tree import CompactTree
+from phylorank.newick import parse_taxon_label
+from phylorank.common import (get_phyla_lineages,
+                              read_compact_tree,
+                              reroot_above_node)
 
 from biolib.taxonomy import Taxonomy
 
-from numpy import (mean as np_mean,
-                   std as np_std)
-                   
-import dendropy
+from numpy import (zeros as np_zeros,
+                   array as np_array,
+                   cumsum as np_cumsum,
+                   add as np_add,
+                   int64 as np_int64)
+
+
+# tree and thresholds used by the current process
+_compact_tree = None
+_rd_thresholds = None
+
+
+def _init_phylum_rooting(compact_tree, rd_thresholds):
+    """Set tree information used to evaluate rootings."""
+
+    global _compact_tree, _rd_thresholds
+    _compact_tree = compact_tree
+    _rd_thresholds = rd_thresholds
+
+
+def _phylum_rooting(phylum_outgroup):
+    """Determine ranks below named groups with tree rooted on a phylum.
+
+    Parameters
+    ----------
+    phylum_outgroup : (str, list, str)
+        Phylum to root on, indices of leaf nodes in the phylum, and output directory for phylum.
+
+    Returns
+    -------
+    d[taxon][rank prefix] -> count
+        Number of ranks below each named taxon.
+    """
+
+    p, outgroup_leaves, phylum_dir = phylum_outgroup
+
+    # reroot a copy of the tree in memory on the edge
+    # separating the phylum from all other taxa
+    outgroup_mask = np_zeros(_compact_tree.num_nodes, dtype=bool)
+    outgroup_mask[outgroup_leaves] = True
+    root_node = _compact_tree.outgroup_edge(outgroup_mask)[0]
+
+    cur_tree, cur_nodes = _compact_tree.to_dendropy(return_nodes=True)
+    reroot_above_node(cur_tree, cur_nodes[root_node])
+
+    # calculate relative distance for all nodes
+    rd = RelativeDistance()
+    rd.decorate_rel_dist(cur_tree)
+
+    # determine ranks
+    for n in cur_tree.postorder_node_iter(lambda n: n != cur_tree.seed_node):
+        ranks = []
+        for rank_prefix, threshold in _rd_thresholds.items():
+            if n.rel_dist >= threshold and n.parent_node.rel_dist < threshold:
+                ranks.append(rank_prefix.capitalize() + '__')
+                
+        if ranks:
+            if not n.label:
+                n.label = '|%s [rd=%.2f]' % (';'.join(ranks), n.rel_dist)
+            else:
+                n.label += '|%s [rd=%.2f]' % (';'.join(ranks), n.rel_dist)
+
+    cur_tree.write_to_path(os.path.join(phylum_dir, 'rd_ranks.tree'), 
+                            schema='newick', 
+                            suppress_rooting=True, 
+                            unquoted_underscores=True)
+    
+    # determine number of ranks below root and all named nodes; the
+    # subtree of a node is a contiguous block of nodes in preorder so
+    # counts below each node are differences of cumulative counts
+    rerooted_tree = CompactTree.from_dendropy(cur_tree)
+
+    rank_index = {}
+    marked_nodes = []
+    marked_ranks = []
+    for i, label in enumerate(rerooted_tree.labels):
+        if not label:
+            continue
+
+        auxiliary_info = parse_taxon_label(label).auxiliary_info
+        if auxiliary_info:
+            ranks = auxiliary_info[0:auxiliary_info.rfind('[')]
+            for r in ranks.split(';'):
+                marked_nodes.append(i)
+                marked_ranks.append(rank_index.setdefault(r.strip(), len(rank_index)))
+
+    rank_marks = np_zeros((rerooted_tree.num_nodes + 1, len(rank_index)), dtype=np_int64)
+    np_add.at(rank_marks, (np_array(marked_nodes, dtype=np_int64) + 1, np_array(marked_ranks, dtype=np_int64)), 1)
+    cs = np_cumsum(rank_marks, axis=0)
+    end = rerooted_tree.preorder + rerooted_tree.subtree_size
+    ranks_below_node = cs[end] - cs[rerooted_tree.preorder]
+
+    rank_labels = sorted(rank_index, key=rank_index.get)
+    ranks_below_taxon = defaultdict(lambda: defaultdict(int))
+    for i, label in enumerate(rerooted_tree.labels):
+        if i == 0:
+            cur_taxon = 'root'
+        elif label:
+            cur_taxon = parse_taxon_label(label).taxon
+            if not cur_taxon or cur_taxon.strip() == '':
+                continue
+        else:
+            continue
+
+        for r, count in zip(rank_labels, ranks_below_node[i].tolist()):
+            if count > 0:
+                ranks_below_taxon[cur_taxon][r] += count
+
+    ranks_below_taxon = dict((taxon, dict(counts)) for taxon, counts in ranks_below_taxon.items())
+
+    results_table = os.path.join(phylum_dir, 'rd_ranks.tsv')
+    RdRanks().write_rank_count(ranks_below_taxon, results_table)
+
+    return ranks_below_taxon
+
+
+class RunningStats():
+    """Running mean, variance, minimum, and maximum of a series of values.
+
+    The mean and variance are updated with Welford's algorithm so
+    values do not need to be retained.
+    """
+
+    def __init__(self):
+        """Initialization."""
+
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """Add value to series."""
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def std(self):
+        """Population standard deviation of series."""
+
+        if self.count == 0:
+            return 0.0
+
+        return (self.m2 / self.count) ** 0.5
 
 
 class RdRanks():
@@ -47,7 +199,7 @@ class RdRanks():
 
         Parameters
         ----------
-        ranks_below_taxon : d[taxon][rank prefix] -> count, or list of counts
+        ranks_below_taxon : d[taxon][rank prefix] -> count, or RunningStats of counts
             Number of ranks below named taxon.
         results_table : str
             Desired output file.
@@ -59,7 +211,7 @@ class RdRanks():
         count = ranks_below_taxon[taxon][rank_prefix]
         
         count_is_scalar = True
-        if isinstance(count, (list, tuple)):
+        if isinstance(count, RunningStats):
             count_is_scalar = False
         
         # write out results sorted by taxonomic rank        
@@ -88,12 +240,12 @@ class RdRanks():
             fout.write(taxon)
             
             for rank_prefix in Taxonomy.rank_prefixes:
-                count = ranks_below_taxon[taxon][rank_prefix.capitalize()]
+                count = ranks_below_taxon[taxon].get(rank_prefix.capitalize())
                 if count_is_scalar:
-                    fout.write('\t%d' % count)
+                    fout.write('\t%d' % (count or 0))
                 else:
-                    if len(count) > 0:
-                        fout.write('\t%.1f\t%.2f\t%d\t%d' % (np_mean(count), np_std(count), min(count), max(count)))
+                    if count is not None and count.count > 0:
+                        fout.write('\t%.1f\t%.2f\t%d\t%d' % (count.mean, count.std(), count.min, count.max))
                     else:
                         fout.write('\t%d\t%d\t%d\t%d' % (0, 0, 0, 0))
                     
@@ -101,7 +253,7 @@ class RdRanks():
                 
         fout.close()
 
-    def run(self, input_tree, rd_thresholds, output_dir):
+    def run(self, input_tree, rd_thresholds, output_dir, cpus=1):
         """Calculate number of taxa for specified relative divergence thresholds.
 
         Parameters
@@ -112,92 +264,73 @@ class RdRanks():
             Relative divergence threshold for defining taxonomic ranks.
         output_dir : str
             Desired output directory.
+        cpus : int
+            Number of processes to use for evaluating rootings.
         """
 
         # get list of phyla level lineages
-        tree = TreeNode.read(input_tree, convert_underscores=False)
+        compact_tree = read_compact_tree(input_tree)
+        tree = compact_tree.to_dendropy()
         phyla = get_phyla_lineages(tree)
         self.logger.info('Identified %d phyla for rooting.' % len(phyla))
         
         self.logger.info('Reading taxonomy from tree.')
-        taxonomy_file = os.path.join(output_dir, 'taxonomy.tsv')
-        taxonomy = Taxonomy().read_from_tree(input_tree)
-        Taxonomy().write(taxonomy, taxonomy_file)
-        
-        rd = RelativeDistance()
-        overall_ranks_below_taxon = defaultdict(lambda: defaultdict(list))
-        for p in phyla:
-            phylum_children = Taxonomy().children(p, taxonomy)
-            phylum = p.replace('p__', '')
-            self.logger.info('Calculating information with rooting on %s.' % phylum)
+        taxonomy = Taxonomy().read_from_tree(tree)
 
-            phylum_dir = os.path.join(output_dir, phylum)
+        leaf_index = {}
+        for i, taxon_label in enumerate(compact_tree.taxa):
+            if taxon_label is not None:
+                leaf_index[taxon_label] = i
+
+        phyla_genomes = defaultdict(list)
+        phyla_set = set(phyla)
+        for genome_id, taxa in taxonomy.items():
+            for t in set(taxa).intersection(phyla_set):
+                phyla_genomes[t].append(genome_id)
+
+        rootings_to_process = []
+        for p in phyla:
+            phylum_dir = os.path.join(output_dir, p.replace('p__', ''))
             if not os.path.exists(phylum_dir):
                 os.makedirs(phylum_dir)
 
-            output_tree = os.path.join(phylum_dir, 'rerooted.tree')
-            os.system('genometreetk outgroup %s %s %s %s' % (input_tree, taxonomy_file, p, output_tree))
-
-            # calculate relative distance for all nodes
-            cur_tree = dendropy.Tree.get_from_path(output_tree, 
-                                                schema='newick', 
-                                                rooting='force-rooted', 
-                                                preserve_underscores=True)
-            rd.decorate_rel_dist(cur_tree)
-
-            # determine ranks
-            for n in cur_tree.postorder_node_iter(lambda n: n != tree.seed_node):
-                ranks = []
-                for rank_prefix, threshold in rd_thresholds.items():
-                    if n.rel_dist >= threshold and n.parent_node.rel_dist < threshold:
-                        ranks.append(rank_prefix.capitalize() + '__')
-                        
-                if ranks:
-                    if not n.label:
-                        n.label = '|%s [rd=%.2f]' % (';'.join(ranks), n.rel_dist)
-                    else:
-                        n.label += '|%s [rd=%.2f]' % (';'.join(ranks), n.rel_dist)
+            outgroup_leaves = [leaf_index[genome_id] for genome_id in phyla_genomes[p]
+                                if genome_id in leaf_index]
+            rootings_to_process.append((p, outgroup_leaves, phylum_dir))
 
-            cur_tree.write_to_path(os.path.join(phylum_dir, 'rd_ranks.tree'), 
-                                    schema='newick', 
-                                    suppress_rooting=True, 
-                                    unquoted_underscores=True)
-            
-            # determine number of ranks below root and all named nodes
-            ranks_below_taxon = defaultdict(lambda: defaultdict(int))
-            for cur_node in cur_tree.postorder_node_iter():
-                if cur_node == cur_tree.seed_node:
-                    cur_taxon = 'root'
-                elif cur_node.label:
-                    _support, cur_taxon, _auxiliary_info = parse_label(cur_node.label)
-                    if not cur_taxon or cur_taxon.strip() == '':
-                        continue
-                else:
-                    continue
-                        
-                for n in cur_node.postorder_iter():
-                    if not n.label:
-                        continue
-                        
-                    _support, _taxon, auxiliary_info = parse_label(n.label)
-                    if auxiliary_info:
-                        ranks = auxiliary_info[0:auxiliary_info.rfind('[')]
-                        ranks = [r.strip() for r in ranks.split(';')]
-
-                        for r in ranks:
-                            ranks_below_taxon[cur_taxon][r] += 1
-                            
+        # evaluate rooting on each phylum; workers receive the tree once
+        # and results are merged in the order of the phyla
+        if cpus > 1:
+            self.logger.info('Evaluating rootings using %d processes.' % cpus)
+            pool = mp.Pool(processes=cpus,
+                            initializer=_init_phylum_rooting,
+                            initargs=(compact_tree, rd_thresholds))
+            rooting_results = pool.imap(_phylum_rooting, rootings_to_process)
+        else:
+            pool = None
+            _init_phylum_rooting(compact_tree, rd_thresholds)
+            rooting_results = map(_phylum_rooting, rootings_to_process)
+
+        overall_ranks_below_taxon = defaultdict(lambda: defaultdict(RunningStats))
+        for (p, outgroup_leaves, phylum_dir), ranks_below_taxon in zip(rootings_to_process, rooting_results):
+            self.logger.info('Calculating information with rooting on %s.' % p.replace('p__', ''))
+
+            phylum_children = Taxonomy().children(p, taxonomy)
             for taxon in ranks_below_taxon:
                 if taxon == p or taxon in phylum_children:
                     # do not record results for named groups in the lineage 
                     # used for rooting
                     continue
-                    
+
+                # only ranks present below the taxon are reported, so
+                # statistics for a rank only include rootings where it
+                # occurs below the taxon
                 for rank, count in ranks_below_taxon[taxon].items():
-                    overall_ranks_below_taxon[taxon][rank].append(count)
-                            
-            results_table = os.path.join(phylum_dir, 'rd_ranks.tsv')
-            self.write_rank_count(ranks_below_taxon, results_table)
+                    overall_ranks_below_taxon[taxon][rank].add(count)
+
+        if pool:
+            pool.close()
+            pool.join()
 
         results_table = os.path.join(output_dir, 'mean_rd_ranks.tsv')
-        self.write_rank_count(overall_ranks_below_taxon, results_table)
\ No newline at end of file
+        self.write_rank_count(overall_ranks_below_taxon, results_table)
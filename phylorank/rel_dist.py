@@ -20,16 +20,20 @@ import sys
 import logging
 from collections import defaultdict
 
-from phylorank.newick import parse_label
-
-from biolib.taxonomy import Taxonomy
+from phylorank.newick import parse_taxon_label
+from phylorank.compact_tree import CompactTree
 
 import dendropy
 
 from numpy import (mean as np_mean,
                    std as np_std,
                    arange as np_arange,
-                   percentile as np_percentile)
+                   percentile as np_percentile,
+                   zeros as np_zeros,
+                   empty as np_empty,
+                   where as np_where,
+                   add as np_add,
+                   errstate as np_errstate)
 
                    
 class RelativeDistance():
@@ -39,6 +43,68 @@ class RelativeDistance():
         """Initialization."""
         self.logger = logging.getLogger()
 
+    def _avg_descendant_rate_compact(self, tree):
+        """Calculate average rate of divergence for each node in a compact tree.
+
+        Nodes are processed one level at a time, starting with the
+        level furthest from the root, so the contribution of all
+        children at a level is added to their parents in a single
+        vectorized operation.
+
+        Parameters
+        ----------
+        tree : CompactTree
+            Phylogenetic tree.
+
+        Returns
+        -------
+        The following arrays are added to the tree:
+          mean_dist: mean distance to tips
+        """
+
+        mean_dist = np_zeros(tree.num_nodes)
+        for nodes in tree.levels[:0:-1]:
+            parents = tree.parent[nodes]
+            np_add.at(mean_dist,
+                        parents,
+                        (tree.num_taxa[nodes] / tree.num_taxa[parents]) * (mean_dist[nodes] + tree.edge_length[nodes]))
+
+        tree.mean_dist = mean_dist
+
+    def _decorate_rel_dist_compact(self, tree):
+        """Calculate relative distance to each node in a compact tree.
+
+        Parameters
+        ----------
+        tree : CompactTree
+            Phylogenetic tree.
+
+        Returns
+        -------
+        The following arrays are added to the tree:
+          mean_dist: mean distance to tips
+          rel_dist: relative distance of node between root and extant organisms
+        """
+
+        self._avg_descendant_rate_compact(tree)
+
+        rel_dist = np_empty(tree.num_nodes)
+        rel_dist[0] = 0.0
+        for nodes in tree.levels[1:]:
+            a = tree.edge_length[nodes]
+            b = tree.mean_dist[nodes]
+            x = rel_dist[tree.parent[nodes]]
+
+            # internal nodes with zero length to their parent
+            # have the same relative distance as the parent node
+            with np_errstate(divide='ignore', invalid='ignore'):
+                level_rel_dist = np_where((a + b) != 0, x + (a / (a + b)) * (1.0 - x), x)
+            level_rel_dist[tree.is_leaf[nodes]] = 1.0
+
+            rel_dist[nodes] = level_rel_dist
+
+        tree.rel_dist = rel_dist
+
     def _avg_descendant_rate(self, tree):
         """Calculate average rate of divergence for each nodes in a tree.
 
@@ -57,16 +123,18 @@ class RelativeDistance():
           num_taxa: number of terminal taxa
         """
 
-        # calculate the mean branch length to extant taxa
+        # calculate the mean branch length to extant taxa; children
+        # are always visited before their parent so the number of
+        # terminal taxa can be obtained directly from the children
         for node in tree.postorder_node_iter():
             avg_div = 0
             if node.is_leaf():
                 node.mean_dist = 0.0
                 node.num_taxa = 1
             else:
-                node.num_taxa = sum([1 for _ in node.leaf_iter()])
-                for c in node.child_node_iter():
-                    num_tips = c.num_taxa
+                children = node.child_nodes()
+                node.num_taxa = sum([c.num_taxa for c in children])
+                for c in children:
                     avg_div += (float(c.num_taxa) / node.num_taxa) * (c.mean_dist + c.edge_length)
 
             node.mean_dist = avg_div
@@ -76,7 +144,7 @@ class RelativeDistance():
 
         Parameters
         ----------
-        tree : Dendropy Tree
+        tree : Dendropy Tree or CompactTree
             Phylogenetic tree.
 
         Returns
@@ -85,8 +153,14 @@ class RelativeDistance():
           mean_dist: mean distance to tips
           num_taxa: number of terminal taxa
           rel_dists: relative distance of node between root and extant organisms
+          
+        For a CompactTree these are added to the tree as arrays indexed by node.
         """
 
+        if isinstance(tree, CompactTree):
+            self._decorate_rel_dist_compact(tree)
+            return
+
         self._avg_descendant_rate(tree)
 
         for node in tree.preorder_node_iter():
@@ -109,12 +183,59 @@ class RelativeDistance():
 
                 node.rel_dist = rel_dist
 
+    def _named_clade(self, label):
+        """Get most-specific taxon and rank index for a node label.
+
+        Parameters
+        ----------
+        label : str
+            Label of node.
+
+        Returns
+        -------
+        int
+            Rank index of most-specific taxon, or None if the label has no recognized taxon.
+        str
+            Most-specific taxon name.
+        """
+
+        taxon_label = parse_taxon_label(label)
+
+        if not taxon_label.taxon or taxon_label.rank_index is None:
+            return None, None
+
+        # get most-specific rank if a node represents multiple ranks
+        return taxon_label.rank_index, taxon_label.taxa[-1]
+
+    def named_clades(self, tree):
+        """Get internal nodes of a compact tree labelled with a taxon.
+
+        Parameters
+        ----------
+        tree : CompactTree
+            Phylogenetic tree.
+
+        Returns
+        -------
+        list
+            Node index, rank index, and most-specific taxon of each named internal node in preorder.
+        """
+
+        named = []
+        for i in range(1, tree.num_nodes):
+            if tree.labels[i] and not tree.is_leaf[i]:
+                rank_index, taxon_name = self._named_clade(tree.labels[i])
+                if taxon_name:
+                    named.append((i, rank_index, taxon_name))
+
+        return named
+
     def rel_dist_to_named_clades(self, tree):
         """Determine relative distance to specific taxa.
 
         Parameters
         ----------
-        tree : Dendropy Tree
+        tree : Dendropy Tree or CompactTree
             Phylogenetic tree.
 
         Returns
@@ -127,21 +248,16 @@ class RelativeDistance():
 
         # assign internal nodes with ranks from
         rel_dists = defaultdict(dict)
-        for node in tree.preorder_node_iter(lambda n: n != tree.seed_node):
-            if not node.label or node.is_leaf():
-                continue
-
-            # check for support value
-            _support, taxon_name, _auxiliary_info = parse_label(node.label)
-
-            if not taxon_name:
-                continue
-
-            # get most-specific rank if a node represents multiple ranks
-            if ';' in taxon_name:
-                taxon_name = taxon_name.split(';')[-1].strip()
+        if isinstance(tree, CompactTree):
+            for i, rank_index, taxon_name in self.named_clades(tree):
+                rel_dists[rank_index][taxon_name] = tree.rel_dist[i]
+        else:
+            for node in tree.preorder_node_iter(lambda n: n != tree.seed_node):
+                if not node.label or node.is_leaf():
+                    continue
 
-            most_specific_rank = taxon_name[0:3]
-            rel_dists[Taxonomy.rank_index[most_specific_rank]][taxon_name] = node.rel_dist
+                rank_index, taxon_name = self._named_clade(node.label)
+                if taxon_name:
+                    rel_dists[rank_index][taxon_name] = node.rel_dist
 
         return rel_dists
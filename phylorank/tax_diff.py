@@ -20,11 +20,14 @@ import sys
 import logging
 from collections import defaultdict
 
+import numpy as np
+
 from phylorank.newick import parse_label
+from phylorank.common import read_tree
+from phylorank.taxonomy_store import TaxonomyStore
 
 from biolib.taxonomy import Taxonomy
 
-import dendropy
 
 
 class TaxDiff():
@@ -68,8 +71,53 @@ class TaxDiff():
         
         # domain = 'a', phylum = 'aeota', class = 'ia', order = 'ales', family = 'aceae'
         self.rank_suffices = ['a', 'aeota', 'ia', 'ales', 'aceae', '']
+        self.max_suffix_len = max([len(s) for s in self.rank_suffices])
         
-    def _renamed(self, taxon, cur_rank, taxa_at_rank):
+    def _suffix_variants(self, suffix):
+        """Get suffix variants considered when matching taxon names.
+
+        Variants are given in the order they are to be considered.
+        """
+
+        variants = []
+        for j in range(0, len(suffix)):
+            variants.append((j, 0, suffix[j:]))
+            variants.append((j, 1, suffix[0:j]))
+
+        return variants
+
+    def _stem_index(self, taxa_at_rank):
+        """Index taxa by name stem.
+
+        A taxon is indexed under every stem obtained by removing
+        a variant of a canonical rank suffix from its name.
+
+        Parameters
+        ----------
+        taxa_at_rank : d[rank] -> set
+            Named taxa at each rank.
+
+        Returns
+        -------
+        dict : d[stem] -> [(suffix rank, j, k, taxon), ...]
+            Taxa with each stem in order of preference.
+        """
+
+        stem_index = defaultdict(list)
+        for rank, taxa in taxa_at_rank.items():
+            for taxon in taxa:
+                for suffix_rank, suffix in enumerate(self.rank_suffices):
+                    for j, k, variant in self._suffix_variants(suffix):
+                        if taxon.endswith(variant):
+                            stem = taxon[0:len(taxon) - len(variant)]
+                            stem_index[stem].append((suffix_rank, j, k, taxon))
+
+        for candidates in stem_index.values():
+            candidates.sort()
+
+        return stem_index
+
+    def _renamed(self, taxon, cur_rank, stem_index):
         """Determine if taxon has been renamed."""
         
         # remove paraphyletic suffix if one exists
@@ -83,55 +131,82 @@ class TaxDiff():
      
         # check if taxon has been moved up or down in rank
         # as determined by removing suffix characters and 
-        # appending canonical rank prefixes
+        # appending the canonical suffix of the rank
         for old_rank in rank_order:
             if old_rank >= len(self.rank_suffices):
                 return None, None
 
-            # eat suffix character by character and append canonical suffix
             old_rank_prefix = Taxonomy.rank_prefixes[old_rank]
-            cur_suffix = self.rank_suffices[cur_rank]
-            old_suffix = self.rank_suffices[old_rank]
-            for i in range(1, max([len(s) for s in self.rank_suffices]) + 1): # eat taxon name
-                if i == 0:
-                    modified_taxon = taxon[3:]
-                else:
-                    modified_taxon = taxon[3:-i]
-                    
-                for j in range(0, len(old_suffix)): # eat suffix
-                    old_taxon = old_rank_prefix + modified_taxon + old_suffix[j:]
-                    if old_taxon in taxa_at_rank[old_rank]:
-                        return old_taxon, old_rank
-                        
-                    old_taxon = old_rank_prefix + modified_taxon + old_suffix[0:j]
-                    if old_taxon in taxa_at_rank[old_rank]:
+            for i in range(1, self.max_suffix_len + 1): # eat taxon name
+                stem = old_rank_prefix + taxon[3:-i]
+                for suffix_rank, _j, _k, old_taxon in stem_index.get(stem, []):
+                    if suffix_rank == old_rank:
                         return old_taxon, old_rank
         
         return None, None
         
-    def _change_suffix(self, taxon, cur_rank, taxa_at_rank):
+    def _change_suffix(self, taxon, stem_index):
         """Change suffix of taxon."""
         
-        # check if taxon name has been corrected
-        for old_rank, old_suffix in enumerate(self.rank_suffices):
-            # eat suffix character by character and append canonical suffix
-            for i in range(0, max([len(s) for s in self.rank_suffices])): # eat taxon name
-                if i == 0:
-                    modified_taxon = taxon
-                else:
-                    modified_taxon = taxon[0:-i]
-                    
-                for j in range(0, len(old_suffix)): # eat suffix
-                    old_taxon = modified_taxon + old_suffix[j:]
-                    if old_taxon in taxa_at_rank[cur_rank]:
-                        return old_taxon
-  
-                    old_taxon = modified_taxon + old_suffix[0:j]
-                    if old_taxon in taxa_at_rank[cur_rank]:
-                        return old_taxon
+        # check if taxon name has been corrected by finding the
+        # preferred taxon sharing a stem with the taxon
+        best = None
+        for i in range(0, self.max_suffix_len): # eat taxon name
+            if i == 0:
+                stem = taxon
+            else:
+                stem = taxon[0:-i]
+
+            candidates = stem_index.get(stem)
+            if candidates:
+                suffix_rank, j, k, old_taxon = candidates[0]
+                if best is None or (suffix_rank, i, j, k) < best[0]:
+                    best = ((suffix_rank, i, j, k), old_taxon)
                         
-        return None
+        if best is None:
+            return None
+
+        return best[1]
         
+    def _rank_matrices(self, tax1, tax2, genome_ids):
+        """Encode taxonomies as rank matrices over a shared taxon table.
+
+        Parameters
+        ----------
+        tax1 : TaxonomyStore
+            First taxonomy.
+        tax2 : TaxonomyStore
+            Second taxonomy.
+        genome_ids : list
+            Genomes to compare, which must be in both taxonomies.
+
+        Returns
+        -------
+        ndarray, ndarray, ndarray
+            Index of taxon at each rank for each genome in the first and
+            second taxonomy, with -1 indicating a missing rank, and flag
+            indicating if each taxon in the shared table is named.
+        """
+
+        num_ranks = len(Taxonomy.rank_prefixes)
+
+        # map taxa of the second taxonomy onto those of the first
+        taxon_index = dict(tax1.taxon_index)
+        remap = np.array([taxon_index.setdefault(taxon, len(taxon_index))
+                            for taxon in tax2.taxon_names] + [-1],
+                         dtype=np.int32)
+
+        is_named = np.zeros(len(taxon_index) + 1, dtype=bool)
+        is_named[0:len(tax1.taxon_names)] = tax1.is_named[:-1]
+        is_named[remap[:-1]] = tax2.is_named[:-1]
+
+        rows1 = np.array([tax1.genome_index[genome_id] for genome_id in genome_ids], dtype=np.int64)
+        rows2 = np.array([tax2.genome_index[genome_id] for genome_id in genome_ids], dtype=np.int64)
+        m1 = tax1.taxa[rows1, 0:num_ranks]
+        m2 = remap[tax2.taxa[rows2, 0:num_ranks]]
+
+        return m1, m2, is_named
+
     def _tax_diff_table(self, tax1, tax2, output_table):
         """Tabulate incongruency of taxonomy strings at each rank."""
         
@@ -140,33 +215,40 @@ class TaxDiff():
         for rank_label in Taxonomy.rank_labels:
             fout.write('\t%s (%%)' % rank_label.title())
         fout.write('\n')
-        
-        taxonomy = Taxonomy()
-        named_lineages_at_rank = taxonomy.named_lineages_at_rank(tax1)
-        for rank, taxa in named_lineages_at_rank.items():
-            rank_label = Taxonomy.rank_labels[rank]
+
+        m1, m2, _ = self._rank_matrices(tax1, tax2, tax1.genome_ids)
+        present = (m1 >= 0) & (m2 >= 0)
+        matches = present & (m1 == m2)
+        num_taxa = len(tax1.taxon_names)
+        num_ranks = m1.shape[1]
+
+        for rank, rank_label in enumerate(Taxonomy.rank_labels):
             if rank_label == 'species':
                 continue
-                
-            extant_taxa_for_rank = taxonomy.extant_taxa_for_rank(rank_label, tax1)
-            
-            for taxon in taxa:
-                extent_taxa = extant_taxa_for_rank[taxon]
-                fout.write('%s\t%d' % (taxon, len(extent_taxa)))
-                
-                row = defaultdict(list)
-                for genome_id in extent_taxa:
-                    taxa1 = tax1[genome_id]
-                    taxa2 = tax2[genome_id]
-                    
-                    for cur_rank, (taxa1, taxa2) in enumerate(list(zip(taxa1, taxa2))):
-                         row[cur_rank].append(taxa1 == taxa2)
-                         
-                for cur_rank, matches in row.items():
+
+            # number of genomes in each taxon at this rank with a
+            # label at each rank in both taxonomies and the number
+            # of these with the same label
+            taxa = m1[:, rank]
+            in_taxon = taxa >= 0
+            num_compared = np.zeros((num_taxa, num_ranks), dtype=np.int64)
+            num_matches = np.zeros((num_taxa, num_ranks), dtype=np.int64)
+            for cur_rank in range(num_ranks):
+                num_compared[:, cur_rank] = np.bincount(taxa[in_taxon & present[:, cur_rank]],
+                                                        minlength=num_taxa)
+                num_matches[:, cur_rank] = np.bincount(taxa[in_taxon & matches[:, cur_rank]],
+                                                       minlength=num_taxa)
+
+            for t in tax1.named_lineages_at_rank(rank, as_index=True).tolist():
+                fout.write('%s\t%d' % (tax1.taxon_names[t], tax1.extant_ptr[t + 1] - tax1.extant_ptr[t]))
+                for cur_rank in range(num_ranks):
+                    if num_compared[t, cur_rank] == 0:
+                        continue
+
                     if cur_rank <= rank:
                         fout.write('\t-')
                     else:
-                        perc_match = sum(matches) * 100.0 / len(matches)
+                        perc_match = num_matches[t, cur_rank] * 100.0 / num_compared[t, cur_rank]
                         fout.write('\t%.1f' % (100.0 - perc_match))
                 fout.write('\n')
         fout.close()
@@ -184,15 +266,9 @@ class TaxDiff():
             Output directory.
         """
         
-        tree1 = dendropy.Tree.get_from_path(tree1_file, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree1 = read_tree(tree1_file)
                                             
-        tree2 = dendropy.Tree.get_from_path(tree2_file, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree2 = read_tree(tree2_file)
         
         # prune both trees to a set of common taxa
         taxa1 = set()
@@ -213,11 +289,15 @@ class TaxDiff():
         
         # get named lineages at each taxonomic rank
         taxonomy = Taxonomy()
-        tax1 = taxonomy.read_from_tree(tree1)
-        tax2 = taxonomy.read_from_tree(tree2)
+        tax1 = TaxonomyStore.from_dict(taxonomy.read_from_tree(tree1))
+        tax2 = TaxonomyStore.from_dict(taxonomy.read_from_tree(tree2))
         
-        taxa_at_rank1 = taxonomy.named_lineages_at_rank(tax1)
-        taxa_at_rank2 = taxonomy.named_lineages_at_rank(tax2)
+        taxa_at_rank1 = {}
+        taxa_at_rank2 = {}
+        for rank in range(len(Taxonomy.rank_labels)):
+            taxa_at_rank1[rank] = tax1.named_lineages_at_rank(rank)
+            taxa_at_rank2[rank] = set(tax2.named_lineages_at_rank(rank))
+        stem_index2 = self._stem_index(taxa_at_rank2)
 
         # identify retained taxonomic names
         tax_file_name = os.path.splitext(os.path.basename(tree1_file))[0]
@@ -234,14 +314,14 @@ class TaxDiff():
                     continue
                     
                 # check if name was simply corrected by changing suffix
-                old_taxon = self._change_suffix(taxon, rank, taxa_at_rank2)  
+                old_taxon = self._change_suffix(taxon, stem_index2)  
                 if old_taxon:
                     fout.write('%s\t%s\t%s\t%s\n' % (rank_label, 'corrected', taxon, old_taxon))
                     taxon2_accounted_for[rank].add(old_taxon)
                     continue
                                          
                 # check if taxon has been moved up or down in rank
-                old_taxon, old_rank = self._renamed(taxon, rank, taxa_at_rank2)
+                old_taxon, old_rank = self._renamed(taxon, rank, stem_index2)
                 if old_taxon:
                     if rank < old_rank:
                         fout.write('%s\t%s\t%s\t%s\n' % (rank_label, 'more general', taxon, old_taxon))
@@ -283,23 +363,14 @@ class TaxDiff():
             Output directory.
         """
         
-        tax1 = Taxonomy().read(tax1_file)
-        tax2 = Taxonomy().read(tax2_file)
+        tax1 = TaxonomyStore.read(tax1_file)
+        tax2 = TaxonomyStore.read(tax2_file)
         
         if not include_user_taxa:
-            new_tax1 = {}
-            for genome_id, taxonomy in tax1.items():
-                if not genome_id.startswith('U_'):
-                    new_tax1[genome_id] = taxonomy
-            tax1 = new_tax1
-            
-            new_tax2 = {}
-            for genome_id, taxonomy in tax2.items():
-                if not genome_id.startswith('U_'):
-                    new_tax2[genome_id] = taxonomy
-            tax2 = new_tax2
+            tax1 = tax1.subset([g for g in tax1.genome_ids if not g.startswith('U_')])
+            tax2 = tax2.subset([g for g in tax2.genome_ids if not g.startswith('U_')])
         
-        common_taxa = set(tax1.keys()).intersection(list(tax2.keys()))
+        common_taxa = [genome_id for genome_id in tax1.genome_ids if genome_id in tax2]
         
         self.logger.info('First taxonomy contains %d taxa.' % len(tax1))
         self.logger.info('Second taxonomy contains %d taxa.' % len(tax2))
@@ -310,30 +381,35 @@ class TaxDiff():
         tax_file_name2 = os.path.splitext(os.path.basename(tax2_file))[0]
         output_table = os.path.join(output_dir, '%s.tax_diff.tsv' % tax_file_name1)
         
+        m1, m2, is_named = self._rank_matrices(tax1, tax2, common_taxa)
+        named1 = is_named[m1]
+        named2 = is_named[m2]
+        changed = (m1 >= 0) & (m2 >= 0) & (m1 != m2)
+
+        unchanged = np.count_nonzero((m1 >= 0) & (m1 == m2), axis=0)   # T2 = g__Bob -> T1 = g__Bob, or T2 = g__ -> T1 = g__
+        active = changed & named1 & named2                              # T2 = g__Bob -> T1 = g__Jane, or T2 = g__Bob -> T1 = g__Bob_A
+        passive = changed & ~named2                                     # T2 = g__??? -> T1 = g__Jane
+        unresolved = changed & named2 & ~named1                         # T2 = g__Box -> T1 = g__???
+        active_change = np.count_nonzero(active, axis=0)
+        passive_change = np.count_nonzero(passive, axis=0)
+        unresolved_change = np.count_nonzero(unresolved, axis=0)
+
+        change_type = np.full(m1.shape, -1, dtype=np.int8)
+        change_type[active] = 0
+        change_type[passive] = 1
+        change_type[unresolved] = 2
+        change_labels = ('active', 'passive', 'unresolved')
+
         fout = open(output_table, 'w')
         fout.write('Genome ID\tChange\tRank\t%s\t%s\n' % (tax_file_name1, tax_file_name2))
-        
-        unchanged = defaultdict(int)           # T2 = g__Bob -> T1 = g__Bob, or T2 = g__ -> T1 = g__
-        active_change = defaultdict(int)       # T2 = g__Bob -> T1 = g__Jane, or T2 = g__Bob -> T1 = g__Bob_A
-        passive_change = defaultdict(int)      # T2 = g__??? -> T1 = g__Jane
-        unresolved_change = defaultdict(int)   # T2 = g__Box -> T1 = g__???
-        for taxa in common_taxa:
-            t1 = tax1[taxa]
-            t2 = tax2[taxa]
-            
-            for rank, (taxon1, taxon2) in enumerate(list(zip(t1, t2))):
-                if taxon1 == taxon2:
-                    unchanged[rank] += 1
-                elif taxon1 != Taxonomy.rank_prefixes[rank] and taxon2 != Taxonomy.rank_prefixes[rank]:
-                    active_change[rank] += 1
-                    fout.write('%s\t%s\t%s\t%s\t%s\n' % (taxa, 'active', Taxonomy.rank_labels[rank], ';'.join(t1), ';'.join(t2)))
-                elif taxon2 == Taxonomy.rank_prefixes[rank]:
-                    passive_change[rank] += 1
-                    fout.write('%s\t%s\t%s\t%s\t%s\n' % (taxa, 'passive', Taxonomy.rank_labels[rank], ';'.join(t1), ';'.join(t2)))
-                elif taxon1 == Taxonomy.rank_prefixes[rank]:
-                    unresolved_change[rank] += 1
-                    fout.write('%s\t%s\t%s\t%s\t%s\n' % (taxa, 'unresolved', Taxonomy.rank_labels[rank], ';'.join(t1), ';'.join(t2)))
-                    
+        genomes, ranks = np.nonzero(change_type >= 0)
+        for g, rank in zip(genomes.tolist(), ranks.tolist()):
+            genome_id = common_taxa[g]
+            fout.write('%s\t%s\t%s\t%s\t%s\n' % (genome_id,
+                                                change_labels[change_type[g, rank]],
+                                                Taxonomy.rank_labels[rank],
+                                                ';'.join(tax1[genome_id]),
+                                                ';'.join(tax2[genome_id])))
         fout.close()
   
         # report results
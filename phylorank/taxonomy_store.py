@@ -0,0 +1,395 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import logging
+
+import numpy as np
+
+from biolib.common import check_file_exists
+from biolib.taxonomy import Taxonomy
+
+
+def _csr(keys, values, num_keys):
+    """Group values by key in compressed sparse row form.
+
+    Values for each key retain their relative order.
+    """
+
+    order = np.argsort(keys, kind='stable')
+    ptr = np.zeros(num_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=num_keys), out=ptr[1:])
+
+    return ptr, values[order]
+
+
+class TaxonomyStore():
+    """Compact representation of the taxonomy of extant taxa.
+
+    Taxon names are interned in a single table and the taxonomy of
+    each genome is stored as a row of indices into this table, with
+    -1 indicating a missing rank. Extant taxa and children of each
+    taxon are indexed in compressed sparse row form when the store
+    is created so lookups do not require scanning the taxonomy.
+
+    The store can also be used as a read-only dictionary indexed
+    by genome ID which returns the list of taxa for a genome.
+    """
+
+    def __init__(self, genome_ids, taxa, taxon_names):
+        """Initialization.
+
+        Parameters
+        ----------
+        genome_ids : list
+            Unique ID of each genome.
+        taxa : ndarray
+            Index of taxon at each rank for each genome.
+        taxon_names : list
+            Name of each taxon.
+        """
+
+        self.logger = logging.getLogger()
+
+        self.genome_ids = genome_ids
+        self.genome_index = dict((genome_id, i) for i, genome_id in enumerate(genome_ids))
+        self.taxa = np.asarray(taxa, dtype=np.int32).reshape(len(genome_ids), -1)
+        self.taxon_names = taxon_names
+        self.taxon_index = dict((taxon, i) for i, taxon in enumerate(taxon_names))
+
+        num_genomes, num_ranks = self.taxa.shape
+        num_taxa = len(taxon_names)
+
+        # taxa consisting of only a rank prefix are unnamed
+        self.is_named = np.array([taxon not in Taxonomy.rank_index for taxon in taxon_names] + [False],
+                                 dtype=bool)
+        named = self.is_named[self.taxa]   # index -1 maps to trailing False
+
+        # rank and a genome containing each taxon
+        rows = np.repeat(np.arange(num_genomes, dtype=np.int32), num_ranks)
+        ranks = np.tile(np.arange(num_ranks, dtype=np.int8), num_genomes)
+        flat_taxa = self.taxa.ravel()
+        present = flat_taxa >= 0
+
+        self.taxon_rank = np.full(num_taxa, -1, dtype=np.int8)
+        self.taxon_rank[flat_taxa[present]] = ranks[present]
+        self.taxon_genome = np.full(num_taxa, -1, dtype=np.int32)
+        np.maximum.at(self.taxon_genome, flat_taxa[present], rows[present])
+
+        # extant taxa of each named taxon in genome order
+        named_flat = named.ravel()
+        self.extant_ptr, self.extant_index = _csr(flat_taxa[named_flat],
+                                                  rows[named_flat],
+                                                  num_taxa)
+
+        # named children of each named taxon at the following rank
+        parents = self.taxa[:, :-1].ravel()
+        children = self.taxa[:, 1:].ravel()
+        pairs = named[:, :-1].ravel() & named[:, 1:].ravel()
+        stride = max(num_taxa, 1)
+        keys = np.unique(parents[pairs].astype(np.int64) * stride + children[pairs])
+        self.child_ptr, self.child_index = _csr(keys // stride,
+                                                (keys % stride).astype(np.int32),
+                                                num_taxa)
+
+        # number of children of each taxon with the children
+        # of species being the extant taxa in the species
+        self.num_children = np.diff(self.child_ptr)
+        if num_ranks > Taxonomy.rank_index['s__']:
+            species = np.flatnonzero(self.taxon_rank == Taxonomy.rank_index['s__'])
+            self.num_children[species] = np.diff(self.extant_ptr)[species]
+
+    @classmethod
+    def from_dict(cls, taxonomy):
+        """Create store from a dictionary of taxonomy strings.
+
+        Parameters
+        ----------
+        taxonomy : d[unique_id] -> [d__<taxon>, ..., s__<taxon>]
+            Taxa indexed by unique ids.
+
+        Returns
+        -------
+        TaxonomyStore
+            Taxonomy of extant taxa.
+        """
+
+        return cls._from_lineages(list(taxonomy.keys()), list(taxonomy.values()))
+
+    @classmethod
+    def read(cls, taxonomy_file):
+        """Read Greengenes-style taxonomy file.
+
+        Expected format is:
+            <id>\t<taxonomy string>
+
+        Parameters
+        ----------
+        taxonomy_file : str
+            Greengenes-style taxonomy file.
+
+        Returns
+        -------
+        TaxonomyStore
+            Taxonomy of extant taxa.
+        """
+
+        check_file_exists(taxonomy_file)
+
+        genome_ids = []
+        lineages = []
+        with open(taxonomy_file) as f:
+            for row, line in enumerate(f):
+                try:
+                    line_split = line.split('\t')
+                    tax_str = line_split[1].rstrip()
+                    if tax_str[-1] == ';':
+                        # remove trailing semicolons which sometimes
+                        # appear in Greengenes-style taxonomy files
+                        tax_str = tax_str[0:-1]
+                except IndexError:
+                    logging.getLogger().error('Failed to parse taxonomy file on line %d' % (row + 1))
+                    raise
+
+                genome_ids.append(line_split[0])
+                lineages.append([x.strip() for x in tax_str.split(';')])
+
+        # the last entry for a genome takes precedence
+        if len(set(genome_ids)) != len(genome_ids):
+            taxonomy = dict(zip(genome_ids, lineages))
+            genome_ids = list(taxonomy.keys())
+            lineages = list(taxonomy.values())
+
+        return cls._from_lineages(genome_ids, lineages)
+
+    @classmethod
+    def _from_lineages(cls, genome_ids, lineages):
+        """Create store from taxonomy strings of each genome."""
+
+        num_ranks = max([len(Taxonomy.rank_prefixes)] + [len(taxa) for taxa in lineages])
+
+        taxon_index = {}
+        taxa = np.full((len(genome_ids), num_ranks), -1, dtype=np.int32)
+        for i, lineage in enumerate(lineages):
+            taxa[i, 0:len(lineage)] = [taxon_index.setdefault(taxon, len(taxon_index))
+                                       for taxon in lineage]
+
+        return cls(genome_ids, taxa, list(taxon_index.keys()))
+
+    def subset(self, genome_ids, default=Taxonomy.rank_prefixes):
+        """Get taxonomy for a set of genomes.
+
+        Parameters
+        ----------
+        genome_ids : iterable
+            Genomes to include in order.
+        default : list
+            Taxonomy of genomes absent from this store.
+
+        Returns
+        -------
+        TaxonomyStore
+            Taxonomy of the specified genomes.
+        """
+
+        genome_ids = list(genome_ids)
+        taxon_names = list(self.taxon_names)
+        taxon_index = dict(self.taxon_index)
+
+        default_taxa = np.full(self.taxa.shape[1], -1, dtype=np.int32)
+        default_taxa[0:len(default)] = [taxon_index.setdefault(taxon, len(taxon_index))
+                                        for taxon in default]
+        taxon_names += list(taxon_index.keys())[len(taxon_names):]
+
+        rows = np.array([self.genome_index.get(genome_id, -1) for genome_id in genome_ids],
+                        dtype=np.int64)
+        taxa = np.vstack((self.taxa, default_taxa))[rows]
+
+        return TaxonomyStore(genome_ids, taxa, taxon_names)
+
+    def __len__(self):
+        """Number of genomes."""
+
+        return len(self.genome_ids)
+
+    def __contains__(self, genome_id):
+        """Check if genome is in taxonomy."""
+
+        return genome_id in self.genome_index
+
+    def __iter__(self):
+        """Iterate over genome IDs."""
+
+        return iter(self.genome_ids)
+
+    def __getitem__(self, genome_id):
+        """Get taxa for a genome in rank order."""
+
+        return self.lineage(self.genome_index[genome_id])
+
+    def get(self, genome_id, default=None):
+        """Get taxa for a genome, or default if the genome is not present."""
+
+        i = self.genome_index.get(genome_id)
+        if i is None:
+            return default
+
+        return self.lineage(i)
+
+    def keys(self):
+        """Get genome IDs."""
+
+        return list(self.genome_ids)
+
+    def values(self):
+        """Get taxa for each genome."""
+
+        return [self.lineage(i) for i in range(len(self.genome_ids))]
+
+    def items(self):
+        """Get genome IDs and taxa for each genome."""
+
+        return list(zip(self.genome_ids, self.values()))
+
+    def lineage(self, genome_index):
+        """Get taxa for a genome in rank order.
+
+        Parameters
+        ----------
+        genome_index : int
+            Index of genome.
+
+        Returns
+        -------
+        list
+            Taxa for genome.
+        """
+
+        return [self.taxon_names[t] for t in self.taxa[genome_index].tolist() if t >= 0]
+
+    def extant_genomes(self, taxon):
+        """Get indices of genomes within a taxon.
+
+        Parameters
+        ----------
+        taxon : str
+            Named taxonomic group.
+
+        Returns
+        -------
+        ndarray
+            Indices of genomes in ascending order.
+        """
+
+        t = self.taxon_index.get(taxon)
+        if t is None:
+            return self.extant_index[0:0]
+
+        return self.extant_index[self.extant_ptr[t]:self.extant_ptr[t + 1]]
+
+    def children(self, taxon):
+        """Get children of a taxon.
+
+        For species, this is the extant taxa. For higher ranks,
+        this is named groups at the following rank.
+
+        Parameters
+        ----------
+        taxon : str
+            Named taxonomic group.
+
+        Returns
+        -------
+        list
+            Children of taxon.
+        """
+
+        t = self.taxon_index.get(taxon)
+        if t is None:
+            return []
+
+        if self.taxon_rank[t] == Taxonomy.rank_index['s__']:
+            return [self.genome_ids[g] for g in self.extant_genomes(taxon).tolist()]
+
+        return [self.taxon_names[c] for c in self.child_index[self.child_ptr[t]:self.child_ptr[t + 1]].tolist()]
+
+    def parents(self, taxon):
+        """Get parent taxa of a taxon.
+
+        Parameters
+        ----------
+        taxon : str
+            Taxonomic group.
+
+        Returns
+        -------
+        list
+            Parent taxa in rank order.
+        """
+
+        t = self.taxon_index.get(taxon)
+        if t is None:
+            return []
+
+        if self.taxon_genome[t] < 0:
+            return []
+
+        lineage = self.taxa[self.taxon_genome[t]].tolist()
+        return [self.taxon_names[p] for p in lineage[0:lineage.index(t)]]
+
+    def extant_taxa_for_rank(self, rank_index):
+        """Get extant taxa for all named groups at the specified rank.
+
+        Parameters
+        ----------
+        rank_index : int
+            Index of rank.
+
+        Returns
+        -------
+        dict : d[taxon] -> ndarray
+            Indices of genomes in each named group at the specified rank.
+        """
+
+        d = {}
+        for t in self.named_lineages_at_rank(rank_index, as_index=True).tolist():
+            d[self.taxon_names[t]] = self.extant_index[self.extant_ptr[t]:self.extant_ptr[t + 1]]
+
+        return d
+
+    def named_lineages_at_rank(self, rank_index, as_index=False):
+        """Get named lineages at a taxonomic rank.
+
+        Parameters
+        ----------
+        rank_index : int
+            Index of rank.
+        as_index : boolean
+            Flag indicating if taxa should be given as indices.
+
+        Returns
+        -------
+        list
+            Taxa in order of first appearance.
+        """
+
+        taxa = np.flatnonzero((self.taxon_rank == rank_index)
+                              & self.is_named[:-1]
+                              & (self.extant_ptr[1:] > self.extant_ptr[:-1]))
+        if as_index:
+            return taxa
+
+        return [self.taxon_names[t] for t in taxa.tolist()]
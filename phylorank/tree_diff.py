@@ -16,15 +16,16 @@
 ###############################################################################
 
 import os
-import sys
 import logging
 from collections import defaultdict
 
-from phylorank.newick import parse_label
+import numpy as np
+
+from phylorank.newick import parse_taxon_label
+from phylorank.common import read_compact_tree
 
 from biolib.taxonomy import Taxonomy
 
-import dendropy
 
 
 class TreeDiff():
@@ -36,7 +37,183 @@ class TreeDiff():
     def __init__(self, dpi=96):
         """Initialize."""
         self.logger = logging.getLogger()
-  
+
+    def _leaf_keys(self, compact_tree, taxon_keys):
+        """Get key of each node for hashing clades.
+
+        Parameters
+        ----------
+        compact_tree : CompactTree
+            Compact representation of tree.
+        taxon_keys : d[taxon label] -> int
+            Random 64-bit key of each taxon.
+
+        Returns
+        -------
+        ndarray
+            Key of each leaf node, with 0 for internal nodes.
+        """
+
+        leaf_keys = np.zeros(compact_tree.num_nodes, dtype=np.uint64)
+        for i in np.flatnonzero(compact_tree.is_leaf).tolist():
+            leaf_keys[i] = taxon_keys[compact_tree.taxa[i]]
+
+        return leaf_keys
+
+    def _leaf_taxa(self, compact_tree, node_index):
+        """Get labels of taxa below a node."""
+
+        return set([compact_tree.taxa[i] for i in compact_tree.leaves(node_index).tolist()])
+
+    def _splits(self, compact_tree, clade_hash):
+        """Get non-trivial bipartitions induced by the internal nodes of a tree.
+
+        Bipartitions are keyed on the smaller of the hashes of the
+        two sides of the split so they are independent of rooting.
+
+        Parameters
+        ----------
+        compact_tree : CompactTree
+            Compact representation of tree.
+        clade_hash : ndarray
+            Hash of leaves below each node.
+
+        Returns
+        -------
+        d[split hash] -> [support, num_taxa, node index]
+            Bipartitions with the support (-1 if absent) and size of the clade inducing them.
+        """
+
+        total_taxa = int(compact_tree.num_taxa[0])
+        tree_hash = clade_hash[0]
+        split_hash = np.minimum(clade_hash, clade_hash ^ tree_hash).tolist()
+        num_taxa = compact_tree.num_taxa.tolist()
+
+        splits = {}
+        for n in np.flatnonzero(~compact_tree.is_leaf[1:]).tolist():
+            n += 1
+            if num_taxa[n] > total_taxa - 2:
+                continue
+
+            support = parse_taxon_label(compact_tree.labels[n]).support
+            support = int(support) if support is not None else -1
+
+            # both children of a bifurcating root induce the same split
+            h = split_hash[n]
+            if h not in splits or support > splits[h][0]:
+                splits[h] = [support, num_taxa[n], n]
+
+        return splits
+
+    def _clade_diff(self, compact_tree1, compact_tree2, splits1, splits2,
+                        tree1_name, tree2_name, output_dir, min_support, min_taxa):
+        """Compare all supported clades between two trees.
+
+        Parameters
+        ----------
+        compact_tree1 : CompactTree
+            First tree.
+        compact_tree2 : CompactTree
+            Second tree.
+        splits1 : d[split hash] -> [support, num_taxa, node index]
+            Bipartitions of the first tree.
+        splits2 : d[split hash] -> [support, num_taxa, node index]
+            Bipartitions of the second tree.
+        tree1_name : str
+            Name of first tree.
+        tree2_name : str
+            Name of second tree.
+        output_dir : str
+            Output directory.
+        min_support : float
+            Minimum value to consider a lineage well supported.
+        min_taxa : int
+            Only consider lineage with sufficient number of taxa.
+        """
+
+        classification_file = os.path.join(output_dir, 'clade_classification.tsv')
+        fout = open(classification_file, 'w')
+        fout.write('Tree\tTaxon\tNo. Taxa\tFirst Taxon\tLast Taxon\tSupport\tClassification\tSupport in Other Tree\n')
+
+        stats = {}
+        for compact_tree, splits, other_splits, tree_name in ([compact_tree1, splits1, splits2, tree1_name],
+                                                              [compact_tree2, splits2, splits1, tree2_name]):
+            # leaves below a node are a contiguous block in preorder, so
+            # the first leaf is the first leaf at or after the node and
+            # the last leaf is the last node in its subtree
+            leaf_indices = np.flatnonzero(compact_tree.is_leaf)
+            counts = defaultdict(int)
+            weighted = defaultdict(float)
+            for h, (support, num_taxa, n) in splits.items():
+                if support < min_support or num_taxa < min_taxa:
+                    continue
+
+                # congruent: clade supported in both trees
+                # unresolved: clade present, but poorly supported in other tree
+                # incongruent: clade absent from other tree
+                other_support = -1
+                if h in other_splits:
+                    other_support = other_splits[h][0]
+                    if other_support >= min_support:
+                        classification = 'congruent'
+                    else:
+                        classification = 'unresolved'
+                else:
+                    classification = 'incongruent'
+
+                counts[classification] += 1
+                weighted[classification] += support
+
+                taxon_name = parse_taxon_label(compact_tree.labels[n]).taxon
+                first_leaf = leaf_indices[np.searchsorted(leaf_indices, n)]
+                last_leaf = n + compact_tree.subtree_size[n] - 1
+                fout.write('%s\t%s\t%d\t%s\t%s\t%d\t%s\t%d\n' % (tree_name,
+                                                                taxon_name if taxon_name else 'NA',
+                                                                num_taxa,
+                                                                compact_tree.taxa[first_leaf],
+                                                                compact_tree.taxa[last_leaf],
+                                                                support,
+                                                                classification,
+                                                                other_support))
+
+            stats[tree_name] = (counts, weighted)
+        fout.close()
+
+        # Robinson-Foulds distance over all bipartitions
+        # and over well-supported bipartitions
+        rf = len(set(splits1).symmetric_difference(splits2))
+        max_rf = len(splits1) + len(splits2)
+
+        supported1 = set([h for h, (support, _, _) in splits1.items() if support >= min_support])
+        supported2 = set([h for h, (support, _, _) in splits2.items() if support >= min_support])
+        supported_rf = len(supported1 - set(splits2)) + len(supported2 - set(splits1))
+
+        stats_file = os.path.join(output_dir, 'tree_diff_stats.tsv')
+        fout = open(stats_file, 'w')
+        fout.write('Tree\tSupported\tCongruent\tUnresolved\tIncongruent\tWeighted Incongruent (%)\n')
+        for tree_name in [tree1_name, tree2_name]:
+            counts, weighted = stats[tree_name]
+            num_supported = sum(counts.values())
+            total_support = sum(weighted.values())
+            weighted_incongruent = 0.0
+            if total_support > 0:
+                weighted_incongruent = weighted['incongruent'] * 100.0 / total_support
+
+            fout.write('%s\t%d\t%d\t%d\t%d\t%.2f\n' % (tree_name,
+                                                        num_supported,
+                                                        counts['congruent'],
+                                                        counts['unresolved'],
+                                                        counts['incongruent'],
+                                                        weighted_incongruent))
+
+        fout.write('\n')
+        fout.write('Robinson-Foulds distance\t%d\n' % rf)
+        fout.write('Normalized Robinson-Foulds distance\t%.4f\n' % (float(rf) / max_rf if max_rf else 0.0))
+        fout.write('Supported Robinson-Foulds distance\t%d\n' % supported_rf)
+        fout.close()
+
+        self.logger.info('Robinson-Foulds distance between trees: %d (%.4f normalized).'
+                            % (rf, float(rf) / max_rf if max_rf else 0.0))
   
     def run(self, tree1_file, tree2_file, output_dir, min_support, min_taxa, named_only):
         """Calculate supported topological differences between trees.
@@ -54,52 +231,59 @@ class TreeDiff():
         min_taxa : int
             Only consider lineage with sufficient number of taxa.
         named_only : boolean
-            Only consider named lineages.  
+            Only consider named lineages; otherwise all bootstrap supported clades are compared.  
         """
         
-        if not named_only:
-            self.logger.error("This command currently assumes the 'named_only' flag will be thrown.")
-            sys.exit()
-            
         tree1_name = os.path.splitext(os.path.basename(tree1_file))[0]
         tree2_name = os.path.splitext(os.path.basename(tree2_file))[0]
         
-        tree1 = dendropy.Tree.get_from_path(tree1_file, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree1 = read_compact_tree(tree1_file)
                                             
-        tree2 = dendropy.Tree.get_from_path(tree2_file, 
-                                            schema='newick', 
-                                            rooting='force-rooted', 
-                                            preserve_underscores=True)
+        tree2 = read_compact_tree(tree2_file)
         
         # prune both trees to the set of common taxa
-        taxa1 = set()
-        for t in tree1.leaf_node_iter():
-            taxa1.add(t.taxon.label)
-            
-        taxa2 = set()
-        for t in tree2.leaf_node_iter():
-            taxa2.add(t.taxon.label)
+        taxa1 = set([tree1.taxa[i] for i in np.flatnonzero(tree1.is_leaf).tolist()])
+        taxa2 = set([tree2.taxa[i] for i in np.flatnonzero(tree2.is_leaf).tolist()])
+        taxa1.discard(None)
+        taxa2.discard(None)
             
         taxa_in_common = taxa1.intersection(taxa2)
         self.logger.info('Tree 1 contains %d taxa.' % len(taxa1))
         self.logger.info('Tree 2 contains %d taxa.' % len(taxa2))
         self.logger.info('Pruning trees to the %d taxa in common.' % len(taxa_in_common))
         
-        tree1.retain_taxa_with_labels(taxa_in_common)
-        tree2.retain_taxa_with_labels(taxa_in_common)
+        compact_tree1 = tree1.prune(np.array([t in taxa_in_common for t in tree1.taxa], dtype=bool))
+        compact_tree2 = tree2.prune(np.array([t in taxa_in_common for t in tree2.taxa], dtype=bool))
+        
+        # hash the extant taxa of each clade using a random
+        # key for each taxon shared between the trees
+        rng = np.random.RandomState(1)
+        keys = rng.randint(1, np.iinfo(np.int64).max, size=len(taxa_in_common), dtype=np.int64)
+        taxon_keys = dict(zip(sorted(taxa_in_common), keys.astype(np.uint64)))
+
+        clade_hash1 = compact_tree1.clade_hashes(self._leaf_keys(compact_tree1, taxon_keys))
+        clade_hash2 = compact_tree2.clade_hashes(self._leaf_keys(compact_tree2, taxon_keys))
+
+        if not named_only:
+            splits1 = self._splits(compact_tree1, clade_hash1)
+            splits2 = self._splits(compact_tree2, clade_hash2)
+            self.logger.info('Tree 1 has %d non-trivial bipartitions.' % len(splits1))
+            self.logger.info('Tree 2 has %d non-trivial bipartitions.' % len(splits2))
+
+            self._clade_diff(compact_tree1, compact_tree2, splits1, splits2,
+                                tree1_name, tree2_name, output_dir, min_support, min_taxa)
+            return
         
         # identify nodes meeting specified criteria
         tree1_nodes = {}
         tree2_nodes = {}
         node_support1 = {}
         node_support2 = {}
-        for tree, tree_nodes, support_values in ([tree1, tree1_nodes, node_support1],[tree2, tree2_nodes, node_support2]):
-            for n in tree.preorder_internal_node_iter():
-                support, taxon_name, _auxiliary_info = parse_label(n.label)
-                if named_only and not taxon_name:
+        for compact_tree, tree_nodes, support_values in ([compact_tree1, tree1_nodes, node_support1],
+                                                         [compact_tree2, tree2_nodes, node_support2]):
+            for n in np.flatnonzero(~compact_tree.is_leaf).tolist():
+                support, taxon_name = parse_taxon_label(compact_tree.labels[n])[0:2]
+                if not taxon_name:
                     continue
                     
                 if not support:
@@ -108,7 +292,7 @@ class TreeDiff():
                 support = int(support)
                 support_values[taxon_name] = support
                 
-                num_taxa = sum([1 for _ in n.leaf_iter()])
+                num_taxa = int(compact_tree.num_taxa[n])
                 if support >= min_support and num_taxa >= min_taxa:
                     tree_nodes[taxon_name] = [support, num_taxa, n]
                     
@@ -129,12 +313,13 @@ class TreeDiff():
             if taxon in tree2_nodes:
                 support2, num_taxa2, node2 = tree2_nodes[taxon]
                 
-                taxa1 = set([t.taxon.label for t in node1.leaf_iter()])
-                taxa2 = set([t.taxon.label for t in node2.leaf_iter()])
-                
-                diff_taxa = taxa1.symmetric_difference(taxa2)
+                # extant taxa only need to be determined
+                # for clades which differ between the trees
+                if num_taxa1 != num_taxa2 or clade_hash1[node1] != clade_hash2[node2]:
+                    taxa1 = self._leaf_taxa(compact_tree1, node1)
+                    taxa2 = self._leaf_taxa(compact_tree2, node2)
+                    diff_taxa = taxa1.symmetric_difference(taxa2)
                 
-                if len(diff_taxa) > 0:
                     diffs[taxon] = [len(diff_taxa), ','.join(taxa1 - taxa2), ','.join(taxa2- taxa1)]
                     incongruent_taxa[rank_index].append((taxon, len(diff_taxa)))
                 else:
@@ -144,8 +329,10 @@ class TreeDiff():
                 
         # identify unresolved taxa in tree 2
         for taxon, data2 in tree2_nodes.items():
-            support2, num_taxa2, node2 = data1
+            support2, num_taxa2, node2 = data2
             if taxon not in tree1_nodes:
+                most_specific_taxon = taxon.split(';')[-1].strip()
+                rank_index = Taxonomy.rank_prefixes.index(most_specific_taxon[0:3])
                 unresolved_taxa[rank_index].append((taxon, tree2_name, support2, tree1_name, node_support1.get(taxon, -1)))
         
         # write out difference in extant taxa for incongruent taxa
@@ -0,0 +1,95 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""Time decoration of trees with relative divergence.
+
+Reports the time taken by RelativeDistance.decorate_rel_dist on
+caterpillar and balanced trees of increasing size, so its scaling
+with the number of taxa can be checked.
+"""
+
+import time
+import random
+import argparse
+
+import dendropy
+
+from phylorank.rel_dist import RelativeDistance
+
+
+def caterpillar_tree(num_taxa, rng):
+    """Create tree where each internal node has a leaf child."""
+
+    tree = dendropy.Tree(is_rooted=True)
+    node = tree.seed_node
+    for i in range(num_taxa - 1):
+        leaf = node.new_child(edge_length=rng.random())
+        leaf.taxon = tree.taxon_namespace.new_taxon('T%d' % i)
+        node = node.new_child(edge_length=rng.random())
+    node.taxon = tree.taxon_namespace.new_taxon('T%d' % (num_taxa - 1))
+
+    return tree
+
+
+def balanced_tree(num_taxa, rng):
+    """Create tree where each internal node divides its taxa evenly."""
+
+    tree = dendropy.Tree(is_rooted=True)
+    stack = [(tree.seed_node, num_taxa)]
+    taxon_id = 0
+    while stack:
+        node, n = stack.pop()
+        if n == 1:
+            node.taxon = tree.taxon_namespace.new_taxon('T%d' % taxon_id)
+            taxon_id += 1
+            continue
+
+        for child_taxa in (n // 2, n - n // 2):
+            stack.append((node.new_child(edge_length=rng.random()), child_taxa))
+
+    return tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 2000, 4000, 8000, 16000],
+                        help='number of taxa in each tree')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='report fastest of this many runs')
+    args = parser.parse_args()
+
+    rd = RelativeDistance()
+    rng = random.Random(1)
+
+    print('Taxa\tCaterpillar (s)\tBalanced (s)')
+    for num_taxa in args.sizes:
+        times = []
+        for create_tree in (caterpillar_tree, balanced_tree):
+            tree = create_tree(num_taxa, rng)
+            best = float('inf')
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                rd.decorate_rel_dist(tree)
+                best = min(best, time.perf_counter() - start)
+            times.append(best)
+
+        print('%d\t%.3f\t%.3f' % (num_taxa, times[0], times[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from phylorank.newick import read_newick
+
+
+class TestReadNewick(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read_all_chunk_sizes(self, newick):
+        """Read tree with every chunk size and check all reads agree."""
+
+        tree_file = os.path.join(self.tmp_dir, 'tree.tree')
+        with open(tree_file, 'w') as fout:
+            fout.write(newick)
+
+        tree = read_newick(tree_file)
+        for chunk_size in range(1, len(newick) + 1):
+            chunk_tree = read_newick(tree_file, chunk_size)
+            self.assertEqual(chunk_tree.parent.tolist(), tree.parent.tolist())
+            self.assertEqual(chunk_tree.edge_length.tolist(), tree.edge_length.tolist())
+            self.assertEqual(chunk_tree.labels, tree.labels)
+            self.assertEqual(chunk_tree.taxa, tree.taxa)
+
+        return tree
+
+    def test_bracket_in_quoted_label(self):
+        tree = self._read_all_chunk_sizes("((A:1,B:2)'x [y':1,(C:1,D:1)90:2);")
+        self.assertEqual(tree.labels[1], 'x [y')
+        self.assertEqual(tree.taxa, [None, None, 'A', 'B', None, 'C', 'D'])
+
+    def test_quote_in_comment(self):
+        tree = self._read_all_chunk_sizes("[it's rooted]((A:1,'B''s':2)x:1,C:2);")
+        self.assertEqual(tree.labels[1], 'x')
+        self.assertEqual(tree.taxa, [None, None, 'A', "B's", 'C'])
+
+
+if __name__ == '__main__':
+    unittest.main()